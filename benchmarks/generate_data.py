@@ -0,0 +1,166 @@
+# Author:      CD4ML Working Group @ D ONE
+# Description: Generates synthetic wind turbine data of any size with the schema
+#              and the partition layout of the raw data in data/batch* (one file
+#              per day in <output_folder>/<year>/<month>/<day>.csv). Every day is
+#              generated independently from its own seed, so days are written in
+#              parallel and the output does not depend on the number of workers.
+# ================================================================================
+
+import argparse
+import json
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import logging
+
+logger = logging.getLogger(__name__)
+
+_columns = ['wt_sk', 'measured_at', 'wind_speed', 'power', 'nacelle_direction',
+            'wind_direction', 'rotor_speed', 'generator_speed', 'temp_environment',
+            'temp_hydraulic_oil', 'temp_gear_bearing', 'cosphi', 'blade_angle_avg',
+            'hydraulic_pressure', 'subtraction', 'categories_sk']
+
+# error categories and their frequencies in data/batch1
+_categories = np.array([5, 20, 3, 24, 22, 19, 0, 7, 8])
+_category_probabilities = np.array([0.86, 0.08, 0.02, 0.01, 0.01, 0.005, 0.005, 0.005, 0.005])
+
+
+def _day_frame(day, n_turbines, interval_minutes, error_rate, utc_offset, seed):
+    """generates the measurements of all turbines for one day, sorted by turbine and time"""
+    rng = np.random.default_rng([seed, day.toordinal()])
+    n_steps = 24 * 60 // interval_minutes
+    n_rows = n_turbines * n_steps
+    shape = (n_turbines, n_steps)
+
+    # slowly varying wind per turbine: random walk around a daily mean
+    mean_wind = rng.weibull(2.0, size=(n_turbines, 1)) * 0.6
+    wind_speed = np.clip(mean_wind + np.cumsum(rng.normal(0, 0.03, shape), axis=1), 0, 2)
+    power = 1 / (1 + np.exp(-8 * (wind_speed - 0.6))) - 0.01 + rng.normal(0, 0.01, shape)
+    wind_direction = (rng.uniform(0, 360, size=(n_turbines, 1))
+                      + np.cumsum(rng.normal(0, 2, shape), axis=1)) % 360
+    time_of_day = np.arange(n_steps) / n_steps
+    temp_environment = (7.5 + 4 * np.sin(2 * np.pi * (time_of_day - 0.375))
+                        + rng.normal(0, 0.5, shape))
+
+    # errors change the behaviour of the turbine, e.g. curtailment (5) or overheating (20)
+    is_error = rng.random(shape) < error_rate
+    categories = np.where(is_error, rng.choice(_categories, size=shape, p=_category_probabilities), np.nan)
+    power = np.where(categories == 5, power * 0.2, power)
+    power = np.clip(power, -0.02, 1.01)
+
+    rotor_speed = np.clip(0.3 + 0.7 * power + rng.normal(0, 0.02, shape), 0, 1.01)
+    frame = {
+        'wt_sk': np.repeat(np.arange(1, n_turbines + 1), n_steps),
+        'measured_at': None,
+        'wind_speed': wind_speed,
+        'power': power,
+        'nacelle_direction': wind_direction + rng.normal(0, 3, shape),
+        'wind_direction': wind_direction,
+        'rotor_speed': rotor_speed,
+        'generator_speed': rotor_speed * 0.84,
+        'temp_environment': temp_environment,
+        'temp_hydraulic_oil': 25 + 5 * power + rng.normal(0, 0.5, shape),
+        'temp_gear_bearing': (35 + 15 * power + rng.normal(0, 1, shape)
+                              + np.where(categories == 20, 20, 0)),
+        'cosphi': np.clip(0.85 + 0.15 * power + rng.normal(0, 0.02, shape), 0, 1.01),
+        'blade_angle_avg': np.where(power < 0.05, 85 + rng.normal(0, 3, shape),
+                                    rng.normal(-0.5, 1, shape)),
+        'hydraulic_pressure': 190 + rng.normal(0, 1, shape),
+        'subtraction': np.where(is_error, (rng.random(shape) < 0.88).astype(float), np.nan),
+        'categories_sk': categories,
+    }
+    frame = {col: (values.reshape(n_rows) if isinstance(values, np.ndarray) else values)
+             for col, values in frame.items()}
+
+    times = pd.date_range(day, periods=n_steps, freq=f'{interval_minutes}min')
+    times = times.strftime(f'%Y-%m-%d %H:%M:%S.0000000 {utc_offset}')
+    frame['measured_at'] = np.tile(np.asarray(times), n_turbines)
+    return pd.DataFrame(frame, columns=_columns)
+
+
+def _write_day(output_folder, day, output_format, **kwargs):
+    """generates and writes the partition of one day, returns its number of rows"""
+    df = _day_frame(day, **kwargs)
+    folder = os.path.join(output_folder, str(day.year), str(day.month))
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, f"{day.day}.{output_format}")
+    if output_format == 'csv':
+        df.to_csv(path, index=False)
+    else:
+        df.to_parquet(path, index=False, compression='zstd')
+    return len(df)
+
+
+def generate_data(output_folder, n_rows=1_000_000, n_turbines=4, start_date='2020-01-01',
+                  interval_minutes=10, error_rate=0.05, utc_offset='+01:00', output_format='csv',
+                  n_workers=None, seed=0):
+    """
+    Generates synthetic turbine data partitioned by day
+
+    Args:
+        output_folder (str): root folder of the partitions
+        n_rows (int): minimum number of rows, rounded up to whole days
+        n_turbines (int): number of turbines (wt_sk 1..n_turbines)
+        start_date (str): date of the first partition
+        interval_minutes (int): time between two measurements of a turbine
+        error_rate (float): share of rows with an error category
+        utc_offset (str): utc offset appended to the timestamps
+        output_format (str): 'csv' or 'parquet'
+        n_workers (Optional[int]): number of processes writing days in parallel
+        seed (int): seed of the random generator
+
+    Returns:
+        dict: the configuration and the number of rows and days written
+    """
+    if output_format not in ('csv', 'parquet'):
+        raise ValueError(f'output_format must be "csv" or "parquet", got "{output_format}"')
+    rows_per_day = n_turbines * (24 * 60 // interval_minutes)
+    n_days = math.ceil(n_rows / rows_per_day)
+    days = pd.date_range(start_date, periods=n_days, freq='D')
+    day_kwargs = dict(n_turbines=n_turbines, interval_minutes=interval_minutes,
+                      error_rate=error_rate, utc_offset=utc_offset, seed=seed)
+
+    with ProcessPoolExecutor(max_workers=n_workers) as pool:
+        futures = [pool.submit(_write_day, output_folder, day, output_format, **day_kwargs)
+                   for day in days]
+        n_written = sum(future.result() for future in futures)
+
+    config = {
+        'n_rows': n_written,
+        'n_days': n_days,
+        'n_turbines': n_turbines,
+        'start_date': start_date,
+        'interval_minutes': interval_minutes,
+        'error_rate': error_rate,
+        'output_format': output_format,
+        'seed': seed,
+    }
+    # not a partition, ingest_data only reads .csv and .parquet files
+    with open(os.path.join(output_folder, '_generator.json'), 'w') as f:
+        json.dump(config, f, indent=4)
+    logger.info(f"wrote {n_written} rows in {n_days} daily partitions to {output_folder}")
+    return config
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description='Generate synthetic turbine data')
+    parser.add_argument('--output_folder', type=str, help='Output folder')
+    parser.add_argument('--n_rows', type=int, default=1_000_000,
+                        help='Number of rows, rounded up to whole days')
+    parser.add_argument('--n_turbines', type=int, default=4, help='Number of turbines')
+    parser.add_argument('--start_date', type=str, default='2020-01-01', help='First day')
+    parser.add_argument('--interval_minutes', type=int, default=10,
+                        help='Minutes between two measurements')
+    parser.add_argument('--error_rate', type=float, default=0.05,
+                        help='Share of rows with an error category')
+    parser.add_argument('--output_format', type=str, default='csv', help='"csv" or "parquet"')
+    parser.add_argument('--n_workers', type=int, help='Number of parallel processes')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+
+    args = parser.parse_args()
+    generate_data(args.output_folder, args.n_rows, args.n_turbines, args.start_date,
+                  args.interval_minutes, args.error_rate, output_format=args.output_format,
+                  n_workers=args.n_workers, seed=args.seed)
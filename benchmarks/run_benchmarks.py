@@ -0,0 +1,331 @@
+# Author:      CD4ML Working Group @ D ONE
+# Description: Runs the stages of the CI pipeline outside of Airflow on a data
+#              folder (e.g. created with generate_data.py) and records wall time,
+#              CPU time, peak RSS and rows/sec of every stage in a json report.
+#              Every stage runs in a fresh process, so its peak memory is not
+#              hidden by a previous stage. A report can be compared with the
+#              report of another commit to catch regressions.
+# ================================================================================
+
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess as sp
+import sys
+import time
+from datetime import datetime
+import logging
+
+logger = logging.getLogger(__name__)
+
+_root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_plugins_dir = os.path.join(_root_dir, 'plugins')
+
+_stages = ['ingest_data', 'split_train_test', 'validate_data', 'transform_data',
+           'train_model', 'validate_model']
+
+# data files whose rows a stage processes
+_stage_rows = {
+    'ingest_data': ['raw_data_file'],
+    'split_train_test': ['raw_data_file'],
+    'validate_data': ['raw_train_file', 'raw_test_file'],
+    'transform_data': ['raw_train_file', 'raw_test_file'],
+    'train_model': ['transformed_x_train_file'],
+    'validate_model': ['transformed_x_test_file'],
+}
+
+# metrics compared with the baseline, higher is worse
+_compared_metrics = ['wall_s', 'cpu_s', 'peak_rss_mb']
+
+
+def get_data_files(workdir, data_format='csv'):
+    """the data files of the pipeline within 'workdir' (as in dags/ci_dag.py)"""
+    return {
+        'raw_data_file': os.path.join(workdir, 'data.csv'),
+        'raw_train_file': os.path.join(workdir, f'data_train.{data_format}'),
+        'raw_test_file': os.path.join(workdir, f'data_test.{data_format}'),
+        'transformed_x_train_file': os.path.join(workdir, f'x_train.{data_format}'),
+        'transformed_y_train_file': os.path.join(workdir, f'y_train.{data_format}'),
+        'transformed_x_test_file': os.path.join(workdir, f'x_test.{data_format}'),
+        'transformed_y_test_file': os.path.join(workdir, f'y_test.{data_format}'),
+        'feature_transformer_file': os.path.join(workdir, 'feature_transformer.json'),
+    }
+
+
+class _TaskInstance:
+    """stand-in for the airflow task instance, returns the return values of previous stages"""
+
+    def __init__(self, xcom_file):
+        self.xcom_file = xcom_file
+
+    def xcom_pull(self, task_ids):
+        with open(self.xcom_file, 'r') as f:
+            return json.load(f)[task_ids]
+
+
+def _peak_rss_mb():
+    """peak resident set size of this process"""
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macos
+    return max_rss / 1024 ** 2 if sys.platform == 'darwin' else max_rss / 1024
+
+
+def _cpu_s():
+    """user and system cpu time of this process and its finished children"""
+    usage = [resource.getrusage(who) for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN)]
+    return sum(u.ru_utime + u.ru_stime for u in usage)
+
+
+def _run_stage(stage, config):
+    """runs a single stage in this process and returns its measurements"""
+    sys.path.insert(0, _plugins_dir)
+    workdir = config['workdir']
+    data_files = get_data_files(workdir, config['data_format'])
+    xcom_file = os.path.join(workdir, 'xcom.json')
+
+    if stage == 'ingest_data':
+        from cd4ml.data_processing import ingest_data
+        call = lambda: ingest_data(config['data_folder'], data_files, engine=config['engine'],
+                                   n_workers=config['n_workers'])
+    elif stage == 'split_train_test':
+        from cd4ml.data_processing import split_train_test
+        call = lambda: split_train_test(data_files, n_days_test=config['n_days_test'],
+                                        chunksize=config['chunksize'])
+    elif stage == 'validate_data':
+        from cd4ml.data_processing import validate_data
+        call = lambda: validate_data(data_files, workdir, chunksize=config['chunksize'])
+    elif stage == 'transform_data':
+        from cd4ml.data_processing import transform_data
+        call = lambda: transform_data(data_files)
+    elif stage == 'train_model':
+        from cd4ml.model_training import train_model
+        call = lambda: train_model(data_files, experiment_name='benchmark')
+    elif stage == 'validate_model':
+        from cd4ml.model_validation import validate_model
+        call = lambda: validate_model(data_files, model='benchmark_model',
+                                      task_instance=_TaskInstance(xcom_file))
+    else:
+        raise ValueError(f'unknown stage "{stage}", expected one of {_stages}')
+
+    rss_before = _peak_rss_mb()
+    cpu_start, start = _cpu_s(), time.perf_counter()
+    return_value = call()
+    wall_s, cpu_s = time.perf_counter() - start, _cpu_s() - cpu_start
+
+    if stage == 'train_model':
+        xcom = {}
+        if os.path.isfile(xcom_file):
+            with open(xcom_file, 'r') as f:
+                xcom = json.load(f)
+        xcom['model_training'] = list(return_value)
+        with open(xcom_file, 'w') as f:
+            json.dump(xcom, f)
+
+    return {
+        'wall_s': round(wall_s, 3),
+        'cpu_s': round(cpu_s, 3),
+        'peak_rss_mb': round(_peak_rss_mb(), 1),
+        'rss_before_mb': round(rss_before, 1),
+    }
+
+
+def count_rows(path):
+    """number of rows of a data file, without loading it"""
+    if path.endswith(('.parquet', '.pq')):
+        import pyarrow.parquet as pq
+        return pq.ParquetFile(path).metadata.num_rows
+    if path.endswith(('.feather', '.arrow')):
+        import pyarrow.feather as feather
+        return feather.read_table(path, memory_map=True).num_rows
+    n_lines = 0
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            n_lines += block.count(b'\n')
+    return max(n_lines - 1, 0)
+
+
+def _git_commit():
+    """the current commit of the repository, None outside of git"""
+    result = sp.run(['git', 'rev-parse', 'HEAD'], cwd=_root_dir, capture_output=True, text=True)
+    return result.stdout.strip() if result.returncode == 0 else None
+
+
+def run_benchmarks(data_folder, workdir, stages=None, engine='pandas', n_workers=None,
+                   n_days_test=20, chunksize=None, data_format='csv'):
+    """
+    Runs the stages one after the other, each in a fresh python process
+
+    Args:
+        data_folder (str): partitioned raw data, e.g. created with generate_data.py
+        workdir (str): location of the pipeline data files and the mlflow store
+        stages (Optional[List[str]]): stages to run (in pipeline order), default all
+        engine (str): engine of ingest_data, 'pandas' or 'pyarrow'
+        n_workers (Optional[int]): number of parallel readers of ingest_data
+        n_days_test (int): number of test days of split_train_test
+        chunksize (Optional[int]): chunk size of split_train_test and validate_data
+        data_format (str): format of the intermediate data files
+
+    Returns:
+        dict: the report with the measurements of every stage
+    """
+    stages = [stage for stage in _stages if stage in (stages or _stages)]
+    os.makedirs(workdir, exist_ok=True)
+    workdir = os.path.abspath(workdir)
+    config = {
+        'data_folder': os.path.abspath(data_folder),
+        'workdir': workdir,
+        'engine': engine,
+        'n_workers': n_workers,
+        'n_days_test': n_days_test,
+        'chunksize': chunksize,
+        'data_format': data_format,
+    }
+    config_file = os.path.join(workdir, 'benchmark_config.json')
+    with open(config_file, 'w') as f:
+        json.dump(config, f, indent=4)
+
+    # cached data profiles and configs would make validate_data faster on reruns
+    for path in [os.path.join(workdir, 'data_config.json')]:
+        if os.path.isfile(path):
+            os.remove(path)
+    profiles_dir = os.path.join(workdir, 'profiles')
+    if os.path.isdir(profiles_dir):
+        for name in os.listdir(profiles_dir):
+            os.remove(os.path.join(profiles_dir, name))
+
+    env = dict(os.environ, MLFLOW_TRACKING_URI=f"sqlite:///{os.path.join(workdir, 'mlflow.db')}")
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [_plugins_dir, env.get('PYTHONPATH')]))
+    data_files = get_data_files(workdir, data_format)
+
+    results = {}
+    for stage in stages:
+        logger.info(f"running {stage}")
+        result_file = os.path.join(workdir, f'benchmark_{stage}.json')
+        process = sp.run([sys.executable, os.path.abspath(__file__), '--run_stage', stage,
+                          '--config', config_file, '--result_file', result_file],
+                         cwd=workdir, env=env)
+        if process.returncode != 0:
+            results[stage] = {'status': 'failed'}
+            logger.error(f"{stage} failed, skipping the remaining stages")
+            break
+
+        with open(result_file, 'r') as f:
+            result = json.load(f)
+        result['rows'] = sum(count_rows(data_files[key]) for key in _stage_rows[stage])
+        result['rows_per_s'] = round(result['rows'] / result['wall_s'], 1) if result['wall_s'] else None
+        result['status'] = 'ok'
+        results[stage] = result
+        logger.info(f"{stage}: {result}")
+
+    generator_file = os.path.join(data_folder, '_generator.json')
+    generator = None
+    if os.path.isfile(generator_file):
+        with open(generator_file, 'r') as f:
+            generator = json.load(f)
+
+    return {
+        'commit': _git_commit(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'platform': {
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'system': platform.system(),
+            'cpu_count': os.cpu_count(),
+        },
+        'data': generator,
+        'config': config,
+        'stages': results,
+    }
+
+
+def compare_reports(report, baseline, tolerance=0.1):
+    """
+    Compares the measurements of two reports
+
+    Args:
+        report (dict): the current report
+        baseline (dict): the report to compare with
+        tolerance (float): relative increase of a metric that counts as regression
+
+    Returns:
+        List[dict]: one row per stage and metric with the baseline and current values,
+          their ratio and whether it is a regression
+    """
+    rows = []
+    for stage, result in report['stages'].items():
+        base = baseline['stages'].get(stage)
+        if base is None or result.get('status') != 'ok' or base.get('status') != 'ok':
+            continue
+        for metric in _compared_metrics:
+            ratio = result[metric] / base[metric] if base[metric] else None
+            rows.append({
+                'stage': stage,
+                'metric': metric,
+                'baseline': base[metric],
+                'current': result[metric],
+                'ratio': round(ratio, 3) if ratio is not None else None,
+                'regression': ratio is not None and ratio > 1 + tolerance,
+            })
+    return rows
+
+
+def _print_comparison(rows, baseline):
+    """prints the comparison as table"""
+    print(f"comparison with baseline {baseline.get('commit')} ({baseline.get('timestamp')})")
+    print(f"{'stage':<18}{'metric':<14}{'baseline':>12}{'current':>12}{'ratio':>8}")
+    for row in rows:
+        flag = '  REGRESSION' if row['regression'] else ''
+        print(f"{row['stage']:<18}{row['metric']:<14}{row['baseline']:>12}{row['current']:>12}"
+              f"{str(row['ratio']):>8}{flag}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the stages of the CI pipeline')
+    parser.add_argument('--data_folder', type=str, help='Partitioned raw data')
+    parser.add_argument('--workdir', type=str, default=os.path.join(_root_dir, 'benchmarks', 'work'),
+                        help='Location of the pipeline data files')
+    parser.add_argument('--stages', type=str, nargs='+', choices=_stages, help='Stages to run')
+    parser.add_argument('--engine', type=str, default='pandas', help='Engine of ingest_data')
+    parser.add_argument('--n_workers', type=int, help='Parallel readers of ingest_data')
+    parser.add_argument('--n_days_test', type=int, default=20, help='Number of test days')
+    parser.add_argument('--chunksize', type=int, help='Chunk size of split and validation')
+    parser.add_argument('--data_format', type=str, default='csv',
+                        help='Format of the intermediate data files')
+    parser.add_argument('--output', type=str, help='Location of the json report')
+    parser.add_argument('--baseline', type=str, help='Report to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='Relative increase of a metric that counts as regression')
+    parser.add_argument('--fail_on_regression', action='store_true',
+                        help='Exit with status 1 if a metric regressed')
+    # internal: run a single stage in this process
+    parser.add_argument('--run_stage', type=str, help=argparse.SUPPRESS)
+    parser.add_argument('--config', type=str, help=argparse.SUPPRESS)
+    parser.add_argument('--result_file', type=str, help=argparse.SUPPRESS)
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.run_stage is not None:
+        logging.getLogger().setLevel(logging.WARNING)
+        with open(args.config, 'r') as f:
+            stage_result = _run_stage(args.run_stage, json.load(f))
+        with open(args.result_file, 'w') as f:
+            json.dump(stage_result, f)
+        sys.exit(0)
+
+    report = run_benchmarks(args.data_folder, args.workdir, args.stages, args.engine,
+                            args.n_workers, args.n_days_test, args.chunksize, args.data_format)
+    output = args.output or os.path.join(args.workdir, f"report_{report['commit'] or 'local'}.json")
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=4)
+    logger.info(f"wrote report to {output}")
+
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as f:
+            baseline_report = json.load(f)
+        comparison = compare_reports(report, baseline_report, args.tolerance)
+        _print_comparison(comparison, baseline_report)
+        if args.fail_on_regression and any(row['regression'] for row in comparison):
+            sys.exit(1)
@@ -7,14 +7,42 @@
 
 from datetime import timedelta
 from airflow import DAG
-from airflow.operators.python_operator import PythonOperator
+from airflow.operators.python_operator import PythonOperator, BranchPythonOperator
+from airflow.operators.dummy import DummyOperator
 from airflow.operators.bash import BashOperator
 from airflow.utils.dates import days_ago
 from airflow.utils.timezone import datetime
-from cd4ml.deploy_model import launch_api_endpoint
+import logging
+from cd4ml.deploy_model import launch_api_endpoint, reload_api_endpoint
+from cd4ml.model_validation import get_production_version
+
+logger = logging.getLogger(__name__)
 
 _model = "my_model"
 
+# cd4ml modules without airflow/mlflow dependencies that the scoring service imports.
+# They are copied into the docker build context before the image is built.
+_score_modules = [
+    'cd4ml/data_processing/feature_transformer.py',
+    'cd4ml/utils/model_cache.py',
+    'cd4ml/model_training/compiled_model.py',
+]
+
+
+def _reload_or_rebuild(**kwargs):
+    """reloads the model of the running container, rebuilds it if that is not possible"""
+    # trigger the DAG with {"rebuild": true} to deploy changes of the scoring service
+    if (kwargs['dag_run'].conf or {}).get('rebuild'):
+        return 'kill_running_docker_container'
+    try:
+        # waits until the workers serve the new version, a failed load is rebuilt
+        reload_api_endpoint(version=get_production_version(_model))
+    except Exception as e:
+        logger.warning(f"reloading the running endpoint failed ({e}), rebuilding the container")
+        return 'kill_running_docker_container'
+    return 'model_reloaded'
+
+
 default_args = {
     'owner': 'cd4ml',
     'depends_on_past': False,
@@ -32,6 +60,16 @@ dag = DAG(
 
 with dag:
 
+    # a new Production version is swapped into the running container without downtime
+    reload_or_rebuild = BranchPythonOperator(
+        task_id='reload_or_rebuild',
+        python_callable=_reload_or_rebuild,
+    )
+
+    model_reloaded = DummyOperator(
+        task_id='model_reloaded',
+    )
+
     kill_running_docker_container = BashOperator(
         task_id='kill_running_docker_container',
         bash_command="docker kill $(docker ps --filter ancestor=deployed_model -q)",
@@ -39,8 +77,12 @@ with dag:
 
     build_docker_image = BashOperator(
         task_id='build_docker_image',
-        bash_command='docker build $PROJECT_PATH/cd4ml/deploy_model/docker_build_context -t deployed_model',
-        trigger_rule="all_done",
+        bash_command=' && '.join(
+            [f'cp $PROJECT_PATH/{module} $PROJECT_PATH/cd4ml/deploy_model/docker_build_context/score/'
+             for module in _score_modules]
+            + ['docker build $PROJECT_PATH/cd4ml/deploy_model/docker_build_context -t deployed_model']),
+        # runs if no container was running to kill, but not after a reload
+        trigger_rule="none_skipped",
     )
 
     launch_api = PythonOperator(
@@ -51,4 +93,5 @@ with dag:
         }
     )
 
+    reload_or_rebuild >> [model_reloaded, kill_running_docker_container]
     kill_running_docker_container >> build_docker_image >> launch_api
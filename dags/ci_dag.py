@@ -17,9 +17,11 @@ from cd4ml.data_processing import split_train_test
 from cd4ml.data_processing import validate_data
 from cd4ml.data_processing import transform_data
 from cd4ml.model_training import train_model
-from cd4ml.model_validation import validate_model
+from cd4ml.model_training.train_model import get_model
+from cd4ml.model_validation import validate_model, get_production_version
 from cd4ml.model_validation import push_model
 from cd4ml.data_processing.track_data import track_data
+from cd4ml.utils import cached_stage
 
 ### SET A UNIQUE MODEL NAME (e.g. "model_<YOUR NAME>"):
 _model_name = "my_model"
@@ -32,15 +34,21 @@ _raw_data_dir = '/data/batch1'
 
 _root_dir = "/"
 _data_dir = "/data"
+# file format of the intermediate artifacts: "csv", "parquet" or "feather". The raw
+# data stays a csv file, it is appended to by the incremental ingestion
+_data_format = "parquet"
 _data_files = {
     'raw_data_file': os.path.join(_data_dir, 'data.csv'),
-    'raw_train_file': os.path.join(_data_dir, 'data_train.csv'),
-    'raw_test_file': os.path.join(_data_dir, 'data_test.csv'),
-    'transformed_x_train_file': os.path.join(_data_dir, 'x_train.csv'),
-    'transformed_y_train_file': os.path.join(_data_dir, 'y_train.csv'),
-    'transformed_x_test_file': os.path.join(_data_dir, 'x_test.csv'),
-    'transformed_y_test_file': os.path.join(_data_dir, 'y_test.csv'),
+    'raw_train_file': os.path.join(_data_dir, f'data_train.{_data_format}'),
+    'raw_test_file': os.path.join(_data_dir, f'data_test.{_data_format}'),
+    'transformed_x_train_file': os.path.join(_data_dir, f'x_train.{_data_format}'),
+    'transformed_y_train_file': os.path.join(_data_dir, f'y_train.{_data_format}'),
+    'transformed_x_test_file': os.path.join(_data_dir, f'x_test.{_data_format}'),
+    'transformed_y_test_file': os.path.join(_data_dir, f'y_test.{_data_format}'),
+    'feature_transformer_file': os.path.join(_data_dir, 'feature_transformer.json'),
 }
+# stages whose inputs did not change since a previous run are restored from this cache
+_stage_cache_dir = os.path.join(_data_dir, '.stage_cache')
 
 
 if not _root_dir:
@@ -68,41 +76,88 @@ with dag:
         task_id='data_ingestion',
         python_callable=ingest_data,
         op_kwargs={'input_folder': _raw_data_dir,
-                   'data_files': _data_files}
+                   'data_files': _data_files,
+                   'engine': 'pyarrow',
+                   'incremental': True}
     )
     
     data_split = PythonOperator(
         task_id='data_split',
-        python_callable=split_train_test,
+        python_callable=cached_stage(
+            split_train_test, _stage_cache_dir,
+            inputs=['raw_data_file'],
+            outputs=['raw_train_file', 'raw_test_file'],
+            params=['n_days_test', 'chunksize']),
         op_kwargs={'data_files': _data_files,
                    'n_days_test': 20}
     )
 
     data_validation = PythonOperator(
         task_id='data_validation',
-        python_callable=validate_data,
+        python_callable=cached_stage(
+            validate_data, _stage_cache_dir,
+            inputs=['raw_train_file', 'raw_test_file'],
+            input_paths=[os.path.join(_data_dir, 'data_config.json')],
+            output_paths=[os.path.join(_data_dir, 'data_config.json')],
+            params=['chunksize']),
         op_kwargs={'data_files': _data_files,
-                   'configs_dir': _data_dir}
+                   'configs_dir': _data_dir,
+                   'chunksize': 100000}
     )
 
     data_transformation = PythonOperator(
         task_id='data_transformation',
-        python_callable=transform_data,
+        python_callable=cached_stage(
+            transform_data, _stage_cache_dir,
+            inputs=['raw_train_file', 'raw_test_file'],
+            outputs=['transformed_x_train_file', 'transformed_y_train_file',
+                     'transformed_x_test_file', 'transformed_y_test_file',
+                     'feature_transformer_file'],
+            params=['dtype']),
         op_kwargs={'data_files': _data_files}
     )
 
     model_training = PythonOperator(
         task_id='model_training',
-        python_callable=train_model,
+        python_callable=cached_stage(
+            train_model, _stage_cache_dir,
+            inputs=['transformed_x_train_file', 'transformed_y_train_file',
+                    'feature_transformer_file', 'raw_train_file'],
+            params=['experiment_name', 'search_space', 'incremental', 'model_name',
+                    'out_of_core', 'batch_mb', 'sharded', 'n_shards'],
+            # incremental training continues from the current production model
+            extra=lambda kwargs: [get_model().get_params(),
+                                  kwargs['incremental'] and get_production_version(kwargs['model_name'])]),
         op_kwargs={
             'data_files': _data_files,
-            'experiment_name': _mlflow_experiment_name
+            'experiment_name': _mlflow_experiment_name,
+            # set to e.g. cd4ml.model_training.default_search_space to train the best
+            # candidate of a hyperparameter search instead of 'get_model'
+            'search_space': None,
+            # continue training the production model on the new data only, with a
+            # full refit every 7th run; needs an estimator with 'partial_fit' or an
+            # ensemble, 'get_model' (LogisticRegression) is always refitted
+            'incremental': False,
+            'model_name': _model_name,
+            'full_refit_every': 7,
+            # 'partial_fit' trains on mini-batches of a memory-mapped copy of the
+            # training data with a memory use independent of its size
+            'out_of_core': None,
+            # train a model per turbine (or per group of 'n_shards' turbines) in parallel
+            # processes, routed by wt_sk when scoring; requires 'incremental': False
+            'sharded': False,
+            'n_shards': None,
         }
     )
 
     model_validation = BranchPythonOperator(
         task_id='model_validation',
-        python_callable=validate_model,
+        python_callable=cached_stage(
+            validate_model, _stage_cache_dir,
+            inputs=['transformed_x_test_file', 'transformed_y_test_file', 'raw_test_file'],
+            params=['model'],
+            xcom_task_ids=['model_training'],
+            extra=lambda kwargs: get_production_version(kwargs['model'])),
         op_kwargs={
             'data_files': _data_files,
             'model': _model_name
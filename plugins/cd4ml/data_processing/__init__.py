@@ -1,6 +1,8 @@
 from cd4ml.data_processing.ingest_data import ingest_data
 from cd4ml.data_processing.ingest_data import get_data
 from cd4ml.data_processing.split_train_test import get_train_test_split, split_train_test
+from cd4ml.data_processing.split_train_test import get_backtest_splits, split_backtest
 from cd4ml.data_processing.transform_data import get_transformed_data, transform_data
+from cd4ml.data_processing.feature_transformer import FeatureTransformer
 from cd4ml.data_processing.validate_data import validate_data
 from cd4ml.data_processing.track_data import track_data
\ No newline at end of file
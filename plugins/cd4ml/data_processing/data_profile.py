@@ -0,0 +1,182 @@
+# Author:      CD4ML Working Group @ D ONE
+# Description: Computes column profiles (dtype, nullability, min/max, null counts,
+#              approximate quantiles and distinct counts) of a data file in a
+#              single pass over chunks with bounded memory. Profiles are cached by
+#              the content hash of the file.
+# ================================================================================
+
+import os
+import json
+import numpy as np
+import pandas as pd
+from cd4ml.data_processing.file_io import iter_frames, read_frame
+from cd4ml.utils.fingerprint import file_hash
+import logging
+
+logger = logging.getLogger(__name__)
+
+_profile_version = 1
+_quantiles = [0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99]
+_sample_size = 10000
+_sketch_size = 1024
+
+
+def _merge_dtype(dtype_a, dtype_b):
+    """the dtype pandas infers for a column whose chunks were inferred as dtype_a and dtype_b"""
+    if dtype_a is None:
+        return dtype_b
+    if dtype_a == dtype_b:
+        return dtype_a
+    if dtype_a.kind in "iuf" and dtype_b.kind in "iuf":
+        return np.result_type(dtype_a, dtype_b)
+    return np.dtype(object)
+
+
+def _to_json_value(value):
+    """converts numpy scalars to python values, missing values to None"""
+    if value is None or (not isinstance(value, str) and pd.isnull(value)):
+        return None
+    return value.item() if isinstance(value, np.generic) else value
+
+
+class _ColumnProfiler:
+    """accumulates the profile of a single column over chunks"""
+
+    def __init__(self, seed=0):
+        self.dtype = None
+        self.n_rows = 0
+        self.null_count = 0
+        self.min = None
+        self.max = None
+        self.dtype_changes = []
+        self.first_nulls = None
+        self._rng = np.random.default_rng(seed)
+        self._sample_keys = np.empty(0)
+        self._sample_values = np.empty(0)
+        self._sketch = np.empty(0, dtype=np.uint64)
+
+    def update(self, series, chunk, row_start):
+        """adds the values of one chunk, 'row_start' is the row number of its first row"""
+        rows = [row_start, row_start + len(series) - 1]
+
+        dtype = _merge_dtype(self.dtype, series.dtype if len(series) else self.dtype)
+        # note: numpy compares None equal to float64
+        if dtype is not None and (self.dtype is None or dtype != self.dtype):
+            self.dtype_changes.append({"chunk": chunk, "rows": rows, "dtype": str(dtype)})
+            self.dtype = dtype
+
+        nulls = int(series.isnull().sum())
+        if nulls and self.first_nulls is None:
+            self.first_nulls = {"chunk": chunk, "rows": rows}
+        self.null_count += nulls
+        self.n_rows += len(series)
+
+        values = series.dropna()
+        if len(values) == 0:
+            return
+        try:
+            self.min = min(filter(lambda v: v is not None, [self.min, values.min()]))
+            self.max = max(filter(lambda v: v is not None, [self.max, values.max()]))
+        except TypeError:
+            # values without a common order (e.g. mixed types)
+            pass
+
+        # bottom-k sample by random keys is a uniform sample of all rows so far
+        if series.dtype.kind in "iuf":
+            keys = self._rng.random(len(values))
+            self._sample_keys = np.concatenate([self._sample_keys, keys])
+            self._sample_values = np.concatenate([self._sample_values, values.to_numpy(dtype=float)])
+            if len(self._sample_keys) > _sample_size:
+                keep = np.argpartition(self._sample_keys, _sample_size)[:_sample_size]
+                self._sample_keys = self._sample_keys[keep]
+                self._sample_values = self._sample_values[keep]
+
+        # k minimum values sketch of the hashes for the distinct count
+        hashes = pd.util.hash_pandas_object(values, index=False).to_numpy()
+        self._sketch = np.unique(np.concatenate([self._sketch, hashes]))[:_sketch_size]
+
+    def result(self):
+        """returns the profile as json serializable dict"""
+        if len(self._sketch) < _sketch_size:
+            distinct_count = len(self._sketch)
+        else:
+            kth_hash = float(self._sketch[-1]) / np.iinfo(np.uint64).max
+            distinct_count = int(round((_sketch_size - 1) / kth_hash))
+
+        quantiles = {}
+        if len(self._sample_values):
+            values = np.quantile(self._sample_values, _quantiles)
+            quantiles = {str(q): float(v) for q, v in zip(_quantiles, values)}
+
+        return {
+            "dtype": str(self.dtype),
+            "nullable": self.null_count > 0,
+            "null_count": self.null_count,
+            "min": _to_json_value(self.min),
+            "max": _to_json_value(self.max),
+            "quantiles": quantiles,
+            "distinct_count": distinct_count,
+            "dtype_changes": self.dtype_changes,
+            "first_nulls": self.first_nulls,
+        }
+
+
+def profile_frames(frames):
+    """
+    Profiles a stream of data frames in a single pass
+
+    Args:
+        frames (Iterable[pd.DataFrame]): the chunks of the data
+
+    Returns:
+        dict: 'n_rows', 'n_chunks' and the profile of every column in 'columns'
+    """
+    profilers = {}
+    row_start, n_chunks = 0, 0
+    for chunk, df in enumerate(frames):
+        for col in df.columns:
+            if col not in profilers:
+                profilers[col] = _ColumnProfiler()
+            profilers[col].update(df[col], chunk, row_start)
+        row_start += len(df)
+        n_chunks += 1
+
+    return {
+        "n_rows": row_start,
+        "n_chunks": n_chunks,
+        "columns": {col: profiler.result() for col, profiler in profilers.items()},
+    }
+
+
+def get_profile(path, chunksize=None, cache_dir=None):
+    """
+    Profiles a data file chunk by chunk. If 'cache_dir' is given, the profile is cached
+    there by the content hash of the file, so profiling unchanged data is instant.
+
+    Args:
+        path (str): location of the data file
+        chunksize (Optional[int]): number of rows per chunk, None reads the file at once
+        cache_dir (Optional[str]): directory of the cached profiles
+
+    Returns:
+        dict: the profile (see 'profile_frames')
+    """
+    cache_file = None
+    if cache_dir is not None:
+        key = f"{file_hash(path)}_{chunksize or 'all'}_v{_profile_version}"
+        cache_file = os.path.join(cache_dir, f"{key}.json")
+        if os.path.isfile(cache_file):
+            with open(cache_file, "r") as f:
+                logger.info(f"loaded cached profile of {path}")
+                return json.load(f)
+
+    frames = [read_frame(path)] if chunksize is None else iter_frames(path, chunksize)
+    profile = profile_frames(frames)
+    logger.info(f"profiled {path}: {profile['n_rows']} rows in {profile['n_chunks']} chunks")
+
+    if cache_file is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(cache_file + ".tmp", "w") as f:
+            json.dump(profile, f, indent=4)
+        os.replace(cache_file + ".tmp", cache_file)
+    return profile
@@ -1,13 +1,15 @@
 # Author:      CD4ML Working Group @ D ONE
-# Description: This script takes a csv file and disaggregates it into multiple 
+# Description: This script takes a csv file and disaggregates it into multiple
 #              files, parttiioned by the date column.
 # ================================================================================
 
 import argparse
 import pandas as pd
 import os
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
 from pathlib import Path
+from cd4ml.data_processing.partition_catalog import get_catalog_path, update_catalog
 import logging
 
 logger = logging.getLogger(__name__)
@@ -21,59 +23,174 @@ parser.add_argument('--granularity', type=str,
                     help='Granularity', default='day')
 parser.add_argument('--from_date', type=str, help='From date')
 parser.add_argument('--to_date', type=str, help='To date')
-
-
-def get_file_path(fn, folder):
-    fns = fn.split("-")
-    return os.path.join(folder, *fns[:-1], fns[-1]+".csv")
+parser.add_argument('--chunksize', type=int,
+                    help='Stream the input file in chunks of this many rows')
+parser.add_argument('--output_format', type=str,
+                    help='Format of the partitions, "csv" or "parquet"', default='csv')
+parser.add_argument('--n_workers', type=int,
+                    help='Number of parallel partition writers', default=1)
+
+# date parts that make up the partition path for every granularity
+_granularity_parts = {
+    'hour': ['year', 'month', 'day', 'hour'],
+    'day': ['year', 'month', 'day'],
+    'month': ['year', 'month'],
+    'year': ['year'],
+}
+
+
+def _partition_keys(df_index_date, granularity):
+    """vectorized date parts of the partition of every row"""
+    if granularity not in _granularity_parts:
+        raise ValueError(f'granularity must be one of {list(_granularity_parts)}, got "{granularity}"')
+    return [getattr(df_index_date.dt, part).rename(part) for part in _granularity_parts[granularity]]
+
+
+def _partition_path(key, folder, granularity, output_format):
+    """the output file of a partition key, e.g. (2020, 1, 15) -> <folder>/2020/1/15.csv"""
+    parts = [str(part) for part in (key if isinstance(key, tuple) else (key,))]
+    if granularity == 'hour':
+        # day and hour share the file name, e.g. 2020/1/1510.csv
+        parts = parts[:-2] + [parts[-2] + parts[-1]]
+    return os.path.join(folder, *parts[:-1], f"{parts[-1]}.{output_format}")
+
+
+class PartitionWriter:
+    """
+    Writes the rows of a data frame to their date partitions. Every partition is
+    written in one go per call of 'write', optionally by parallel writers. Calling
+    'write' again (e.g. for the next chunk of a streamed input file) appends to the
+    partitions that were already written. A parquet file stays open while the
+    following calls write to it, the input is expected in the order of its dates.
+
+    Args:
+        output_folder (str): root folder of the partitions
+        granularity (str): 'hour', 'day', 'month' or 'year'
+        output_format (str): 'csv' or 'parquet'
+        n_workers (int): number of parallel writers
+        keep_frames (bool): remember the data frame written to every partition (in
+          'written') to update the partition catalog without reading the files again
+    """
+
+    def __init__(self, output_folder, granularity='day', output_format='csv', n_workers=1,
+                 keep_frames=False):
+        if output_format not in ('csv', 'parquet'):
+            raise ValueError(f'output_format must be "csv" or "parquet", got "{output_format}"')
+        self.output_folder = output_folder
+        self.granularity = granularity
+        self.output_format = output_format
+        self.n_workers = n_workers
+        self.keep_frames = keep_frames
+        self.written = {}
+        self._parquet_writers = {}
+
+    def _write_partition(self, path, df):
+        """writes or appends the rows of one partition"""
+        is_new = path not in self.written
+        if is_new:
+            Path(os.path.dirname(path)).mkdir(parents=True, exist_ok=True)
+
+        if self.output_format == 'csv':
+            df.to_csv(path, index=False, mode='w' if is_new else 'a', header=is_new)
+        else:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            # parquet files can't be appended to, the writer stays open while the partition
+            # is written (see 'write')
+            writer = self._parquet_writers.get(path)
+            existing = None
+            if writer is None and not is_new:
+                # rows of a partition that was already closed, its file is written again
+                existing = pq.read_table(path)
+            schema = writer.schema if writer is not None else existing.schema if existing is not None else None
+            table = pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+            if writer is None:
+                writer = self._parquet_writers[path] = pq.ParquetWriter(
+                    path, table.schema, compression='zstd')
+                if existing is not None:
+                    writer.write_table(existing)
+            writer.write_table(table)
+
+    def write(self, df, df_index_date):
+        """
+        Writes every row of 'df' to the partition of its date
+
+        Args:
+            df (pd.DataFrame): the rows to write
+            df_index_date (pd.Series): the parsed date column of 'df'
+        """
+        frames = {}
+        for key, group in df.groupby(_partition_keys(df_index_date, self.granularity), sort=False):
+            path = _partition_path(key, self.output_folder, self.granularity, self.output_format)
+            frames.setdefault(path, []).append(group)
+        # hours of different days can share a file (2020/1/110.csv holds day 1 hour 10 and
+        # day 11 hour 0), every file is written once per call
+        groups = [(path, parts[0] if len(parts) == 1 else pd.concat(parts))
+                  for path, parts in frames.items()]
+
+        if self.n_workers > 1:
+            with ThreadPoolExecutor(max_workers=self.n_workers) as pool:
+                list(pool.map(lambda item: self._write_partition(*item), groups))
+        else:
+            for path, group in groups:
+                self._write_partition(path, group)
+
+        for path, group in groups:
+            # a partition spread over several calls is only known from its file
+            keep = self.keep_frames and path not in self.written
+            self.written[path] = group if keep else None
+
+        # partitions without rows in this call are complete, their files are closed so the
+        # number of open files stays small
+        for path in [path for path in self._parquet_writers if path not in frames]:
+            self._parquet_writers.pop(path).close()
+
+    def close(self):
+        """closes all open partition files"""
+        for writer in self._parquet_writers.values():
+            writer.close()
+        self._parquet_writers = {}
+
+
+def _filter_dates(df, df_index_date, from_date=None, to_date=None):
+    """filters the rows of 'df' (and their dates) by 'from_date' and 'to_date'"""
+    selector = pd.Series(True, index=df.index)
+    if from_date is not None:
+        selector &= df_index_date >= pd.to_datetime(from_date, utc=True)
+    if to_date is not None:
+        selector &= df_index_date <= pd.to_datetime(to_date, utc=True)
+    return df[selector], df_index_date[selector]
 
 
 if __name__ == "__main__":
     args = parser.parse_args()
-    granularity = args.granularity
 
-    # Read the data
-    df = pd.read_csv(args.input_file)
+    writer = PartitionWriter(args.output_folder, args.granularity, args.output_format,
+                             args.n_workers, keep_frames=args.chunksize is None)
 
-    # Transforms the date column into a datetime object
-    df_index_date = pd.to_datetime(df[args.date_column], utc=True)
+    # Read the data, either at once or as a stream of chunks
+    if args.chunksize is not None:
+        chunks = pd.read_csv(args.input_file, chunksize=args.chunksize)
+    else:
+        chunks = [pd.read_csv(args.input_file)]
 
-    # Define the folder structure for hourly resolution
-    if granularity == 'hour':
-        df_index_col = df_index_date.dt.year.astype(str) + '-' + df_index_date.dt.month.astype(
-            str) + '-' + df_index_date.dt.day.astype(str) + df_index_date.dt.hour.astype(str)
-
-    # Define the folder structure for daily resolution
-    if granularity == 'day':
-        df_index_col = df_index_date.dt.year.astype(
-            str) + '-' + df_index_date.dt.month.astype(str) + '-' + df_index_date.dt.day.astype(str)
-
-    # Define the folder structure for monthly resolution
-    if granularity == 'month':
-        df_index_col = df_index_date.dt.year.astype(
-            str) + '-' + df_index_date.dt.month.astype(str)
-
-    # Define the folder structure for yearly resolution
-    if granularity == 'year':
-        df_index_col = df_index_date.dt.year.astype(str)
-
-    # Filter the dataframe by the from_date
-    if args.from_date is not None:
-        selector = df_index_date >= pd.to_datetime(args.from_date, utc=True)
-        df_index_col = df_index_col[selector]
-        df = df[selector]
-
-    # Filter the dataframe by the to_date
-    if args.to_date is not None:
-        selector = df_index_date <= pd.to_datetime(args.to_date, utc=True)
-        df_index_col = df_index_col[selector]
-        df = df[selector]
-
-    # Create the pd Series of output filenames
-    df_file_name = df_index_col.apply(
-        get_file_path, args=(args.output_folder,))
-
-    # Write the dataframe to the output files
-    for ff in tqdm(set(df_file_name)):
-        Path(os.path.dirname(ff)).mkdir(parents=True, exist_ok=True)
-        df[df_file_name == ff].to_csv(ff, index=False)
\ No newline at end of file
+    try:
+        for df in tqdm(chunks):
+            # Transforms the date column into a datetime object
+            df_index_date = pd.to_datetime(df[args.date_column], utc=True)
+
+            # Filter the dataframe by the from_date and to_date
+            df, df_index_date = _filter_dates(df, df_index_date, args.from_date, args.to_date)
+
+            # Write the dataframe to the output files
+            writer.write(df, df_index_date)
+    finally:
+        writer.close()
+
+    logger.info(f"wrote {len(writer.written)} partitions to {args.output_folder}")
+
+    # Keep an existing partition catalog in sync (a missing one is built on first use)
+    if os.path.isfile(get_catalog_path(args.output_folder)):
+        frames = {path: df for path, df in writer.written.items() if df is not None}
+        update_catalog(args.output_folder, list(writer.written), frames=frames)
@@ -0,0 +1,143 @@
+# Author:      CD4ML Working Group @ D ONE
+# Description: Memory-mapped store of the transformed features and labels. The
+#              x and y files are converted once, chunk by chunk, into contiguous
+#              float32 and int64 arrays on disk. Training then reads them through
+#              np.memmap, so only the pages in use are held in memory.
+# ================================================================================
+
+import json
+import os
+import shutil
+from itertools import zip_longest
+import numpy as np
+from cd4ml.data_processing.file_io import iter_frames
+from cd4ml.utils.fingerprint import file_fingerprint
+import logging
+
+logger = logging.getLogger(__name__)
+
+_store_version = 1
+_x_name = "x.f32"
+_y_name = "y.i64"
+_meta_name = "meta.json"
+
+
+def get_batch_rows(batch_mb, n_columns):
+    """number of rows of a batch of features and labels of about 'batch_mb' megabytes"""
+    return max(1, int(batch_mb * 1024 ** 2 // (4 * n_columns + 8)))
+
+
+class MemmapFeatureStore:
+    """
+    Read-only view of a feature store created by 'build_feature_store'
+
+    Args:
+        store_dir (str): location of the store
+
+    Attributes:
+        x (np.memmap): features, shape (n_rows, n_columns), float32, C-contiguous
+        y (np.memmap): labels, shape (n_rows,), int64
+        columns (List[str]): names of the features
+        classes (np.ndarray): sorted unique labels
+    """
+
+    def __init__(self, store_dir):
+        with open(os.path.join(store_dir, _meta_name), "r") as f:
+            self.meta = json.load(f)
+        self.store_dir = store_dir
+        self.columns = self.meta["columns"]
+        self.n_rows = self.meta["n_rows"]
+        self.classes = np.array(self.meta["classes"], dtype=np.int64)
+        self._x_file = os.path.join(store_dir, _x_name)
+        self._y_file = os.path.join(store_dir, _y_name)
+        shape = (self.n_rows, len(self.columns))
+        # np.memmap can't map empty files
+        if self.n_rows:
+            self.x = np.memmap(self._x_file, dtype=np.float32, mode="r", shape=shape)
+            self.y = np.memmap(self._y_file, dtype=np.int64, mode="r", shape=(self.n_rows,))
+        else:
+            self.x = np.empty(shape, dtype=np.float32)
+            self.y = np.empty(0, dtype=np.int64)
+
+    def iter_batches(self, batch_rows, seed=None):
+        """
+        Iterates over contiguous batches of rows, in random order if 'seed' is given. Every
+        batch is a separate memory map, so its pages are released once it is dropped.
+
+        Args:
+            batch_rows (int): number of rows per batch
+            seed (Optional[int]): seed of the shuffling of the batches
+
+        Yields:
+            Tuple[np.memmap]: features and labels of the next batch
+        """
+        n_columns = len(self.columns)
+        starts = np.arange(0, self.n_rows, batch_rows)
+        if seed is not None:
+            np.random.default_rng(seed).shuffle(starts)
+        for start in starts:
+            n_rows = int(min(batch_rows, self.n_rows - start))
+            yield (np.memmap(self._x_file, dtype=np.float32, mode="r", offset=int(start) * 4 * n_columns,
+                             shape=(n_rows, n_columns)),
+                   np.memmap(self._y_file, dtype=np.int64, mode="r", offset=int(start) * 8,
+                             shape=(n_rows,)))
+
+
+def _is_current(store_dir, sources):
+    """checks that the store exists and was built from the current source files"""
+    meta_file = os.path.join(store_dir, _meta_name)
+    if not os.path.isfile(meta_file):
+        return False
+    with open(meta_file, "r") as f:
+        meta = json.load(f)
+    return meta.get("version") == _store_version and meta.get("sources") == sources
+
+
+def build_feature_store(x_file, y_file, store_dir=None, chunksize=100000):
+    """
+    Converts transformed features and labels into a memory-mapped store, unless the
+    store is already up to date with the files. The conversion streams the files in
+    chunks of 'chunksize' rows, its memory use does not depend on the size of the data.
+
+    Args:
+        x_file (str): location of the input features
+        y_file (str): location of the labels
+        store_dir (Optional[str]): location of the store, defaults to '<x_file>.memmap'
+        chunksize (int): number of rows converted at once
+
+    Returns:
+        MemmapFeatureStore: the store
+    """
+    store_dir = store_dir or x_file + ".memmap"
+    sources = {"x": [os.path.abspath(x_file)] + file_fingerprint(x_file),
+               "y": [os.path.abspath(y_file)] + file_fingerprint(y_file)}
+    if _is_current(store_dir, sources):
+        logger.info(f"feature store {store_dir} is up to date")
+        return MemmapFeatureStore(store_dir)
+
+    tmp_dir = store_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    n_rows, columns, classes = 0, None, set()
+    with open(os.path.join(tmp_dir, _x_name), "wb") as x_out, \
+            open(os.path.join(tmp_dir, _y_name), "wb") as y_out:
+        # zip_longest, so extra rows of either file are not silently dropped
+        for x, y in zip_longest(iter_frames(x_file, chunksize), iter_frames(y_file, chunksize)):
+            if x is None or y is None or len(x) != len(y):
+                raise ValueError(f"{x_file} and {y_file} have a different number of rows")
+            columns = columns or list(x.columns)
+            np.ascontiguousarray(x.to_numpy(dtype=np.float32)).tofile(x_out)
+            labels = y.iloc[:, 0].to_numpy(dtype=np.int64)
+            labels.tofile(y_out)
+            classes.update(np.unique(labels).tolist())
+            n_rows += len(x)
+
+    with open(os.path.join(tmp_dir, _meta_name), "w") as f:
+        json.dump({"version": _store_version, "sources": sources, "n_rows": n_rows,
+                   "columns": columns or [], "classes": sorted(classes)}, f, indent=4)
+
+    shutil.rmtree(store_dir, ignore_errors=True)
+    os.replace(tmp_dir, store_dir)
+    logger.info(f"converted {n_rows} rows of {x_file} and {y_file} into {store_dir}")
+    return MemmapFeatureStore(store_dir)
@@ -0,0 +1,134 @@
+# Author:      CD4ML Working Group @ D ONE
+# Description: Fitted, serializable transformation of raw turbine data into input
+#              features and labels. It only depends on numpy and pandas, so the
+#              same module is copied into the scoring container (see cd_dag) and
+#              serving applies exactly the transformation used in training.
+# ================================================================================
+
+import json
+import numpy as np
+import pandas as pd
+
+_features = ['wind_speed', 'power', 'nacelle_direction', 'wind_direction',
+             'rotor_speed', 'generator_speed', 'temp_environment',
+             'temp_hydraulic_oil', 'temp_gear_bearing', 'cosphi',
+             'blade_angle_avg', 'hydraulic_pressure']
+_label = 'categories_sk'
+_errors_to_classify = [0, 3, 5, 7, 8]
+_other_error = 9
+_min_power = 0.05
+
+
+class FeatureTransformer:
+    """
+    Transforms raw data into input features and labels: keeps the rows with power above
+    'min_power', fills missing features with 0 and maps every label that is not in
+    'errors_to_classify' to 'other_error'. All steps are vectorized numpy operations.
+
+    Args:
+        features (Optional[List[str]]): input feature columns
+        label (str): label column
+        errors_to_classify (Optional[List[int]]): labels that are kept as they are
+        other_error (int): label of all other errors
+        min_power (float): rows with a power below are not used
+        dtype (str): dtype of the features, 'float64' or 'float32'
+    """
+
+    def __init__(self, features=None, label=_label, errors_to_classify=None,
+                 other_error=_other_error, min_power=_min_power, dtype='float64'):
+        self.features = list(features or _features)
+        self.label = label
+        self.errors_to_classify = list(errors_to_classify or _errors_to_classify)
+        self.other_error = other_error
+        self.min_power = min_power
+        self.dtype = dtype
+        self.is_fitted = False
+
+    def fit(self, df):
+        """
+        Checks that 'df' contains all features and fixes the transformation
+
+        Args:
+            df (pd.DataFrame): raw training data
+
+        Returns:
+            FeatureTransformer: the fitted transformer
+        """
+        missing = [col for col in self.features if col not in df.columns]
+        if missing:
+            raise ValueError(f"input data is missing the feature columns {missing}")
+        self.is_fitted = True
+        return self
+
+    def transform_features(self, df):
+        """
+        Transforms raw data into input features without filtering rows, as used for serving
+
+        Args:
+            df (pd.DataFrame): raw input data
+
+        Returns:
+            pd.DataFrame: input features with the index of 'df'
+        """
+        values = df[self.features].to_numpy(dtype=self.dtype, copy=True)
+        values[np.isnan(values)] = 0
+        return pd.DataFrame(values, columns=self.features, index=df.index)
+
+    def row_mask(self, df):
+        """
+        Selects the rows used for training and validation
+
+        Args:
+            df (pd.DataFrame): raw data, at least with the column 'power'
+
+        Returns:
+            np.ndarray: boolean mask of the rows of 'df' that 'transform' keeps
+        """
+        return df['power'].to_numpy() > self.min_power
+
+    def transform(self, df):
+        """
+        Transforms raw data into input features and labels
+
+        Args:
+            df (pd.DataFrame): raw input data
+
+        Returns:
+            Tuple[pd.DataFrame]: input features and labels (an empty data frame if 'df'
+              has no label column)
+        """
+        mask = self.row_mask(df)
+        x = self.transform_features(df[mask])
+
+        if self.label in df.columns:
+            labels = df[self.label].to_numpy(dtype='float64')[mask]
+            labels = np.where(np.isnan(labels), 0, labels).astype('int64')
+            labels = np.where(np.isin(labels, self.errors_to_classify), labels, self.other_error)
+            y = pd.Series(labels, index=x.index, name=self.label)
+        else:
+            y = pd.DataFrame(None)
+        return x, y
+
+    def to_dict(self):
+        """returns the parameters of the transformer"""
+        return {
+            'features': self.features,
+            'label': self.label,
+            'errors_to_classify': self.errors_to_classify,
+            'other_error': self.other_error,
+            'min_power': self.min_power,
+            'dtype': self.dtype,
+        }
+
+    def save(self, path):
+        """saves the transformer as json file"""
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=4)
+
+    @classmethod
+    def load(cls, path):
+        """loads a transformer saved with 'save'"""
+        with open(path, 'r') as f:
+            transformer = cls(**json.load(f))
+        transformer.is_fitted = True
+        return transformer
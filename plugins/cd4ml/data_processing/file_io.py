@@ -0,0 +1,214 @@
+# Author:      CD4ML Working Group @ D ONE
+# Description: Reads and writes the data frames exchanged between the pipeline
+#              stages. The file format is chosen from the file extension: csv,
+#              parquet (.parquet, .pq) or feather (.feather, .arrow). The columnar
+#              formats keep the schema, are compressed and support column
+#              projection on read.
+# ================================================================================
+
+import os
+import pandas as pd
+import logging
+
+logger = logging.getLogger(__name__)
+
+_extensions = {
+    ".csv": "csv",
+    ".parquet": "parquet",
+    ".pq": "parquet",
+    ".feather": "feather",
+    ".arrow": "feather",
+}
+
+_default_compression = {
+    "csv": None,
+    "parquet": "zstd",
+    "feather": "lz4",
+}
+
+# bounds the memory needed to stream a parquet file, a row group is read at once
+_row_group_size = 100000
+
+
+def get_file_format(path):
+    """
+    Returns the file format of 'path' according to its extension
+
+    Args:
+        path (str): location of the file
+
+    Returns:
+        str: 'csv', 'parquet' or 'feather'
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in _extensions:
+        raise ValueError(f'unsupported file extension "{extension}" of {path}, '
+                         f'expected one of {sorted(_extensions)}')
+    return _extensions[extension]
+
+
+def read_columns(path):
+    """
+    Returns the column names of a data file without reading its content
+
+    Args:
+        path (str): location of the file
+
+    Returns:
+        List[str]: column names
+    """
+    file_format = get_file_format(path)
+    if file_format == "csv":
+        return list(pd.read_csv(path, nrows=0).columns)
+
+    import pyarrow.ipc as ipc
+    import pyarrow.parquet as pq
+
+    if file_format == "parquet":
+        return list(pq.read_schema(path).names)
+    with ipc.open_file(path) as reader:
+        return list(reader.schema.names)
+
+
+def read_frame(path, columns=None):
+    """
+    Reads a data frame from disk
+
+    Args:
+        path (str): location of the file
+        columns (Optional[List[str]]): only read these columns
+
+    Returns:
+        pd.DataFrame: the data
+    """
+    file_format = get_file_format(path)
+    if file_format == "csv":
+        return pd.read_csv(path, usecols=columns)
+    elif file_format == "parquet":
+        return pd.read_parquet(path, columns=columns)
+    return pd.read_feather(path, columns=columns)
+
+
+def write_frame(df, path, compression="default"):
+    """
+    Writes a data frame (or series) to disk without its index
+
+    Args:
+        df (Union[pd.DataFrame, pd.Series]): the data
+        path (str): location of the file
+        compression (Optional[str]): compression codec of the columnar formats,
+          defaults to zstd for parquet and lz4 for feather
+    """
+    file_format = get_file_format(path)
+    if compression == "default":
+        compression = _default_compression[file_format]
+    if isinstance(df, pd.Series):
+        df = df.to_frame()
+
+    if file_format == "csv":
+        df.to_csv(path, index=False)
+    elif file_format == "parquet":
+        df.to_parquet(path, index=False, compression=compression, row_group_size=_row_group_size)
+    else:
+        df.reset_index(drop=True).to_feather(path, compression=compression)
+
+
+def iter_frames(path, chunksize, columns=None):
+    """
+    Reads a data file as a stream of data frames with at most 'chunksize' rows
+
+    Args:
+        path (str): location of the file
+        chunksize (int): number of rows per chunk
+        columns (Optional[List[str]]): only read these columns
+
+    Yields:
+        pd.DataFrame: the next chunk of rows
+    """
+    file_format = get_file_format(path)
+    if file_format == "csv":
+        yield from pd.read_csv(path, usecols=columns, chunksize=chunksize)
+        return
+
+    import pyarrow.feather as feather
+    import pyarrow.parquet as pq
+
+    if file_format == "parquet":
+        # without pre-buffering, only the row group being read is held in memory
+        for batch in pq.ParquetFile(path, pre_buffer=False).iter_batches(batch_size=chunksize,
+                                                                         columns=columns):
+            yield batch.to_pandas()
+    else:
+        # memory mapped, only the sliced rows are materialized
+        table = feather.read_table(path, columns=columns, memory_map=True)
+        for offset in range(0, max(table.num_rows, 1), chunksize):
+            yield table.slice(offset, chunksize).to_pandas()
+
+
+class FrameWriter:
+    """
+    Writes a data file from a stream of data frames (e.g. produced by 'iter_frames'),
+    so the complete data never has to be held in memory. The schema of the first
+    data frame is the schema of the file. Use it as context manager or call 'close'.
+
+    Args:
+        path (str): location of the file
+        compression (Optional[str]): compression codec of the columnar formats,
+          defaults to zstd for parquet and lz4 for feather
+    """
+
+    def __init__(self, path, compression="default"):
+        self.path = path
+        self.file_format = get_file_format(path)
+        self.compression = _default_compression[self.file_format] \
+            if compression == "default" else compression
+        self.n_rows = 0
+        self._writer = None
+        self._schema = None
+        self._empty = None
+
+    def write(self, df):
+        """appends the rows of 'df' to the file"""
+        if isinstance(df, pd.Series):
+            df = df.to_frame()
+
+        if self.file_format == "csv":
+            df.to_csv(self.path, index=False, mode="w" if self._schema is None else "a",
+                      header=self._schema is None)
+            self._schema = self._schema or list(df.columns)
+        elif self._writer is None and len(df) == 0:
+            # the types of empty object columns are unknown, wait for rows
+            self._empty = df
+        else:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            table = pa.Table.from_pandas(df, schema=self._schema, preserve_index=False)
+            if self._writer is None:
+                self._schema = table.schema
+                if self.file_format == "parquet":
+                    self._writer = pq.ParquetWriter(self.path, self._schema,
+                                                    compression=self.compression)
+                else:
+                    options = pa.ipc.IpcWriteOptions(compression=self.compression)
+                    self._writer = pa.ipc.new_file(self.path, self._schema, options=options)
+            if self.file_format == "parquet":
+                self._writer.write_table(table, row_group_size=_row_group_size)
+            else:
+                self._writer.write_table(table)
+        self.n_rows += len(df)
+
+    def close(self):
+        """finishes the file"""
+        if self._writer is None and self._empty is not None:
+            write_frame(self._empty, self.path, self.compression)
+            self._empty = None
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -6,17 +6,43 @@
 import argparse
 import pandas as pd
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from pathlib import Path
+from cd4ml.data_processing.partition_catalog import query_partitions, partition_extensions
+from cd4ml.data_processing import ingest_manifest
+from cd4ml.data_processing.file_io import get_file_format, read_frame, write_frame
 import logging
 
 logger = logging.getLogger(__name__)
 
+# known column types of the turbine partitions, used by the pyarrow reader to skip
+# type inference (and to agree with the dtypes pd.read_csv would infer)
+_column_types = {
+    'wt_sk': 'int64',
+    'measured_at': 'string',
+    'wind_speed': 'float64',
+    'power': 'float64',
+    'nacelle_direction': 'float64',
+    'wind_direction': 'float64',
+    'rotor_speed': 'float64',
+    'generator_speed': 'float64',
+    'temp_environment': 'float64',
+    'temp_hydraulic_oil': 'float64',
+    'temp_gear_bearing': 'float64',
+    'cosphi': 'float64',
+    'blade_angle_avg': 'float64',
+    'hydraulic_pressure': 'float64',
+    'subtraction': 'float64',
+    'categories_sk': 'float64',
+}
+
 
 def filter_from_date(item, from_date):
     """
     Returns true if the item is after the from_date
     """
-    item = item.replace(".csv", "")
+    item = os.path.splitext(item)[0]
     if from_date is not None:
         if pd.to_datetime(item) < pd.to_datetime(from_date):
             return False
@@ -27,7 +53,7 @@ def filter_to_date(item, from_date):
     """
     Returns true if the item is before the to_date
     """
-    item = item.replace(".csv", "")
+    item = os.path.splitext(item)[0]
     if from_date is not None:
         if pd.to_datetime(item) > pd.to_datetime(from_date):
             return False
@@ -41,6 +67,13 @@ def filter_is_csv(item):
     return item.endswith(".csv")
 
 
+def filter_is_partition(item):
+    """
+    Returns true if the item is a partition file (csv or parquet)
+    """
+    return item.endswith(partition_extensions)
+
+
 def _check_keys(dict_, required_keys):
     """checks if a dict contains all expected keys"""
     for key in required_keys:
@@ -48,22 +81,70 @@ def _check_keys(dict_, required_keys):
             raise ValueError(f'input argument "data_files" is missing required key "{key}"')
         
 
-def get_data(input_folder, from_date=None, to_date=None):
-    """
-    Get the aggregated dataframe, consisting of all data inside 'input_folder'
-    between 'from_date' and 'to_date'
-    
-    Args:
-       input_folder (str): specifying the folder which stores the data
-       from_date (Optional[str]): earliest start date to filter data
-       to_date (Optional[str]): last date to filter data
-    Returns:
-       pd.DataFrame: aggregated data frame
-    """
-    
-    list_of_files = []
+def _read_partition_arrow(path, use_threads=True):
+    """reads a single partition into a pyarrow table with the known column types"""
+    import pyarrow as pa
+    from pyarrow import csv
+    import pyarrow.parquet as pq
+
+    if get_file_format(path) == "parquet":
+        return pq.read_table(path, use_threads=use_threads)
+
+    convert_options = csv.ConvertOptions(
+        column_types={col: pa.type_for_alias(type_) for col, type_ in _column_types.items()})
+    read_options = csv.ReadOptions(use_threads=use_threads)
+    return csv.read_csv(path, read_options=read_options, convert_options=convert_options)
+
+
+def _concat_tables(tables):
+    """concatenates pyarrow tables, unifying schemas of columns without known type"""
+    import pyarrow as pa
+
+    try:
+        return pa.concat_tables(tables, promote_options="default")
+    except TypeError:
+        # pyarrow < 14 does not know 'promote_options'
+        return pa.concat_tables(tables, promote=True)
+
+
+def _read_tables_arrow(paths, n_workers=None, executor="thread"):
+    """reads all csv partitions in 'paths' concurrently into a list of pyarrow tables"""
+    if executor == "thread":
+        pool_cls = ThreadPoolExecutor
+    elif executor == "process":
+        pool_cls = ProcessPoolExecutor
+    else:
+        raise ValueError(f'executor must be "thread" or "process", got "{executor}"')
+
+    # files are read in parallel, so every single file is parsed single-threaded
+    # to avoid oversubscribing the cores
+    use_threads = n_workers == 1
+    if n_workers == 1:
+        tables = [_read_partition_arrow(path, use_threads) for path in paths]
+    else:
+        with pool_cls(max_workers=n_workers) as pool:
+            tables = list(pool.map(_read_partition_arrow, paths,
+                                   [use_threads] * len(paths)))
+    return tables
+
+
+def _read_partitions_arrow(paths, n_workers=None, executor="thread"):
+    """reads all csv partitions in 'paths' concurrently and returns one data frame"""
+    return _concat_tables(_read_tables_arrow(paths, n_workers, executor)).to_pandas()
+
+
+def _read_frames(paths, engine="pandas", n_workers=None, executor="thread"):
+    """reads the csv partitions in 'paths' into one data frame per partition"""
+    if engine == "pyarrow":
+        return [table.to_pandas() for table in _read_tables_arrow(paths, n_workers, executor)]
+    elif engine == "pandas":
+        return [read_frame(path) for path in paths]
+    raise ValueError(f'engine must be "pandas" or "pyarrow", got "{engine}"')
 
-    logger.info(f"reads csv files from nested folder {input_folder}")
+
+def _list_partitions(input_folder, from_date=None, to_date=None):
+    """lists the partition files inside 'input_folder' between 'from_date' and 'to_date'"""
+    list_of_files = []
 
     for (dirpath, dirnames, filenames) in os.walk(input_folder):
         list_of_files += [os.path.join(dirpath, file) for file in filenames]
@@ -73,8 +154,8 @@ def get_data(input_folder, from_date=None, to_date=None):
     # Make relative paths from absolute file paths
     rel_paths = [os.path.relpath(item, input_folder) for item in list_of_files]
 
-    # Filter out non-csv files
-    rel_paths = filter(filter_is_csv, rel_paths)
+    # Filter out files that are no partitions
+    rel_paths = filter(filter_is_partition, rel_paths)
 
     # Filter out files before from_date
     rel_paths = filter(lambda x: filter_from_date(
@@ -84,17 +165,102 @@ def get_data(input_folder, from_date=None, to_date=None):
     rel_paths = filter(lambda x: filter_to_date(x, to_date), rel_paths)
 
     # Get absolute paths
-    abs_paths = [os.path.join(input_folder, item) for item in rel_paths]
+    return [os.path.join(input_folder, item) for item in rel_paths]
 
-    # Concate all files
-    dfs = []
-    for item in abs_paths:
-        dfs.append(pd.read_csv(item))
 
-    return pd.concat(dfs)
+def get_data(input_folder, from_date=None, to_date=None, engine="pandas",
+             n_workers=None, executor="thread", use_catalog=False):
+    """
+    Get the aggregated dataframe, consisting of all data inside 'input_folder'
+    between 'from_date' and 'to_date'
     
+    Args:
+       input_folder (str): specifying the folder which stores the data
+       from_date (Optional[str]): earliest start date to filter data
+       to_date (Optional[str]): last date to filter data
+       engine (str): 'pandas' reads the files one after the other with pd.read_csv,
+         'pyarrow' reads them concurrently with the multithreaded pyarrow csv reader
+         and builds the data frame in one step
+       n_workers (Optional[int]): size of the worker pool used by the 'pyarrow' engine.
+         Defaults to the number of cores
+       executor (str): 'thread' or 'process', the kind of worker pool used by the
+         'pyarrow' engine
+       use_catalog (bool): resolve the files of the date range with the partition catalog
+         stored next to 'input_folder' instead of walking the whole folder
+    Returns:
+       pd.DataFrame: aggregated data frame
+    """
     
-def ingest_data(input_folder, data_files, from_date=None, to_date=None):
+    logger.info(f"reads csv files from nested folder {input_folder}")
+
+    if use_catalog:
+        abs_paths = query_partitions(input_folder, from_date, to_date)
+        logger.info(f"resolved {len(abs_paths)} CSV files from the partition catalog")
+    else:
+        abs_paths = _list_partitions(input_folder, from_date, to_date)
+
+    start = time.time()
+
+    if engine == "pyarrow":
+        if not abs_paths:
+            raise ValueError(f"no csv files found in {input_folder} between {from_date} and {to_date}")
+        df = _read_partitions_arrow(abs_paths, n_workers, executor)
+    elif engine == "pandas":
+        # Concate all files
+        dfs = []
+        for item in abs_paths:
+            dfs.append(read_frame(item))
+        df = pd.concat(dfs)
+    else:
+        raise ValueError(f'engine must be "pandas" or "pyarrow", got "{engine}"')
+
+    duration = max(time.time() - start, 1e-9)
+    logger.info(f"read {len(abs_paths)} files ({len(df)} rows) in {round(duration, 3)} seconds: "
+                f"{round(len(abs_paths) / duration, 1)} files/sec, {round(len(df) / duration)} rows/sec")
+
+    return df
+    
+    
+def _ingest_incremental(input_folder, output_file, paths, engine="pandas", n_workers=None,
+                        executor="thread"):
+    """
+    Brings the aggregated raw data file up to date with the partitions in 'paths'. Only
+    new or changed partitions are read. Rows of changed or deleted partitions are cut out
+    of the raw data file, the new versions are appended.
+    """
+    start = time.time()
+    manifest = ingest_manifest.load_manifest(output_file, input_folder)
+    if manifest is None:
+        manifest = ingest_manifest.new_manifest(input_folder)
+
+    to_write, changed, deleted = ingest_manifest.plan_ingestion(manifest, input_folder, paths)
+    logger.info(f"incremental ingestion: {len(to_write) - len(changed)} new, {len(changed)} changed, "
+                f"{len(deleted)} deleted, {len(paths) - len(to_write)} unchanged partitions")
+
+    rel_paths = list(to_write)
+    frames = _read_frames([os.path.join(input_folder, rel_path) for rel_path in rel_paths],
+                          engine, n_workers, executor)
+    frames = dict(zip(rel_paths, frames))
+
+    # checked before anything is written, partitions without some of the columns are
+    # appended with these columns empty
+    unknown = ingest_manifest.unknown_columns(manifest, frames)
+    if unknown:
+        logger.info(f"the partitions have the new columns {unknown}, rebuilding the raw data from scratch")
+        os.remove(ingest_manifest.get_manifest_path(output_file))
+        return _ingest_incremental(input_folder, output_file, paths, engine, n_workers, executor)
+
+    if changed or deleted:
+        ingest_manifest.remove_partitions(output_file, manifest, changed + deleted)
+    ingest_manifest.append_partitions(output_file, manifest, frames, to_write)
+    ingest_manifest.save_manifest(output_file, manifest)
+
+    n_rows = sum(len(df) for df in frames.values())
+    logger.info(f"ingested {len(frames)} partitions ({n_rows} rows) in {round(time.time() - start, 3)} seconds")
+
+
+def ingest_data(input_folder, data_files, from_date=None, to_date=None, engine="pandas",
+                n_workers=None, executor="thread", use_catalog=False, incremental=False):
     """
     Save the aggregated dataframe, consisting of all data inside 'input_folder'
     between 'from_date' and 'to_date', to the location specified in
@@ -106,6 +272,13 @@ def ingest_data(input_folder, data_files, from_date=None, to_date=None):
           location of the output data
         from_date (Optional[str]): earliest start date to filter data
         to_date (Optional[str]): last date to filter data
+        engine (str): csv reader engine, 'pandas' or 'pyarrow' (see 'get_data')
+        n_workers (Optional[int]): size of the worker pool of the 'pyarrow' engine
+        executor (str): 'thread' or 'process' worker pool of the 'pyarrow' engine
+        use_catalog (bool): resolve the input files with the partition catalog
+        incremental (bool): keep a manifest of the ingested partitions next to the output
+          file and only read partitions that are new or changed since the last run. Rows
+          of changed or deleted partitions are replaced, everything else is kept
     
     Returns:
         pd.DataFrame: aggregated data frame
@@ -114,14 +287,28 @@ def ingest_data(input_folder, data_files, from_date=None, to_date=None):
     _check_keys(data_files, ["raw_data_file"])
     output_file = data_files['raw_data_file']
     
-    df = get_data(input_folder, from_date, to_date)
-        
     if not os.path.exists(os.path.dirname(output_file)):
         os.mkdir(os.path.dirname(output_file))
 
-    df.to_csv(output_file, index=False)
+    if incremental:
+        if get_file_format(output_file) != "csv":
+            raise ValueError(f"incremental ingestion appends to a csv file, got {output_file}")
+        if use_catalog:
+            paths = query_partitions(input_folder, from_date, to_date)
+        else:
+            paths = _list_partitions(input_folder, from_date, to_date)
+        _ingest_incremental(input_folder, output_file, paths, engine, n_workers, executor)
+    else:
+        df = get_data(input_folder, from_date, to_date, engine=engine,
+                      n_workers=n_workers, executor=executor, use_catalog=use_catalog)
+        write_frame(df, output_file)
+
+        # a full rebuild invalidates the manifest of previous incremental runs
+        manifest_file = ingest_manifest.get_manifest_path(output_file)
+        if os.path.isfile(manifest_file):
+            os.remove(manifest_file)
 
-    logger.info(f"Successfully saved csv {output_file}")
+    logger.info(f"Successfully saved {output_file}")
 
 
 if __name__ == "__main__":
@@ -131,7 +318,18 @@ if __name__ == "__main__":
                         help='dict including key "raw_data_file" where ingested data will be saved')
     parser.add_argument('--from_date', type=str, help='From date')
     parser.add_argument('--to_date', type=str, help='To date')
+    parser.add_argument('--engine', type=str, default='pandas',
+                        help='csv reader engine, "pandas" or "pyarrow"')
+    parser.add_argument('--n_workers', type=int, help='number of parallel readers')
+    parser.add_argument('--executor', type=str, default='thread',
+                        help='worker pool, "thread" or "process"')
+    parser.add_argument('--use_catalog', action='store_true',
+                        help='resolve the input files with the partition catalog')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only ingest new or changed partitions')
 
     args = parser.parse_args()
     ingest_data(args.input_folder, args.data_files,
-                from_date=args.from_date, to_date=args.to_date)
\ No newline at end of file
+                from_date=args.from_date, to_date=args.to_date, engine=args.engine,
+                n_workers=args.n_workers, executor=args.executor, use_catalog=args.use_catalog,
+                incremental=args.incremental)
\ No newline at end of file
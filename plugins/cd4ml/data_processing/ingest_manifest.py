@@ -0,0 +1,206 @@
+# Author:      CD4ML Working Group @ D ONE
+# Description: Manifest of the partitions that were already ingested into the
+#              aggregated raw data file. It is used by the incremental mode of
+#              'ingest_data' to only read new or changed partitions. Every
+#              partition occupies one contiguous byte range of the raw data file,
+#              so changed or deleted partitions can be cut out without parsing
+#              the rest of the file.
+# ================================================================================
+
+import os
+import json
+import shutil
+import pandas as pd
+from cd4ml.utils.fingerprint import file_hash
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def get_manifest_path(raw_data_file):
+    """returns the location of the manifest of 'raw_data_file'"""
+    return raw_data_file + ".manifest.json"
+
+
+def new_manifest(input_folder):
+    """returns an empty manifest for the partitions of 'input_folder'"""
+    return {
+        "input_folder": os.path.abspath(input_folder),
+        "columns": None,
+        "header_length": None,
+        "raw_data_size": 0,
+        "partitions": {},
+    }
+
+
+def load_manifest(raw_data_file, input_folder):
+    """
+    Loads the manifest of 'raw_data_file' if it can be used for an incremental update
+
+    Args:
+        raw_data_file (str): location of the aggregated raw data
+        input_folder (str): the partitioned data folder that is ingested
+
+    Returns:
+        Optional[dict]: the manifest, None if the raw data has to be rebuilt from scratch
+    """
+    manifest_file = get_manifest_path(raw_data_file)
+    if not os.path.isfile(manifest_file) or not os.path.isfile(raw_data_file):
+        logger.info("no previous ingestion found")
+        return None
+
+    with open(manifest_file, "r") as f:
+        manifest = json.load(f)
+
+    if manifest["input_folder"] != os.path.abspath(input_folder):
+        logger.info(f"previous ingestion read from {manifest['input_folder']}")
+        return None
+    if manifest["raw_data_size"] != os.path.getsize(raw_data_file):
+        logger.info(f"{raw_data_file} was modified outside of the incremental ingestion")
+        return None
+    return manifest
+
+
+def save_manifest(raw_data_file, manifest):
+    """writes the manifest of 'raw_data_file' atomically"""
+    manifest_file = get_manifest_path(raw_data_file)
+    with open(manifest_file + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=4)
+    os.replace(manifest_file + ".tmp", manifest_file)
+
+
+def plan_ingestion(manifest, input_folder, paths):
+    """
+    Compares the partition files with the manifest. A file is unchanged if its size
+    and mtime did not change, otherwise its content hash decides.
+
+    Args:
+        manifest (dict): manifest of the previous ingestion
+        input_folder (str): the partitioned data folder
+        paths (List[str]): absolute paths of the partitions that should be ingested
+
+    Returns:
+        Tuple[dict, List[str], List[str]]: the file stats of all partitions to (re)write
+          keyed by relative path, the relative paths of the changed partitions and the
+          relative paths of the deleted partitions
+    """
+    partitions = manifest["partitions"]
+    to_write, changed = {}, []
+
+    for path in paths:
+        rel_path = os.path.relpath(path, input_folder)
+        stat = os.stat(path)
+        entry = partitions.get(rel_path)
+        if entry is not None and (entry["size"], entry["mtime_ns"]) == (stat.st_size, stat.st_mtime_ns):
+            continue
+
+        content_hash = file_hash(path)
+        if entry is not None and entry["hash"] == content_hash:
+            # only touched, the ingested rows are still valid
+            entry["mtime_ns"] = stat.st_mtime_ns
+            continue
+
+        if entry is not None:
+            changed.append(rel_path)
+        to_write[rel_path] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns,
+                              "hash": content_hash}
+
+    current = {os.path.relpath(path, input_folder) for path in paths}
+    deleted = [rel_path for rel_path in partitions if rel_path not in current]
+
+    return to_write, changed, deleted
+
+
+def remove_partitions(raw_data_file, manifest, rel_paths):
+    """
+    Cuts the byte ranges of the given partitions out of the raw data file by copying
+    the header and all remaining ranges into a new file
+
+    Args:
+        raw_data_file (str): location of the aggregated raw data
+        manifest (dict): manifest of the previous ingestion, updated in place
+        rel_paths (List[str]): relative paths of the partitions to remove
+    """
+    partitions = manifest["partitions"]
+    for rel_path in rel_paths:
+        partitions.pop(rel_path)
+
+    kept = sorted(partitions.items(), key=lambda item: item[1]["offset"])
+    tmp_file = raw_data_file + ".tmp"
+    with open(raw_data_file, "rb") as src, open(tmp_file, "wb") as dst:
+        dst.write(src.read(manifest["header_length"]))
+        for rel_path, entry in kept:
+            src.seek(entry["offset"])
+            entry["offset"] = dst.tell()
+            shutil.copyfileobj(_LimitedReader(src, entry["length"]), dst)
+    os.replace(tmp_file, raw_data_file)
+
+    manifest["raw_data_size"] = os.path.getsize(raw_data_file)
+    logger.info(f"removed {len(rel_paths)} partitions from {raw_data_file}")
+
+
+class _LimitedReader:
+    """file-like wrapper that reads at most 'length' bytes from 'f'"""
+
+    def __init__(self, f, length):
+        self.f = f
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.f.read(size)
+        self.remaining -= len(data)
+        return data
+
+
+def unknown_columns(manifest, frames):
+    """
+    Returns the columns of the partitions that the raw data file does not have. Such
+    partitions can't be appended, the raw data file has to be rebuilt.
+
+    Args:
+        manifest (dict): manifest of the previous ingestion
+        frames (dict): data frame of every partition keyed by relative path
+
+    Returns:
+        List[str]: the unknown columns, empty if all partitions can be appended
+    """
+    if manifest["columns"] is None:
+        return []
+    known = set(manifest["columns"])
+    return sorted({column for df in frames.values() for column in df.columns if column not in known})
+
+
+def append_partitions(raw_data_file, manifest, frames, stats):
+    """
+    Appends partitions to the raw data file and records their byte ranges. A new file
+    gets the columns of all partitions (like pd.concat), columns a partition lacks are
+    left empty.
+
+    Args:
+        raw_data_file (str): location of the aggregated raw data
+        manifest (dict): manifest of the ingestion, updated in place
+        frames (dict): data frame of every partition keyed by relative path
+        stats (dict): size, mtime and hash of every partition keyed by relative path
+    """
+    unknown = unknown_columns(manifest, frames)
+    if unknown:
+        raise ValueError(f"{raw_data_file} has no columns {unknown}, it has to be rebuilt")
+    columns = manifest["columns"]
+    mode = "ab" if columns is not None else "wb"
+
+    with open(raw_data_file, mode) as f:
+        if columns is None and frames:
+            columns = list(dict.fromkeys(column for df in frames.values() for column in df.columns))
+            f.write(pd.DataFrame(columns=columns).to_csv(index=False).encode())
+            manifest["columns"] = columns
+            manifest["header_length"] = f.tell()
+
+        for rel_path, df in frames.items():
+            offset = f.tell()
+            f.write(df.reindex(columns=columns).to_csv(index=False, header=False).encode())
+            manifest["partitions"][rel_path] = dict(
+                stats[rel_path], offset=offset, length=f.tell() - offset, n_rows=len(df))
+
+    manifest["raw_data_size"] = os.path.getsize(raw_data_file)
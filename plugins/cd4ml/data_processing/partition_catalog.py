@@ -0,0 +1,211 @@
+# Author:      CD4ML Working Group @ D ONE
+# Description: Persistent catalog of the date partitions of a raw data folder
+#              (e.g. /data/batch1/<year>/<month>/<day>.csv). The catalog is a small
+#              SQLite database stored next to the data folder, which allows to
+#              resolve the partitions of a date range without listing folders.
+#              Writers keep it current with 'update_catalog', a full refresh
+#              (stats all files, reads the new or modified ones) is explicit.
+# ================================================================================
+
+import argparse
+import os
+import sqlite3
+from contextlib import closing
+from datetime import datetime
+import pandas as pd
+from cd4ml.data_processing.file_io import read_frame
+import logging
+
+logger = logging.getLogger(__name__)
+
+_date_format = "%Y-%m-%d %H:%M:%S"
+partition_extensions = (".csv", ".parquet")
+
+_schema = """
+CREATE TABLE IF NOT EXISTS partitions (
+    path TEXT PRIMARY KEY,
+    date TEXT NOT NULL,
+    n_rows INTEGER,
+    n_bytes INTEGER,
+    mtime REAL,
+    min_measured_at TEXT,
+    max_measured_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_partitions_date ON partitions (date);
+CREATE TABLE IF NOT EXISTS partition_turbines (
+    path TEXT NOT NULL,
+    wt_sk INTEGER NOT NULL,
+    PRIMARY KEY (path, wt_sk)
+);
+CREATE INDEX IF NOT EXISTS idx_partition_turbines_wt_sk ON partition_turbines (wt_sk);
+"""
+
+
+def get_catalog_path(input_folder):
+    """returns the location of the catalog of 'input_folder' (next to the folder)"""
+    return os.path.normpath(input_folder) + ".catalog.sqlite"
+
+
+def _partition_date(rel_path):
+    """parses the partition date from a relative path like '2020/1/15.csv'"""
+    item = os.path.splitext(rel_path)[0]
+    try:
+        return datetime(*[int(part) for part in item.split(os.sep)]).strftime(_date_format)
+    except (TypeError, ValueError):
+        # same interpretation as 'filter_from_date' and 'filter_to_date'
+        return pd.to_datetime(item).strftime(_date_format)
+
+
+def _to_catalog_date(date):
+    """converts a user supplied date bound to the catalog date format"""
+    return pd.to_datetime(date).strftime(_date_format)
+
+
+def _connect(input_folder):
+    """opens (and if needed creates) the catalog of 'input_folder'"""
+    connection = sqlite3.connect(get_catalog_path(input_folder))
+    connection.executescript(_schema)
+    return connection
+
+
+def _partition_record(input_folder, path, df=None):
+    """collects the catalog record of a single partition file"""
+    stat = os.stat(path)
+    if df is None:
+        df = read_frame(path, columns=["wt_sk", "measured_at"])
+    rel_path = os.path.relpath(path, input_folder)
+    record = {
+        "path": rel_path,
+        "date": _partition_date(rel_path),
+        "n_rows": len(df),
+        "n_bytes": stat.st_size,
+        "mtime": stat.st_mtime,
+        "min_measured_at": str(df["measured_at"].min()) if len(df) else None,
+        "max_measured_at": str(df["measured_at"].max()) if len(df) else None,
+    }
+    turbines = [int(wt_sk) for wt_sk in pd.unique(df["wt_sk"].dropna())]
+    return record, turbines
+
+
+def _write_records(connection, records):
+    """upserts partition records and their turbines into the catalog"""
+    with connection:
+        for record, turbines in records:
+            connection.execute(
+                "INSERT OR REPLACE INTO partitions VALUES "
+                "(:path, :date, :n_rows, :n_bytes, :mtime, :min_measured_at, :max_measured_at)",
+                record)
+            connection.execute("DELETE FROM partition_turbines WHERE path = ?", (record["path"],))
+            connection.executemany("INSERT INTO partition_turbines VALUES (?, ?)",
+                                   [(record["path"], wt_sk) for wt_sk in turbines])
+
+
+def update_catalog(input_folder, paths, frames=None):
+    """
+    Adds or refreshes the catalog entries of the given partition files. Paths that do
+    not exist anymore are removed from the catalog.
+
+    Args:
+        input_folder (str): the partitioned data folder
+        paths (List[str]): absolute paths of the partition files that were written
+        frames (Optional[dict]): maps a path to the data frame that was written to it,
+          which avoids reading the file again to collect the statistics
+    """
+    frames = frames or {}
+    records, removed = [], []
+    for path in paths:
+        if os.path.isfile(path):
+            records.append(_partition_record(input_folder, path, frames.get(path)))
+        else:
+            removed.append(os.path.relpath(path, input_folder))
+
+    with closing(_connect(input_folder)) as connection:
+        _write_records(connection, records)
+        with connection:
+            connection.executemany("DELETE FROM partitions WHERE path = ?", [(p,) for p in removed])
+            connection.executemany("DELETE FROM partition_turbines WHERE path = ?",
+                                   [(p,) for p in removed])
+
+    logger.info(f"updated {len(records)} and removed {len(removed)} partitions in "
+                f"{get_catalog_path(input_folder)}")
+
+
+def refresh_catalog(input_folder):
+    """
+    Synchronizes the catalog with the files on disk. Only new or modified partitions
+    (by size and mtime) are read, deleted partitions are dropped from the catalog.
+
+    Args:
+        input_folder (str): the partitioned data folder
+    """
+    with closing(_connect(input_folder)) as connection:
+        known = {path: (n_bytes, mtime) for path, n_bytes, mtime in
+                 connection.execute("SELECT path, n_bytes, mtime FROM partitions")}
+
+    changed = []
+    for (dirpath, dirnames, filenames) in os.walk(input_folder):
+        for file in filenames:
+            if not file.endswith(partition_extensions):
+                continue
+            path = os.path.join(dirpath, file)
+            rel_path = os.path.relpath(path, input_folder)
+            stat = os.stat(path)
+            if known.pop(rel_path, None) != (stat.st_size, stat.st_mtime):
+                changed.append(path)
+
+    deleted = [os.path.join(input_folder, path) for path in known]
+    if changed or deleted:
+        update_catalog(input_folder, changed + deleted)
+
+
+def query_partitions(input_folder, from_date=None, to_date=None, wt_sks=None, refresh=False):
+    """
+    Resolves the partition files between 'from_date' and 'to_date' (both included) with
+    an indexed range query on the catalog. The catalog is built if it does not exist yet,
+    otherwise the folder is only walked if 'refresh' is set.
+
+    Args:
+        input_folder (str): the partitioned data folder
+        from_date (Optional[str]): earliest partition date
+        to_date (Optional[str]): last partition date
+        wt_sks (Optional[List[int]]): only return partitions containing these turbines
+        refresh (bool): synchronize the catalog with the files on disk first, needed if
+          partitions were added without 'update_catalog' (e.g. copied into the folder)
+
+    Returns:
+        List[str]: absolute paths of the matching partition files, ordered by date
+    """
+    if not os.path.isfile(get_catalog_path(input_folder)):
+        logger.info(f"no partition catalog for {input_folder} yet, building it")
+        refresh_catalog(input_folder)
+    elif refresh:
+        refresh_catalog(input_folder)
+
+    query = "SELECT DISTINCT p.path, p.date FROM partitions p"
+    conditions, params = [], []
+    if wt_sks is not None:
+        query += " JOIN partition_turbines t ON t.path = p.path"
+        conditions.append(f"t.wt_sk IN ({', '.join('?' * len(wt_sks))})")
+        params += [int(wt_sk) for wt_sk in wt_sks]
+    if from_date is not None:
+        conditions.append("p.date >= ?")
+        params.append(_to_catalog_date(from_date))
+    if to_date is not None:
+        conditions.append("p.date <= ?")
+        params.append(_to_catalog_date(to_date))
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY p.date, p.path"
+
+    with closing(_connect(input_folder)) as connection:
+        rows = connection.execute(query, params).fetchall()
+
+    return [os.path.join(input_folder, path) for path, _ in rows]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Build or refresh a partition catalog')
+    parser.add_argument('--input_folder', type=str, help='Partitioned data folder')
+
+    args = parser.parse_args()
+    refresh_catalog(args.input_folder)
@@ -5,18 +5,45 @@
 
 import os
 import pandas as pd
+from cd4ml.data_processing.file_io import FrameWriter, iter_frames, read_frame, write_frame
 from datetime import datetime, timedelta
 import logging
 
 logger = logging.getLogger(__name__)
 
+_date_format = '%Y-%m-%d'
+
 
 def _check_keys(dict_, required_keys):
     """checks if a dict contains all expected keys"""
     for key in required_keys:
         if key not in dict_:
             raise ValueError(f'input argument "data_files" is missing required key "{key}"')
-        
+
+
+def _get_date_key(measured_at):
+    """vectorized date (YYYY-MM-DD) of the measured_at column"""
+    return measured_at.str[:10]
+
+
+def _get_test_dates(max_date_str, n_days_test):
+    """the n_days_test last dates up to and including max_date_str"""
+    max_date = datetime.strptime(max_date_str, _date_format)
+    return [datetime.strftime(max_date - timedelta(days=i), _date_format)
+            for i in range(n_days_test)]
+
+
+def _get_date_range(input_file, chunksize):
+    """streams the measured_at column of 'input_file' to find its first and last date"""
+    min_date_str, max_date_str = None, None
+    for chunk in iter_frames(input_file, chunksize, columns=['measured_at']):
+        if len(chunk) == 0:
+            continue
+        date = _get_date_key(chunk['measured_at'])
+        min_date_str = min(filter(None, [min_date_str, date.min()]))
+        max_date_str = max(filter(None, [max_date_str, date.max()]))
+    return min_date_str, max_date_str
+
 
 def get_train_test_split(df, n_days_test):
     """
@@ -30,24 +57,99 @@ def get_train_test_split(df, n_days_test):
     Returns:
         Tuple[pd.DataFrame]: raw train and test data splits
     """
+    date = _get_date_key(df['measured_at'])
 
-    df['date'] = df['measured_at'].apply(lambda x: x[:10])
+    min_date_str = date.min()
+    test_dates = _get_test_dates(date.max(), n_days_test)
 
-    min_date_str = df['date'].min()
-    max_date = datetime.strptime(df['date'].max(), '%Y-%m-%d')
-    test_dates = [datetime.strftime(max_date - timedelta(days=i), '%Y-%m-%d') 
-                  for i in range(n_days_test)]
+    is_test = date.isin(test_dates)
+    df_train = df[~is_test]
+    df_test = df[is_test]
     
-    df_train = df[~df['date'].isin(test_dates)].drop('date', axis=1)
-    df_test = df[df['date'].isin(test_dates)].drop('date', axis=1)
-    
-    logger.info(f"trainset goes from {min_date_str} until {min(test_dates)} (not included)")
-    logger.info(f"testset goes from {min(test_dates)} until {max(test_dates)}")
+    logger.info(f"trainset goes from {min_date_str} until {min(test_dates)} (not included)")
+    logger.info(f"testset goes from {min(test_dates)} until {max(test_dates)}")
     
     return df_train, df_test
-    
+
+
+def get_backtest_folds(max_date_str, n_days_test, n_folds, step_days=None, mode='expanding',
+                       train_days=None):
+    """
+    Defines the date windows of a rolling-origin backtest. The last fold is the split
+    of 'get_train_test_split', every earlier fold moves the origin 'step_days' back.
+
+    Args:
+        max_date_str (str): last date (YYYY-MM-DD) of the data
+        n_days_test (int): number of days of every test window
+        n_folds (int): number of folds
+        step_days (Optional[int]): days between the origins of two folds, defaults
+          to n_days_test (non-overlapping test windows)
+        mode (str): 'expanding' trains on all data before the test window, 'rolling'
+          only on the 'train_days' days before it
+        train_days (Optional[int]): length of the training window in 'rolling' mode
+
+    Returns:
+        List[dict]: 'train_start' (None for all history), 'test_start' and 'test_end'
+          (included) dates of every fold, oldest fold first
+    """
+    if mode not in ('expanding', 'rolling'):
+        raise ValueError(f'mode must be "expanding" or "rolling", got "{mode}"')
+    if mode == 'rolling' and train_days is None:
+        raise ValueError('train_days is required in "rolling" mode')
+    step_days = step_days or n_days_test
+
+    max_date = datetime.strptime(max_date_str, _date_format)
+    folds = []
+    for k in reversed(range(n_folds)):
+        test_end = max_date - timedelta(days=k * step_days)
+        test_start = test_end - timedelta(days=n_days_test - 1)
+        train_start = test_start - timedelta(days=train_days) if mode == 'rolling' else None
+        folds.append({
+            'train_start': datetime.strftime(train_start, _date_format) if train_start else None,
+            'test_start': datetime.strftime(test_start, _date_format),
+            'test_end': datetime.strftime(test_end, _date_format),
+        })
+    return folds
+
+
+def _route_fold(date, fold):
+    """boolean train and test masks of the rows with the given dates for one fold"""
+    is_test = (date >= fold['test_start']) & (date <= fold['test_end'])
+    is_train = date < fold['test_start']
+    if fold['train_start'] is not None:
+        is_train &= date >= fold['train_start']
+    return is_train, is_test
+
+
+def get_backtest_splits(df, n_days_test, n_folds, step_days=None, mode='expanding',
+                        train_days=None):
+    """
+    Splits the input data frame into the train and test sets of a rolling-origin backtest
+
+    Args:
+        df (pd.DataFrame): raw input data
+        n_days_test (int): number of days of every test window
+        n_folds (int): number of folds
+        step_days (Optional[int]): days between the origins of two folds
+        mode (str): 'expanding' or 'rolling' training window (see 'get_backtest_folds')
+        train_days (Optional[int]): length of the training window in 'rolling' mode
+
+    Yields:
+        Tuple[pd.DataFrame]: raw train and test data of every fold, oldest fold first
+    """
+    date = _get_date_key(df['measured_at'])
+    for fold in get_backtest_folds(date.max(), n_days_test, n_folds, step_days, mode, train_days):
+        is_train, is_test = _route_fold(date, fold)
+        yield df[is_train], df[is_test]
+
+
+def get_fold_file(path, fold):
+    """location of a per fold output file, e.g. data_train.csv -> data_train_fold0.csv"""
+    root, extension = os.path.splitext(path)
+    return f"{root}_fold{fold}{extension}"
+
         
-def split_train_test(data_files, n_days_test=10, **kwargs):
+def split_train_test(data_files, n_days_test=10, chunksize=None, **kwargs):
     """
     Splits the input data frame into a training and test set and saves them to disk
 
@@ -58,6 +160,8 @@ def split_train_test(data_files, n_days_test=10, **kwargs):
           'raw_test_file': location of the raw output test data
         n_days_test (int): number of days to consider for test split. The n_days_test last 
           days of the input data will be selected for the test split
+        chunksize (Optional[int]): stream the raw data in chunks of this many rows instead
+          of loading it at once. The outputs are the same as without chunks
 
     Returns:
         Tuple[pd.DataFrame]: raw train and test data splits
@@ -72,12 +176,82 @@ def split_train_test(data_files, n_days_test=10, **kwargs):
     input_file = data_files['raw_data_file']
     output_train_file = data_files['raw_train_file']
     output_test_file = data_files['raw_test_file']
-    
-    df = pd.read_csv(input_file)
-    logger.info(f"loaded {input_file} successfully")
 
-    df_train, df_test = get_train_test_split(df, n_days_test)
-    
-    df_train.to_csv(output_train_file, index=False)
-    
-    df_test.to_csv(output_test_file, index=False)
\ No newline at end of file
+    if chunksize is None:
+        df = read_frame(input_file)
+        logger.info(f"loaded {input_file} successfully")
+
+        df_train, df_test = get_train_test_split(df, n_days_test)
+
+        write_frame(df_train, output_train_file)
+
+        write_frame(df_test, output_test_file)
+        return
+
+    # first pass: only the dates, second pass: route every chunk to its split
+    min_date_str, max_date_str = _get_date_range(input_file, chunksize)
+    test_dates = _get_test_dates(max_date_str, n_days_test)
+
+    with FrameWriter(output_train_file) as train_writer, FrameWriter(output_test_file) as test_writer:
+        for chunk in iter_frames(input_file, chunksize):
+            is_test = _get_date_key(chunk['measured_at']).isin(test_dates)
+            train_writer.write(chunk[~is_test])
+            test_writer.write(chunk[is_test])
+
+    logger.info(f"trainset goes from {min_date_str} until {min(test_dates)} (not included), "
+                f"{train_writer.n_rows} rows")
+    logger.info(f"testset goes from {min(test_dates)} until {max(test_dates)}, {test_writer.n_rows} rows")
+
+
+def split_backtest(data_files, n_days_test=10, n_folds=3, step_days=None, mode='expanding',
+                   train_days=None, chunksize=None, **kwargs):
+    """
+    Splits the input data into the train and test sets of a rolling-origin backtest and
+    saves them next to data_files['raw_train_file'] and data_files['raw_test_file'] with
+    the suffix '_fold<i>' (see 'get_fold_file'). The last fold equals 'split_train_test'.
+
+    Args:
+        data_files (dict): contains the keys 'raw_data_file', 'raw_train_file' and
+          'raw_test_file' (see 'split_train_test')
+        n_days_test (int): number of days of every test window
+        n_folds (int): number of folds
+        step_days (Optional[int]): days between the origins of two folds, defaults
+          to n_days_test
+        mode (str): 'expanding' or 'rolling' training window (see 'get_backtest_folds')
+        train_days (Optional[int]): length of the training window in 'rolling' mode
+        chunksize (Optional[int]): stream the raw data in chunks of this many rows
+
+    Returns:
+        List[dict]: the date windows of the folds (see 'get_backtest_folds')
+    """
+    _check_keys(data_files, ['raw_data_file', 'raw_train_file', 'raw_test_file'])
+    input_file = data_files['raw_data_file']
+
+    if chunksize is None:
+        chunks = [read_frame(input_file)]
+        max_date_str = _get_date_key(chunks[0]['measured_at']).max()
+    else:
+        chunks = iter_frames(input_file, chunksize)
+        max_date_str = _get_date_range(input_file, chunksize)[1]
+    folds = get_backtest_folds(max_date_str, n_days_test, n_folds, step_days, mode, train_days)
+
+    writers = [(FrameWriter(get_fold_file(data_files['raw_train_file'], i)),
+                FrameWriter(get_fold_file(data_files['raw_test_file'], i)))
+               for i in range(len(folds))]
+    try:
+        for chunk in chunks:
+            date = _get_date_key(chunk['measured_at'])
+            for fold, (train_writer, test_writer) in zip(folds, writers):
+                is_train, is_test = _route_fold(date, fold)
+                train_writer.write(chunk[is_train])
+                test_writer.write(chunk[is_test])
+    finally:
+        for train_writer, test_writer in writers:
+            train_writer.close()
+            test_writer.close()
+
+    for i, (fold, (train_writer, test_writer)) in enumerate(zip(folds, writers)):
+        logger.info(f"fold {i}: train from {fold['train_start'] or 'start'} until {fold['test_start']} "
+                    f"(not included, {train_writer.n_rows} rows), test from {fold['test_start']} "
+                    f"until {fold['test_end']} ({test_writer.n_rows} rows)")
+    return folds
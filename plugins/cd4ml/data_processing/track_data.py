@@ -1,26 +1,37 @@
 # Author:      CD4ML Working Group @ D ONE
-# Description: Use this script to track the current version of the dataset 
-#              located at <data_dir/data.csv> using dvc.
+# Description: Use this script to track the current version of the dataset
+#              located at <data_dir/data.csv> using dvc. Changes are detected in
+#              process: a cheap (size, mtime, inode) fingerprint is compared with
+#              the last tracked version first, the file is only hashed if the
+#              fingerprint differs and dvc only adds and pushes real changes.
 # ================================================================================
 
 import os
+import json
+import time
 import subprocess as sp
+from contextlib import contextmanager
 from datetime import datetime
 import argparse
+from cd4ml.utils.fingerprint import file_fingerprint, chunked_file_hash
 
 import logging
 
 logger = logging.getLogger(__name__)
 
 
+def _run(args, cwd, check=True):
+    """runs a command without a shell"""
+    return sp.run(args, cwd=cwd, check=check)
+
+
 def _initialize_dvc(home_dir, data_dir):
     """initialize .dvc stored in 'home_dir' with data in 'data_dir'"""
     logger.info("initializing DVC repository")
-    sp.Popen("git init", shell=True).wait()
-    sp.Popen("dvc init", shell=True).wait()
-    sp.Popen(f"dvc remote add -d dvc_remote \
-        {os.path.join(home_dir, 'dvc_remote')}", shell=True).wait()
-    sp.Popen("git commit -m 'dvc setup'", shell=True).wait()
+    _run(["git", "init"], home_dir)
+    _run(["dvc", "init"], home_dir)
+    _run(["dvc", "remote", "add", "-d", "dvc_remote", os.path.join(home_dir, 'dvc_remote')], home_dir)
+    _run(["git", "commit", "-m", "dvc setup"], home_dir)
     logger.info("DVC setup committed to Git")
 
 
@@ -31,48 +42,116 @@ def _check_keys(dict_, required_keys):
             raise ValueError(f'input argument "data_files" is missing required key "{key}"')
 
 
+def _get_state_file(home_dir):
+    """location of the fingerprints of the tracked files (ignored by git within .dvc/tmp)"""
+    return os.path.join(home_dir, ".dvc", "tmp", "track_data_state.json")
+
+
+def _load_state(state_file):
+    """loads the fingerprints and hashes of the last tracked versions"""
+    if not os.path.isfile(state_file):
+        return {}
+    with open(state_file, "r") as f:
+        return json.load(f)
+
+
+def _save_state(state_file, state):
+    """saves the fingerprints and hashes of the tracked versions"""
+    os.makedirs(os.path.dirname(state_file), exist_ok=True)
+    with open(state_file + ".tmp", "w") as f:
+        json.dump(state, f, indent=4)
+    os.replace(state_file + ".tmp", state_file)
+
+
+@contextmanager
+def _timed(timings, phase):
+    """records the duration of a phase in seconds in 'timings'"""
+    start = time.time()
+    try:
+        yield
+    finally:
+        timings[phase] = round(time.time() - start, 3)
+
+
+def _dvc_add_and_push(home_dir, data_file, timings):
+    """adds a new version of 'data_file' to dvc, commits the .dvc file and pushes the data"""
+    from dvc.repo import Repo
+
+    repo = Repo(home_dir)
+    try:
+        with _timed(timings, "dvc_add"):
+            repo.add(data_file)
+
+        with _timed(timings, "git_commit"):
+            timestamp = datetime.now().strftime("%Y/%m/%d-%H:%M:%S")
+            _run(["git", "add", f"{data_file}.dvc"], home_dir)
+            # nothing to commit if dvc already tracked this version
+            if _run(["git", "diff", "--cached", "--quiet"], home_dir, check=False).returncode:
+                _run(["git", "commit", "-m", f"adding dataset version {timestamp}"], home_dir)
+                logger.info(f"Committed new dataset version {timestamp}")
+
+        with _timed(timings, "dvc_push"):
+            repo.push()
+        logger.info("Pushed data to remote")
+    finally:
+        repo.close()
+
+
 def track_data(home_dir, data_files, **kwargs):
     """
     Track the raw data stored in data_files['raw_data_file'] with .dvc located in the 'home_dir'
 
     Args:
         home_dir (str): location of the '.dvc' for data tracking
-        data_files (dict): including the key 'raw_data_file', specifying the location of the 
+        data_files (dict): including the key 'raw_data_file', specifying the location of the
           raw data
+
+    Returns:
+        dict: duration in seconds of every phase ('fingerprint', 'hash', 'dvc_add',
+          'git_commit', 'dvc_push'), phases that were skipped are missing
     """
 
     _check_keys(data_files, ['raw_data_file'])
-    
-    os.chdir(home_dir)
+    data_file = data_files['raw_data_file']
+    timings = {}
+
     # Check if DVC was already initialized
     if not os.path.exists(os.path.join(home_dir, ".dvc")):
         logger.info("DVC not yet initialized")
-        _initialize_dvc(home_dir, data_files['raw_data_file'])
-    
-    if not os.popen("dvc status").read() == "Data and pipelines are up to date.\n":
-        logger.info("Data update detected")
-        logger.info(os.popen("dvc status").read())
-        
-        # Track current version of dataset
-        current_time = datetime.now()
-        timestamp = current_time.strftime("%Y/%m/%d-%H:%M:%S")
-        sp.Popen(f"dvc add {data_files['raw_data_file']}", shell=True).wait()
-        sp.Popen(f"git add {data_files['raw_data_file']}.dvc", shell=True)\
-            .wait()
-        commit_msg = ' '.join(["adding dataset version", timestamp])
-        sp.Popen(f"git commit -m '{commit_msg}'", shell=True).wait()
-        logger.info(f"Committed new dataset version {timestamp}")
-        sp.Popen("dvc push", shell=True).wait()
-        logger.info("Pushed data to remote")
+        _initialize_dvc(home_dir, data_file)
+
+    state_file = _get_state_file(home_dir)
+    state = _load_state(state_file)
+    tracked = state.get(os.path.abspath(data_file))
+
+    with _timed(timings, "fingerprint"):
+        fingerprint = file_fingerprint(data_file)
+
+    if tracked is not None and tracked["fingerprint"] == fingerprint:
+        logger.info(f"Dataset did not change (same fingerprint). Nothing to track. Timings: {timings}")
+        return timings
+
+    with _timed(timings, "hash"):
+        content_hash = chunked_file_hash(data_file)
+
+    if tracked is not None and tracked["hash"] == content_hash:
+        logger.info("Dataset did not change (same content hash). Nothing to track.")
     else:
-        logger.info("Dataset did not change. Nothing to track.")
-    
-    
+        logger.info("Data update detected")
+        _dvc_add_and_push(home_dir, data_file, timings)
+
+    # dvc add may rewrite the file (e.g. as link to its cache), fingerprint it afterwards
+    state[os.path.abspath(data_file)] = {"fingerprint": file_fingerprint(data_file), "hash": content_hash}
+    _save_state(state_file, state)
+
+    logger.info(f"Tracked {data_file}. Timings: {timings}")
+    return timings
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Track data')
     parser.add_argument('--home_dir', type=str, help='root dir')
-    parser.add_argument('--data_files', type=dict, help='dict including the key "raw_data_file"')
+    parser.add_argument('--raw_data_file', type=str, help='location of the raw data')
 
     args = parser.parse_args()
-    track_data(args.home_dir, args.data_dir)
-    
\ No newline at end of file
+    track_data(args.home_dir, {'raw_data_file': args.raw_data_file})
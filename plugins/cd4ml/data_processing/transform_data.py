@@ -3,46 +3,36 @@
 #              and label set (y)
 # ================================================================================
 
-import os
-import time
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
+from cd4ml.data_processing.feature_transformer import FeatureTransformer
+from cd4ml.data_processing.file_io import read_columns, read_frame, write_frame
 import logging
 
 logger = logging.getLogger(__name__)
 
-pd.options.mode.chained_assignment = None  # default='warn'
 
-_errors_to_classify = [0, 3, 5, 7, 8]
-_min_power = 0.05
-
-
-def get_transformed_data(df):
+def get_transformed_data(df, transformer=None):
     """
     Transform raw data into input features and labels
 
     Args:
         df (pd.DataFrame): raw input data
+        transformer (Optional[FeatureTransformer]): fitted transformer, defaults to a
+          transformer with the default settings
     
     Returns:
         Tuple[pd.DataFrame]: transformed data frames (input features and labels)
     """
-    df = df[df['power'] > _min_power]
+    if transformer is None:
+        transformer = FeatureTransformer().fit(df)
+    return transformer.transform(df)
 
-    features = ['wind_speed', 'power', 'nacelle_direction', 'wind_direction',
-                'rotor_speed', 'generator_speed', 'temp_environment',
-                'temp_hydraulic_oil', 'temp_gear_bearing', 'cosphi',
-                'blade_angle_avg', 'hydraulic_pressure']
 
-    x = df[features].fillna(0)
-    if 'categories_sk' in df.columns:
-        df['categories_sk'] = df['categories_sk'].fillna(
-            0).apply(lambda x: int(x))
-        df['categories_sk'] = df['categories_sk'].apply(
-            lambda x: x if x in _errors_to_classify else 9)
-        y = df['categories_sk']
-    else:
-        y = pd.DataFrame(None)
-    return x, y
+def _get_input_columns(path, transformer):
+    """the raw columns needed by the transformer which are present in 'path'"""
+    needed = transformer.features + [transformer.label]
+    return [col for col in read_columns(path) if col in needed]
 
 
 def _check_keys(dict_, required_keys):
@@ -50,13 +40,27 @@ def _check_keys(dict_, required_keys):
     for key in required_keys:
         if key not in dict_:
             raise ValueError(f'input argument "data_files" is missing required key "{key}"')
+
+
+def _transform_file(transformer, raw_file, x_file, y_file):
+    """reads, transforms and saves one raw data file"""
+    df = read_frame(raw_file, columns=_get_input_columns(raw_file, transformer))
+    logger.info(f'loaded {raw_file} successfully')
+
+    x, y = transformer.transform(df)
+
+    write_frame(x, x_file)
+    logger.info(f'saved {x_file} successfully')
+
+    write_frame(y, y_file)
+    logger.info(f'saved {y_file} successfully')
     
     
-def transform_data(data_files, **kwargs):
+def transform_data(data_files, dtype='float64', **kwargs):
     """
     Reads the raw input training and test data from disk and transforms them 
-    according to the preprocessing function 'get_transformed_data'. Saves the output
-    x_train.csv, y_train.csv, x_test.csv and y_test.csv into the specified locations.
+    with a 'FeatureTransformer'. Saves the output x_train, y_train, x_test and y_test
+    into the specified locations. Training and test data are processed concurrently.
 
     Args:
         data_files (dict): contains the following keys:
@@ -66,6 +70,8 @@ def transform_data(data_files, **kwargs):
           'transformed_y_train_file': where to save the transformed training data (labels)
           'transformed_x_test_file': where to save the transformed test data (input features)
           'transformed_y_test_file': where to save the transformed test data (labels)
+          'feature_transformer_file' (optional): where to save the fitted transformer
+        dtype (str): dtype of the features, 'float64' or 'float32'
     """
     required_keys = [
         'raw_train_file',
@@ -76,25 +82,20 @@ def transform_data(data_files, **kwargs):
         'transformed_y_test_file',
     ]
     _check_keys(data_files, required_keys)
-    
-    df_train = pd.read_csv(data_files['raw_train_file'])
-    logger.info(f'loaded {data_files["raw_train_file"]} successfully')
-
-    df_test = pd.read_csv(data_files['raw_test_file'])
-    logger.info(f'loaded {data_files["raw_test_file"]} successfully')
-
-    x_train, y_train = get_transformed_data(df_train)
-
-    x_train.to_csv(data_files['transformed_x_train_file'], index=False)
-    logger.info('saved {data_files["transformed_x_train_file"]} successfully')
-    
-    y_train.to_csv(data_files['transformed_y_train_file'], index=False)
-    logger.info('saved {data_files["transformed_y_train_file"]} successfully')
-
-    x_test, y_test = get_transformed_data(df_test)
-
-    x_test.to_csv(data_files['transformed_x_test_file'], index=False)
-    logger.info('saved {data_files["transformed_x_test_file"]} successfully')
 
-    y_test.to_csv(data_files['transformed_y_test_file'], index=False)
-    logger.info('saved {data_files["transformed_y_test_file"]} successfully')
\ No newline at end of file
+    transformer = FeatureTransformer(dtype=dtype)
+    transformer.fit(pd.DataFrame(columns=read_columns(data_files['raw_train_file'])))
+
+    if 'feature_transformer_file' in data_files:
+        transformer.save(data_files['feature_transformer_file'])
+        logger.info(f'saved {data_files["feature_transformer_file"]} successfully')
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        futures = [
+            pool.submit(_transform_file, transformer, data_files['raw_train_file'],
+                        data_files['transformed_x_train_file'], data_files['transformed_y_train_file']),
+            pool.submit(_transform_file, transformer, data_files['raw_test_file'],
+                        data_files['transformed_x_test_file'], data_files['transformed_y_test_file']),
+        ]
+        for future in futures:
+            future.result()
@@ -4,8 +4,8 @@
 #              either already exists or will be created from the training data.
 # ================================================================================
 
-import pandas as pd
 from collections import defaultdict
+from cd4ml.data_processing.data_profile import get_profile
 import os
 import json
 
@@ -14,29 +14,44 @@ import logging
 logger = logging.getLogger(__name__)
 
 
-def _create_json_config(df):
-    """ creates the json config from an input data frame"""
+def _create_json_config(profile):
+    """ creates the json config from the profile of an input data file"""
     data_config = defaultdict(dict)
 
-    dtypes_ = df.dtypes.to_dict()
-    nulls_ = df.isnull().sum().to_dict()
-
-    for col in df.columns:
-        data_config[col]['dtype'] = str(dtypes_[col])
-        data_config[col]['nullable'] = nulls_[col] > 0
+    for col, col_profile in profile['columns'].items():
+        data_config[col]['dtype'] = col_profile['dtype']
+        data_config[col]['nullable'] = col_profile['nullable']
 
     return data_config
 
 
-def _assert_consistency(df, data_config):
-    """ asserts consistency of data types an nullability of an input df with a json config"""
-    dtypes_ = df.dtypes.to_dict()
-    nulls_ = df.isnull().sum().to_dict()
-    for col in df.columns:
-        has_nulls = nulls_[col] > 0
-        assert data_config[col]['dtype'] == str(
-            dtypes_[col]), f"{col}: {data_config[col]['dtype']} == {str(dtypes_[col])}"
-        assert data_config[col]['nullable'] == has_nulls, f"{col}: {data_config[col]['nullable']} == {has_nulls}"
+def _describe_rows(location):
+    """describes the chunk and row range of a profile location"""
+    return f"chunk {location['chunk']} (rows {location['rows'][0]}-{location['rows'][1]})"
+
+
+def _check_consistency(profile, data_config):
+    """ checks data types an nullability of an input data profile against a json config"""
+    errors = []
+    for col, col_profile in profile['columns'].items():
+        if col not in data_config:
+            errors.append(f"{col}: column is not in the data config")
+            continue
+
+        expected_dtype = data_config[col]['dtype']
+        if expected_dtype != col_profile['dtype']:
+            change = col_profile['dtype_changes'][-1]
+            errors.append(f"{col}: dtype {col_profile['dtype']} != {expected_dtype}, "
+                          f"inferred from {_describe_rows(change)} on")
+
+        expected_nullable = data_config[col]['nullable']
+        if expected_nullable != col_profile['nullable']:
+            if col_profile['nullable']:
+                errors.append(f"{col}: {col_profile['null_count']} nulls but not nullable, "
+                              f"first nulls in {_describe_rows(col_profile['first_nulls'])}")
+            else:
+                errors.append(f"{col}: nullable but no nulls in any of the {profile['n_rows']} rows")
+    return errors
 
 
 def _check_keys(dict_, required_keys):
@@ -46,27 +61,37 @@ def _check_keys(dict_, required_keys):
             raise ValueError(f'input argument "data_files" is missing required key "{key}"')
         
 
-def validate_data(data_files, configs_dir, **kwargs):
+def validate_data(data_files, configs_dir, chunksize=None, **kwargs):
     """
     Loads raw training and test data and validates it for data types and nullability with the 
     'data_config.json' in the configs_dir directory. If there is no data_config.json file, 
     this function creates it from the training data.
+
+    The data is checked from column profiles, which are computed in a single pass over
+    chunks of the data and cached by the content hash of the data in
+    '<configs_dir>/profiles'. Besides dtype and nullability the profiles contain min/max,
+    null counts, approximate quantiles and distinct counts of every column.
     
     Args:
         data_files (dict): contains the following keys:
           'raw_train_file': location of the raw training data
           'raw_test_file': location of the raw test data
         configs_dir (str): path to the configs directory
+        chunksize (Optional[int]): number of rows per chunk, None reads the data at once
 
+    Raises:
+        ValueError: if the data does not match the config, naming the offending columns
+          with the chunk and row range where the mismatch starts
     """
     required_keys = [
         'raw_train_file',
         'raw_test_file',
     ]
     _check_keys(data_files, required_keys)
-    
-    df_train = pd.read_csv(data_files['raw_train_file'])
-    df_test = pd.read_csv(data_files['raw_test_file'])
+
+    profiles_dir = os.path.join(configs_dir, 'profiles')
+    profile_train = get_profile(data_files['raw_train_file'], chunksize, profiles_dir)
+    profile_test = get_profile(data_files['raw_test_file'], chunksize, profiles_dir)
 
     json_file = os.path.join(configs_dir, 'data_config.json')
     if os.path.isfile(json_file):
@@ -74,10 +99,13 @@ def validate_data(data_files, configs_dir, **kwargs):
             data_config = json.loads(f.read())
             logger.info("loaded {} successfully".format(json_file))
     else:
-        data_config = _create_json_config(df_train)
+        data_config = _create_json_config(profile_train)
         with open(json_file, 'w') as f:
             json.dump(data_config, f, indent=4)
             logger.info("created {} successfully".format(json_file))
 
-    _assert_consistency(df_train, data_config)
-    _assert_consistency(df_test, data_config)
\ No newline at end of file
+    errors = []
+    for key, profile in [('raw_train_file', profile_train), ('raw_test_file', profile_test)]:
+        errors += [f"{data_files[key]}: {error}" for error in _check_consistency(profile, data_config)]
+    if errors:
+        raise ValueError("data validation failed:\n" + "\n".join(errors))
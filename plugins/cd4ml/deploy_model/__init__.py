@@ -1 +1,2 @@
-from cd4ml.deploy_model.launch_api_endpoint import launch_api_endpoint
\ No newline at end of file
+from cd4ml.deploy_model.launch_api_endpoint import launch_api_endpoint
+from cd4ml.deploy_model.reload_api_endpoint import reload_api_endpoint
\ No newline at end of file
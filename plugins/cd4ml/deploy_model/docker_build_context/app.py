@@ -1,13 +1,48 @@
+import hmac
+import os
+
 import flask
 
+from score import score, formats
+
 app = flask.Flask(__name__)
 
+
+@app.route("/", methods=["GET", "POST"])
+def flask_wrapper():
+    request = flask.request
+    # request and response formats by Content-Type and Accept, JSON by default (see formats.py)
+    accept = request.accept_mimetypes.best_match(formats.response_types, default=formats.json_type)
+    try:
+        input_data = formats.decode_request(request.get_data(), request.mimetype,
+                                            request.mimetype_params, request.headers)
+        result, model_run_id = score.score_frame(input_data)
+        body, content_type, headers = formats.encode_response(result, model_run_id, accept)
+    except formats.FormatError as e:
+        return flask.jsonify({"error": str(e)}), e.status
+    return flask.Response(body, content_type=content_type, headers=headers)
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    # metrics of the worker process that handles the request
+    return flask.jsonify(score.metrics())
+
+
+@app.route("/admin/reload", methods=["POST"])
+def reload():
+    # disabled unless the container gets a SCORE_ADMIN_TOKEN
+    token = os.environ.get("SCORE_ADMIN_TOKEN")
+    if not token or not hmac.compare_digest(flask.request.headers.get("X-Admin-Token", ""), token):
+        return flask.jsonify({"error": "forbidden"}), 403
+    # the workers load the new version in the background, see score.request_reload
+    score.request_reload()
+    return flask.jsonify({"reload_requested": True, "model_run_id": score.loaded.run_id,
+                          "model_version": score.loaded.version}), 202
+
+
 if __name__ == "__main__":
-    from score import score
-    
-    @app.route("/", methods=["GET", "POST"])
-    def flask_wrapper():
-        return flask.jsonify(score.run(flask.request.json))
-    
+    # development server, the container runs the app with gunicorn (see gunicorn.conf.py)
     score.init()
-    app.run(host="0.0.0.0")
\ No newline at end of file
+    score.start_watcher()
+    app.run(host="0.0.0.0")
@@ -0,0 +1,57 @@
+# Author:      CD4ML Working Group @ D ONE
+# Description: Configuration of the gunicorn server of the scoring service. The
+#              model is loaded once in the master process before the workers are
+#              forked (preload), so they share its memory copy-on-write and start
+#              without loading it again. Every worker then watches the registry
+#              for a new Production version and swaps it in (see score.reload).
+#              All settings can be changed with environment variables of the
+#              container.
+# ================================================================================
+
+import logging
+import multiprocessing
+import os
+
+# one numpy/BLAS thread per worker, the workers already use all cores
+for _variable in ["OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"]:
+    os.environ.setdefault(_variable, os.environ.get("GUNICORN_BLAS_THREADS", "1"))
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:5000")
+workers = int(os.environ.get("GUNICORN_WORKERS", multiprocessing.cpu_count()))
+threads = int(os.environ.get("GUNICORN_THREADS", 1))
+worker_class = "gthread" if threads > 1 else "sync"
+# seconds an idle connection is kept open, the timeout of a request and the time to
+# finish running requests on shutdown (SIGTERM of 'docker stop')
+keepalive = int(os.environ.get("GUNICORN_KEEPALIVE", 5))
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 30))
+graceful_timeout = int(os.environ.get("GUNICORN_GRACEFUL_TIMEOUT", 30))
+# restart workers after a number of requests, 0 never restarts them
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", 0))
+max_requests_jitter = int(os.environ.get("GUNICORN_MAX_REQUESTS_JITTER", 0))
+
+preload_app = True
+accesslog = "-"
+errorlog = "-"
+loglevel = os.environ.get("GUNICORN_LOG_LEVEL", "info")
+
+
+def on_starting(server):
+    """loads the model in the master process, before the app is loaded and the workers fork"""
+    from score import score
+
+    # messages of the scoring modules (e.g. model reloads) go to the error log of gunicorn
+    score_logger = logging.getLogger("score")
+    score_logger.handlers = server.log.error_log.handlers
+    score_logger.setLevel(server.log.error_log.level)
+
+    score.init()
+    server.log.info(f"loaded the model of run {score.loaded.run_id}, starting {workers} workers "
+                    f"with {threads} threads")
+
+
+def post_fork(server, worker):
+    """starts the model watcher of a worker, it also catches up on reloads that happened before
+    the worker was (re)started"""
+    from score import score
+
+    score.start_watcher()
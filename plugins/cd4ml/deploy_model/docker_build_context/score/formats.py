@@ -0,0 +1,153 @@
+# Author:      CD4ML Working Group @ D ONE
+# Description: Request and response formats of the scoring endpoint, selected by
+#              the Content-Type and Accept headers:
+#              - application/json: {"data": "<DataFrame.to_json()>"} (the original
+#                format) or columnar arrays {"columns": {"<name>": [...], ...}}
+#              - application/vnd.apache.arrow.stream: an Arrow IPC stream
+#              - application/x-numpy; dtype=float32|float64: a raw little-endian
+#                row-major buffer, the column names in the X-Columns header
+#              Binary inputs are turned into data frames without copying the
+#              values where possible. pyarrow is only needed for Arrow.
+# ================================================================================
+
+import io
+import json
+import numpy as np
+import pandas as pd
+
+json_type = "application/json"
+arrow_type = "application/vnd.apache.arrow.stream"
+numpy_type = "application/x-numpy"
+response_types = [json_type, arrow_type, numpy_type]
+
+_numpy_dtypes = {"float32": np.dtype("<f4"), "float64": np.dtype("<f8")}
+_columns_header = "X-Columns"
+_run_id_header = "X-Model-Run-Id"
+
+
+class FormatError(ValueError):
+    """a request that can't be decoded or a response that can't be encoded, with its http status"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def decode_json(data):
+    """
+    Reads the input data of a parsed JSON request
+
+    Args:
+        data (dict): {"data": "<DataFrame.to_json()>"} or {"columns": {"<name>": [...]}}
+
+    Returns:
+        pd.DataFrame: the input data
+    """
+    if not isinstance(data, dict):
+        raise FormatError("a JSON request must be an object")
+    if "columns" in data:
+        columns = data["columns"]
+        if not isinstance(columns, dict):
+            raise FormatError("'columns' must map the column names to arrays")
+        try:
+            # a numeric array becomes one contiguous numpy array per column
+            return pd.DataFrame({name: np.asarray(values) for name, values in columns.items()})
+        except ValueError as e:
+            raise FormatError(f"invalid 'columns': {e}")
+    if "data" in data:
+        text = data["data"] if isinstance(data["data"], str) else json.dumps(data["data"])
+        try:
+            return pd.read_json(io.StringIO(text))
+        except ValueError as e:
+            raise FormatError(f"invalid 'data': {e}")
+    raise FormatError("a JSON request needs the key 'data' or 'columns'")
+
+
+def _decode_arrow(body):
+    """reads an Arrow IPC stream"""
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise FormatError(f"{arrow_type} is not supported, pyarrow is not installed", status=415)
+    try:
+        table = pa.ipc.open_stream(body).read_all()
+    except pa.ArrowInvalid as e:
+        raise FormatError(f"invalid Arrow stream: {e}")
+    # one block per column, numeric columns without nulls then share the Arrow buffers
+    return table.to_pandas(split_blocks=True)
+
+
+def _decode_numpy(body, params, headers):
+    """reads a raw row-major buffer, the result is a read-only view of 'body'"""
+    dtype = _numpy_dtypes.get(params.get("dtype", "float64"))
+    if dtype is None:
+        raise FormatError(f"the dtype of {numpy_type} must be one of {list(_numpy_dtypes)}")
+    columns = [name.strip() for name in headers.get(_columns_header, "").split(",") if name.strip()]
+    if not columns:
+        raise FormatError(f"{numpy_type} needs the column names in the {_columns_header} header")
+    if len(body) % (dtype.itemsize * len(columns)):
+        raise FormatError(f"the body is not a whole number of rows of {len(columns)} {dtype.name} values")
+    values = np.frombuffer(body, dtype=dtype).reshape(-1, len(columns))
+    return pd.DataFrame(values, columns=columns, copy=False)
+
+
+def decode_request(body, mimetype, params=None, headers=None):
+    """
+    Reads the input data of a request
+
+    Args:
+        body (bytes): the request body
+        mimetype (str): the media type of the Content-Type header, JSON if empty
+        params (Optional[dict]): the parameters of the Content-Type header
+        headers (Optional[Mapping]): the request headers
+
+    Returns:
+        pd.DataFrame: the input data
+    """
+    if not mimetype or mimetype == json_type:
+        try:
+            data = json.loads(body)
+        except ValueError as e:
+            raise FormatError(f"invalid JSON: {e}")
+        return decode_json(data)
+    if mimetype == arrow_type:
+        return _decode_arrow(body)
+    if mimetype == numpy_type:
+        return _decode_numpy(body, params or {}, headers or {})
+    raise FormatError(f"unsupported Content-Type {mimetype}, use one of {response_types}", status=415)
+
+
+def encode_response(result, model_run_id, mimetype=json_type):
+    """
+    Writes the predictions in the requested format
+
+    Args:
+        result (np.ndarray): the predictions
+        model_run_id (str): MLflow run of the model, returned in the X-Model-Run-Id header
+          (and in the body of JSON and the schema metadata of Arrow)
+        mimetype (str): one of 'response_types'
+
+    Returns:
+        Tuple[bytes, str, dict]: the body, its Content-Type and the headers
+    """
+    result = np.asarray(result)
+    headers = {_run_id_header: str(model_run_id)}
+    if mimetype == json_type:
+        body = json.dumps({"result": result.tolist(), "model_run_id": model_run_id})
+        return body.encode(), json_type, headers
+    if mimetype == arrow_type:
+        try:
+            import pyarrow as pa
+        except ImportError:
+            raise FormatError(f"{arrow_type} is not supported, pyarrow is not installed", status=406)
+        table = pa.table({"result": result}, metadata={"model_run_id": str(model_run_id)})
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue().to_pybytes(), arrow_type, headers
+    if mimetype == numpy_type:
+        if result.dtype.kind not in "biuf":
+            raise FormatError(f"{result.dtype} predictions can't be returned as {numpy_type}", status=406)
+        dtype = result.dtype.newbyteorder("<")
+        return result.astype(dtype, copy=False).tobytes(), f"{numpy_type}; dtype={dtype.name}", headers
+    raise FormatError(f"unsupported Accept {mimetype}, use one of {response_types}", status=406)
@@ -0,0 +1,166 @@
+# Author:      CD4ML Working Group @ D ONE
+# Description: Micro-batching of concurrent scoring requests. Requests are put on
+#              a queue, a background thread merges them into one data frame and
+#              predicts it in a single call once 'max_batch_rows' rows are queued
+#              or the first request waited 'max_wait_ms', then hands every caller
+#              its rows of the result. Requests of different contexts (e.g. model
+#              versions) are never merged. Batch sizes and queueing delays are
+#              counted, see 'metrics'.
+# ================================================================================
+
+import os
+import queue
+import threading
+import time
+import numpy as np
+import pandas as pd
+
+
+class _Request:
+    """a queued input frame and its result"""
+
+    def __init__(self, frame, context):
+        self.frame = frame
+        self.context = context
+        self.enqueued = time.monotonic()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class MicroBatcher:
+    """
+    Merges concurrent calls of 'predict' into batches
+
+    Args:
+        predict (Callable): predicts a data frame and a context, returns an array with a row
+          per input row
+        max_batch_rows (int): a batch is predicted as soon as it has this many rows
+        max_wait_ms (float): maximum time a request waits for other requests
+    """
+
+    def __init__(self, predict, max_batch_rows=256, max_wait_ms=2.0):
+        self._predict = predict
+        self.max_batch_rows = max_batch_rows
+        self.max_wait_ms = max_wait_ms
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {"batches": 0, "requests": 0, "rows": 0, "max_batch_rows": 0,
+                       "queue_wait_ms": 0.0, "max_queue_wait_ms": 0.0, "predict_ms": 0.0,
+                       "batch_requests_histogram": {}}
+
+    def _ensure_started(self):
+        """starts the batching thread, threads don't survive the fork of the server workers"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._queue = queue.Queue()
+                threading.Thread(target=self._worker, name="micro-batcher", daemon=True).start()
+                self._pid = os.getpid()
+
+    def predict(self, frame, context=None):
+        """
+        Predicts a data frame as part of the next batch
+
+        Args:
+            frame (pd.DataFrame): the input rows
+            context (Any): passed to 'predict', only requests with the same context are merged
+
+        Returns:
+            np.ndarray: the predictions of the rows of 'frame'
+        """
+        self._ensure_started()
+        request = _Request(frame, context)
+        self._queue.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def _worker(self):
+        """collects requests into batches until the batch is full or the first request waited long enough"""
+        while True:
+            batch = [self._queue.get()]
+            n_rows = len(batch[0].frame)
+            deadline = batch[0].enqueued + self.max_wait_ms / 1000
+            while n_rows < self.max_batch_rows:
+                # requests which queued up during the last batch are taken without waiting
+                timeout = deadline - time.monotonic()
+                try:
+                    request = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                batch.append(request)
+                n_rows += len(request.frame)
+            contexts = {}
+            for request in batch:
+                contexts.setdefault(id(request.context), []).append(request)
+            for requests in contexts.values():
+                self._run(requests)
+
+    def _run(self, batch):
+        """predicts a batch of requests with the same context and hands every request its rows"""
+        n_rows = sum(len(request.frame) for request in batch)
+        context = batch[0].context
+        start = time.monotonic()
+        waits = [(start - request.enqueued) * 1000 for request in batch]
+        try:
+            frame = batch[0].frame if len(batch) == 1 else \
+                pd.concat([request.frame for request in batch], ignore_index=True)
+            y_pred = np.asarray(self._predict(frame, context))
+            offsets = np.cumsum([0] + [len(request.frame) for request in batch])
+            for request, begin, end in zip(batch, offsets[:-1], offsets[1:]):
+                request.result = y_pred[begin:end]
+        except Exception:
+            # a bad request fails alone, the others are predicted separately
+            for request in batch:
+                try:
+                    request.result = np.asarray(self._predict(request.frame, context))
+                except Exception as e:
+                    request.error = e
+        predict_ms = (time.monotonic() - start) * 1000
+        for request in batch:
+            request.done.set()
+
+        with self._stats_lock:
+            stats = self._stats
+            stats["batches"] += 1
+            stats["requests"] += len(batch)
+            stats["rows"] += n_rows
+            stats["max_batch_rows"] = max(stats["max_batch_rows"], n_rows)
+            stats["queue_wait_ms"] += sum(waits)
+            stats["max_queue_wait_ms"] = max(stats["max_queue_wait_ms"], max(waits))
+            stats["predict_ms"] += predict_ms
+            # number of batches by requests per batch, in powers of two
+            bucket = str(1 << (len(batch) - 1).bit_length())
+            stats["batch_requests_histogram"][bucket] = stats["batch_requests_histogram"].get(bucket, 0) + 1
+
+    def metrics(self):
+        """
+        Returns the batching metrics of this process
+
+        Returns:
+            dict: totals of 'batches', 'requests' and 'rows', the mean and maximum rows per
+              batch, mean requests per batch, mean and maximum queueing delay and mean
+              predict time in milliseconds and a histogram of the requests per batch
+        """
+        with self._stats_lock:
+            stats = dict(self._stats, batch_requests_histogram=dict(self._stats["batch_requests_histogram"]))
+        batches = max(stats["batches"], 1)
+        requests = max(stats["requests"], 1)
+        return {
+            "max_batch_rows_setting": self.max_batch_rows,
+            "max_wait_ms_setting": self.max_wait_ms,
+            "batches": stats["batches"],
+            "requests": stats["requests"],
+            "rows": stats["rows"],
+            "mean_batch_requests": stats["requests"] / batches,
+            "mean_batch_rows": stats["rows"] / batches,
+            "max_batch_rows": stats["max_batch_rows"],
+            "mean_queue_wait_ms": stats["queue_wait_ms"] / requests,
+            "max_queue_wait_ms": stats["max_queue_wait_ms"],
+            "mean_predict_ms": stats["predict_ms"] / batches,
+            "batch_requests_histogram": stats["batch_requests_histogram"],
+        }
@@ -0,0 +1,154 @@
+# Author:      CD4ML Working Group @ D ONE
+# Description: Bounded LRU cache of the predictions of single rows, so replayed
+#              telemetry (dashboards, overlapping backfills) is not predicted
+#              again. A row is keyed by the bytes of its feature values and the
+#              column names, the cache belongs to one model version and is
+#              cleared when another version predicts. Only the rows that are not
+#              cached are passed to the model. Entries expire after an optional
+#              TTL and the least recently used are evicted above a memory budget.
+# ================================================================================
+
+import sys
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+
+# estimated bytes of an entry besides its key: dict slot, tuple, prediction and expiry
+_entry_overhead = 200
+
+
+class PredictionCache:
+    """
+    LRU/TTL cache of row predictions of one model version
+
+    Args:
+        max_bytes (int): estimated memory budget of the entries
+        ttl_seconds (Optional[float]): entries expire after this time, never if None or 0
+    """
+
+    def __init__(self, max_bytes, ttl_seconds=None):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds or None
+        self._entries = OrderedDict()
+        self._schemas = {}
+        self._version = None
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "invalidations": 0,
+                       "uncacheable_rows": 0}
+
+    def _row_keys(self, x):
+        """the keys of the rows of 'x', None if the values are not numeric"""
+        values = np.ascontiguousarray(x.to_numpy() if hasattr(x, "to_numpy") else x)
+        if values.ndim != 2 or values.dtype.kind not in "biuf":
+            return None
+        # the same values mean another input with other columns, the schema is part of the key
+        columns = tuple(str(column) for column in x.columns) if hasattr(x, "columns") else None
+        schema = self._schemas.setdefault((columns, values.dtype.str), len(self._schemas))
+        data, width = values.tobytes(), values.dtype.itemsize * values.shape[1]
+        return [(schema, data[begin:begin + width]) for begin in range(0, len(data), width)]
+
+    def _invalidate(self, version):
+        """drops all entries of another model version"""
+        if self._entries:
+            self._stats["invalidations"] += 1
+        self._entries.clear()
+        self._schemas.clear()
+        self._bytes = 0
+        self._version = version
+
+    def predict(self, x, predict, version):
+        """
+        Predicts the rows of 'x' which are not cached and caches their predictions
+
+        Args:
+            x (pd.DataFrame): input of the model
+            predict (Callable): predicts a data frame, returns an array with a row per input row
+            version (str): version of the model, e.g. its run id
+
+        Returns:
+            np.ndarray: the predictions of all rows of 'x'
+        """
+        with self._lock:
+            if version != self._version:
+                self._invalidate(version)
+            keys = self._row_keys(x)
+            if keys is None:
+                self._stats["uncacheable_rows"] += len(x)
+                cached = None
+            else:
+                cached = self._get(keys)
+        if cached is None:
+            return predict(x)
+
+        missing = [i for i, value in enumerate(cached) if value is None]
+        if not missing:
+            return np.asarray(cached)
+        predictions = predict(x.iloc[missing] if len(missing) < len(x) else x)
+        with self._lock:
+            # a reload may have swapped the model meanwhile, its entries are not mixed in
+            if version == self._version:
+                self._put([keys[i] for i in missing], predictions)
+        if len(missing) == len(x):
+            return predictions
+        y_pred = np.empty(len(x), dtype=predictions.dtype)
+        y_pred[missing] = predictions
+        hits = np.setdiff1d(np.arange(len(x)), missing, assume_unique=True)
+        y_pred[hits] = [cached[i] for i in hits]
+        return y_pred
+
+    def _get(self, keys):
+        """the cached predictions of 'keys', None for the misses"""
+        now, result = time.monotonic(), []
+        for key in keys:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] is not None and entry[1] < now:
+                self._remove(key)
+                self._stats["expirations"] += 1
+                entry = None
+            if entry is None:
+                result.append(None)
+            else:
+                self._entries.move_to_end(key)
+                result.append(entry[0])
+        n_hits = sum(value is not None for value in result)
+        self._stats["hits"] += n_hits
+        self._stats["misses"] += len(result) - n_hits
+        return result
+
+    def _put(self, keys, predictions):
+        """caches predictions and evicts the least recently used entries above the budget"""
+        expires = time.monotonic() + self.ttl_seconds if self.ttl_seconds else None
+        # python scalars are smaller than numpy scalars and faster to turn back into an array
+        for key, prediction in zip(keys, np.asarray(predictions).tolist()):
+            if key not in self._entries:
+                self._bytes += sys.getsizeof(key[1]) + _entry_overhead
+            self._entries[key] = (prediction, expires)
+            self._entries.move_to_end(key)
+        while self._bytes > self.max_bytes and self._entries:
+            self._remove(next(iter(self._entries)))
+            self._stats["evictions"] += 1
+
+    def _remove(self, key):
+        """removes an entry"""
+        del self._entries[key]
+        self._bytes -= sys.getsizeof(key[1]) + _entry_overhead
+
+    def metrics(self):
+        """
+        Returns the metrics of the cache
+
+        Returns:
+            dict: counts of row 'hits' and 'misses', the 'hit_ratio', number of 'entries', their
+              estimated 'memory_bytes', the budget, the counts of 'evictions', 'expirations',
+              'invalidations' (model version changes) and of rows that can't be cached
+        """
+        with self._lock:
+            stats = dict(self._stats, entries=len(self._entries), memory_bytes=self._bytes,
+                         model_version=self._version)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = stats["hits"] / lookups if lookups else 0.0
+        stats["max_bytes"] = self.max_bytes
+        stats["ttl_seconds"] = self.ttl_seconds
+        return stats
@@ -1,19 +1,256 @@
 import numpy as np
-import mlflow
 import pandas as pd
 
 import os
+import json
+import logging
+import multiprocessing
+import threading
+import time
 
+try:
+    # copied into the build context from cd4ml/data_processing (see cd_dag)
+    from .feature_transformer import FeatureTransformer
+except ImportError:
+    FeatureTransformer = None
+
+try:
+    # copied into the build context from cd4ml/utils (see cd_dag)
+    from .model_cache import ModelCache
+except ImportError:
+    ModelCache = None
+
+try:
+    # copied into the build context from cd4ml/model_training (see cd_dag)
+    from .compiled_model import CompiledLinearModel, compiled_file
+except ImportError:
+    CompiledLinearModel = None
+
+from .micro_batcher import MicroBatcher
+from .formats import decode_json, FormatError
+from .prediction_cache import PredictionCache
+
+logger = logging.getLogger(__name__)
+
+model_name = None
 if os.environ.get("MLFLOW_RUN_ID") is not None:
     logged_model = "runs:/{}/model".format(os.environ.get("MLFLOW_RUN_ID"))
 elif os.environ.get("MLFLOW_MODEL") is not None:
-    logged_model="models:/{}/Production".format(os.environ.get("MLFLOW_MODEL"))
+    model_name = os.environ.get("MLFLOW_MODEL")
+    logged_model="models:/{}/Production".format(model_name)
+
+# opt-in micro-batching of concurrent requests (needs several threads per server worker)
+micro_batching = os.environ.get("SCORE_MICRO_BATCHING", "0") == "1"
+batcher = None
+
+# optional cache of row predictions, its memory budget in MB (0 disables it)
+cache_mb = float(os.environ.get("SCORE_CACHE_MB", 0))
+cache = None
+
+# seconds between checks of the registry for a new Production version (0 disables them)
+reload_interval = float(os.environ.get("SCORE_RELOAD_INTERVAL_S", 60))
+# number of reloads requested in any worker, created before the workers fork so all of
+# them share it and follow a reload requested in one of them
+reload_requests = multiprocessing.Value("q", 0)
+_reload_lock = threading.Lock()
+_watcher_pid = None
+
+# the model new requests are predicted with, 'reload' replaces it as a whole
+loaded = None
+
+class LoadedModel:
+    """a model with its feature transformation, a request keeps the one it started with"""
+
+    def __init__(self, model, run_id, version=None, transformer=None, shard_key=None):
+        self.model = model
+        self.run_id = run_id
+        self.version = version
+        self.transformer = transformer
+        self.shard_key = shard_key
+
+def _load(model_uri, model_version=None):
+    """loads a model with its transformation, downloads it unless it is cached"""
+    version = model_version.version if model_version is not None else None
+    if ModelCache is None:
+        from mlflow.tracking.artifact_utils import _download_artifact_from_uri
+        return _read_model(_download_artifact_from_uri(model_uri), version)
+    # the cache directory is a docker volume, restarts reuse the downloaded model, and
+    # the version fetched from the registry is passed so it is not resolved again
+    with ModelCache().local_path(model_uri, model_version) as local_path:
+        # another worker can't evict the model while it is read
+        return _read_model(local_path, version)
+
+def _read_model(local_path, version=None):
+    """reads a model with its transformation from its local copy"""
+    # a linear model exported by train_model is predicted with numpy only, without
+    # loading sklearn and the MLflow model
+    compiled_path = os.path.join(local_path, "compiled", compiled_file) if CompiledLinearModel else None
+    if compiled_path is not None and os.path.isfile(compiled_path):
+        model = CompiledLinearModel.load(compiled_path)
+        run_id = model.run_id
+    else:
+        import mlflow.pyfunc
+        model = mlflow.pyfunc.load_model(local_path)
+        run_id = model.metadata.run_id
+
+    # apply the feature transformation logged with the model, if there is one
+    transformer = None
+    transformer_file = os.path.join(local_path, "feature_transformer.json")
+    if FeatureTransformer is not None and os.path.isfile(transformer_file):
+        transformer = FeatureTransformer.load(transformer_file)
+
+    # a sharded model (see sharded_training.py) selects the model of a row by this column
+    shard_key = None
+    sharding_file = os.path.join(local_path, "sharding.json")
+    if os.path.isfile(sharding_file):
+        with open(sharding_file) as f:
+            shard_key = json.load(f)["shard_key"]
+
+    return LoadedModel(model, run_id, version, transformer, shard_key)
+
+def _input_features(loaded_model):
+    """the input columns a model needs, None if they are not known"""
+    if loaded_model.transformer is not None:
+        return loaded_model.transformer.features
+    features = getattr(loaded_model.model, "features", None)
+    if features is None and hasattr(loaded_model.model, "metadata"):
+        schema = loaded_model.model.metadata.get_input_schema()
+        features = schema.input_names() if schema is not None else None
+    return features
+
+def _warm_up(loaded_model):
+    """predicts a row of zeros, so lazy initialization does not slow down the first request"""
+    features = _input_features(loaded_model)
+    if not features:
+        logger.warning(f"the input features of run {loaded_model.run_id} are unknown, it is not warmed up")
+        return
+    y_pred = predict(pd.DataFrame(np.zeros((1, len(features))), columns=features), loaded_model)
+    if len(y_pred) != 1:
+        raise ValueError(f"the probe prediction of run {loaded_model.run_id} returned {len(y_pred)} rows")
+
+def _production_version():
+    """the registered version of 'model_name' in stage Production, None if there is none"""
+    from mlflow.tracking.client import MlflowClient
+
+    versions = MlflowClient().get_latest_versions(model_name, stages=["Production"])
+    return versions[0] if versions else None
 
 def init():
-    global model
-    model = mlflow.pyfunc.load_model(logged_model)
-    
+    global loaded, batcher, cache
+    if model_name is not None:
+        # a fixed version, so a reload can tell whether Production moved on
+        version = _production_version()
+        if version is None:
+            raise ValueError(f"model {model_name} has no version in stage Production")
+        loaded = _load("models:/{}/{}".format(model_name, version.version), version)
+    else:
+        loaded = _load(logged_model)
+    try:
+        _warm_up(loaded)
+    except Exception:
+        logger.exception(f"the probe prediction of run {loaded.run_id} failed")
+
+    if micro_batching:
+        batcher = MicroBatcher(predict,
+                               max_batch_rows=int(os.environ.get("SCORE_MAX_BATCH_ROWS", 256)),
+                               max_wait_ms=float(os.environ.get("SCORE_MAX_WAIT_MS", 2)))
+    if cache_mb > 0:
+        cache = PredictionCache(int(cache_mb * 2**20),
+                                ttl_seconds=float(os.environ.get("SCORE_CACHE_TTL_S", 0)))
+
+def reload():
+    """
+    Swaps in the current Production version of the model if it is not the loaded one.
+    It is loaded and warmed up while the loaded model keeps serving, requests that
+    already started finish with the previous model.
+
+    Returns:
+        bool: True if another version was swapped in
+    """
+    global loaded
+    if model_name is None:
+        # the model of a run never changes
+        return False
+    with _reload_lock:
+        version = _production_version()
+        if version is None or version.version == loaded.version:
+            return False
+        start = time.time()
+        new_model = _load("models:/{}/{}".format(model_name, version.version), version)
+        _warm_up(new_model)
+        previous, loaded = loaded, new_model
+    logger.info(f"swapped version {previous.version} (run {previous.run_id}) of {model_name} for "
+                f"version {new_model.version} (run {new_model.run_id}), loaded in "
+                f"{round(time.time() - start, 3)} seconds")
+    return True
+
+def request_reload():
+    # the watchers of all server workers check for a new version within a second, the model
+    # is loaded by them and not in the request, which would run into the server's timeout
+    with reload_requests.get_lock():
+        reload_requests.value += 1
+
+def _watch():
+    """checks for a new version at start, every 'reload_interval' seconds and when a reload is requested"""
+    # a (re)started worker has the model preloaded by the master, which may be outdated
+    seen, check = reload_requests.value, True
+    next_check = time.monotonic()
+    while True:
+        if check or reload_requests.value != seen or (reload_interval > 0 and time.monotonic() >= next_check):
+            seen, check = reload_requests.value, False
+            try:
+                reload()
+            except Exception:
+                # the loaded model keeps serving, the next check tries again
+                logger.exception(f"reloading {model_name} failed")
+            next_check = time.monotonic() + reload_interval
+        time.sleep(1)
+
+def start_watcher():
+    # threads don't survive the fork of the server workers, every worker starts its own
+    global _watcher_pid
+    if model_name is None or _watcher_pid == os.getpid():
+        return
+    _watcher_pid = os.getpid()
+    threading.Thread(target=_watch, name="model-watcher", daemon=True).start()
+
+def _check_features(input_data, loaded_model):
+    """raises a FormatError (a bad request) if the input lacks features of the model"""
+    missing = [feature for feature in _input_features(loaded_model) or []
+               if feature not in input_data.columns]
+    if missing:
+        raise FormatError(f"the input data is missing the feature columns {missing}")
+
+def predict(input_data, loaded_model=None):
+    loaded_model = loaded_model or loaded
+    _check_features(input_data, loaded_model)
+    features = input_data
+    if loaded_model.transformer is not None:
+        features = loaded_model.transformer.transform_features(input_data)
+        shard_key = loaded_model.shard_key
+        if shard_key is not None and shard_key in input_data.columns:
+            features[shard_key] = input_data[shard_key]
+    if cache is not None and loaded_model is loaded:
+        # only the rows not predicted before by this model version are passed to the model
+        return cache.predict(features, loaded_model.model.predict, loaded_model.run_id)
+    return loaded_model.model.predict(features)
+
+def score_frame(input_data):
+    # the predictions of a decoded request (see formats.py) and the run of the model
+    loaded_model = loaded
+    if batcher is not None:
+        return batcher.predict(input_data, loaded_model), loaded_model.run_id
+    return predict(input_data, loaded_model), loaded_model.run_id
+
 def run(data):
-    input_data = pd.read_json(data.get("data"))
-    result = model.predict(input_data)
-    return {"result": result.tolist(), "model_run_id": model.metadata.run_id}
\ No newline at end of file
+    result, model_run_id = score_frame(decode_json(data))
+    return {"result": result.tolist(), "model_run_id": model_run_id}
+
+def metrics():
+    result = {"pid": os.getpid(), "model_run_id": loaded.run_id, "model_version": loaded.version,
+              "micro_batching": batcher is not None}
+    if batcher is not None:
+        result.update(batcher.metrics())
+    if cache is not None:
+        result["prediction_cache"] = cache.metrics()
+    return result
@@ -8,11 +8,14 @@ import logging
 logger = logging.getLogger(__name__)
 
 
-def launch_api_endpoint(model=None):
+def launch_api_endpoint(model=None, workers=None, threads=None, micro_batching=False):
     """Launches the REST API endpoint through a docker container. 
 
     Args:
         model (_type_, optional): A model name in mlflow. If model is set the latest model with production tag is taken. Defaults to None.
+        workers (int, optional): Number of gunicorn worker processes. Defaults to one per cpu of the host.
+        threads (int, optional): Number of threads per worker. Defaults to 1.
+        micro_batching (bool, optional): Merges concurrent requests of a worker into one prediction, needs threads > 1. Defaults to False.
 
     Raises:
         ValueError: If run_id and model ar both empty.
@@ -23,8 +26,23 @@ def launch_api_endpoint(model=None):
     else:
         raise ValueError("model must be set")
 
+    # the serving settings of gunicorn.conf.py
+    server_env = ""
+    if workers is not None:
+        server_env += " -e GUNICORN_WORKERS={}".format(workers)
+    if threads is not None:
+        server_env += " -e GUNICORN_THREADS={}".format(threads)
+    if micro_batching:
+        server_env += " -e SCORE_MICRO_BATCHING=1"
+    # enables the reload of the model through the endpoint (see reload_api_endpoint)
+    if os.environ.get("SCORE_ADMIN_TOKEN"):
+        server_env += " -e SCORE_ADMIN_TOKEN={}".format(os.environ.get("SCORE_ADMIN_TOKEN"))
+
+    # downloaded models are cached in a volume, so a new container starts faster
     bashCommand = "docker run -p 5000:5000 \
-        "+model_env+"\
+        "+model_env+server_env+"\
+        -v cd4ml-model-cache:/var/cache/cd4ml/models \
+        -e MODEL_CACHE_DIR=/var/cache/cd4ml/models \
         -e MLFLOW_TRACKING_USERNAME={} \
         -e MLFLOW_TRACKING_PASSWORD={} \
         -e AZURE_STORAGE_ACCESS_KEY={} \
@@ -0,0 +1,68 @@
+import argparse
+import json
+import os
+import time
+import urllib.request
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# consecutive responses of the expected version, requests are spread over the workers
+_n_confirmations = 10
+
+
+def _get_json(request, timeout):
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.load(response)
+
+
+def reload_api_endpoint(host="http://localhost:5000", version=None, timeout=600):
+    """Makes a running REST API endpoint swap in the current Production version of its model,
+    without restarting the docker container. The workers of the endpoint load the new version
+    in the background.
+
+    Args:
+        host (str, optional): Address of the endpoint. Defaults to "http://localhost:5000".
+        version (str, optional): Registered model version to wait for. If None, only the reload is requested. Defaults to None.
+        timeout (int, optional): Seconds to wait for the endpoint to serve 'version'. Defaults to 600.
+
+    Raises:
+        ValueError: If SCORE_ADMIN_TOKEN is not set.
+        TimeoutError: If the endpoint does not serve 'version' within 'timeout' seconds.
+
+    Returns:
+        dict: "model_run_id" and "model_version" served by the endpoint.
+    """
+    token = os.environ.get("SCORE_ADMIN_TOKEN")
+    if not token:
+        raise ValueError("SCORE_ADMIN_TOKEN must be set")
+
+    host = host.rstrip("/")
+    request = urllib.request.Request(host + "/admin/reload", data=b"", method="POST",
+                                     headers={"X-Admin-Token": token})
+    result = _get_json(request, timeout=30)
+    logger.info(f"requested the reload of the endpoint {host}: {result}")
+    if version is None:
+        return result
+
+    deadline, confirmations = time.time() + timeout, 0
+    while confirmations < _n_confirmations:
+        if time.time() > deadline:
+            raise TimeoutError(f"the endpoint {host} does not serve version {version} after {timeout} seconds")
+        result = _get_json(host + "/metrics", timeout=30)
+        if str(result.get("model_version")) == str(version):
+            confirmations += 1
+        else:
+            confirmations = 0
+            time.sleep(1)
+    logger.info(f"the endpoint {host} serves version {version} (run {result.get('model_run_id')})")
+    return {"model_run_id": result.get("model_run_id"), "model_version": result.get("model_version")}
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(description='Reloads the model of a running REST Endpoint')
+    argparser.add_argument('--host', type=str, default="http://localhost:5000", help='address of the endpoint')
+    argparser.add_argument('--version', type=str, help='model version to wait for')
+    args = argparser.parse_args()
+    print(reload_api_endpoint(args.host, args.version))
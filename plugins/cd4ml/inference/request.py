@@ -1,12 +1,62 @@
+import argparse
+import json
 import requests
 import numpy as np
 import pandas as pd
 
+_arrow_type = "application/vnd.apache.arrow.stream"
+_numpy_type = "application/x-numpy"
+
+
+def encode(dat, format):
+    """returns the body and headers of a scoring request of 'dat' in 'format'"""
+    if format == "json":
+        # the original format, a DataFrame.to_json() string in a JSON object
+        return json.dumps({"data": dat.to_json()}), {"Content-Type": "application/json"}
+    if format == "columns":
+        body = {"columns": {name: dat[name].tolist() for name in dat.columns}}
+        return json.dumps(body), {"Content-Type": "application/json"}
+    if format == "arrow":
+        import pyarrow as pa
+
+        table = pa.Table.from_pandas(dat, preserve_index=False)
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue().to_pybytes(), {"Content-Type": _arrow_type, "Accept": _arrow_type}
+    if format in ("float32", "float64"):
+        body = np.ascontiguousarray(dat.to_numpy(dtype="<f4" if format == "float32" else "<f8")).tobytes()
+        return body, {"Content-Type": f"{_numpy_type}; dtype={format}", "Accept": _numpy_type,
+                      "X-Columns": ",".join(dat.columns)}
+    raise ValueError(f"unknown format {format}")
+
+
+def decode(response):
+    """returns the predictions and the model run of a scoring response"""
+    response.raise_for_status()
+    content_type = response.headers.get("Content-Type", "")
+    if content_type.startswith(_arrow_type):
+        import pyarrow as pa
+
+        table = pa.ipc.open_stream(response.content).read_all()
+        return table.column("result").to_numpy(), table.schema.metadata[b"model_run_id"].decode()
+    if content_type.startswith(_numpy_type):
+        dtype = content_type.split("dtype=")[1].strip()
+        return np.frombuffer(response.content, dtype=np.dtype(dtype).newbyteorder("<")), \
+            response.headers.get("X-Model-Run-Id")
+    body = response.json()
+    return np.asarray(body["result"]), body["model_run_id"]
+
 
 if __name__ == "__main__":
-    host = "http://localhost:5000"
+    argparser = argparse.ArgumentParser(description='Requests the scoring endpoint')
+    argparser.add_argument('--host', type=str, default="http://localhost:5000")
+    argparser.add_argument('--format', type=str, default="json",
+                           choices=["json", "columns", "arrow", "float32", "float64"],
+                           help='format of the request and the response')
+    args = argparser.parse_args()
 
-    dat = pd.DataFrame(np.random.uniform(0,1,(10,12)), 
+    dat = pd.DataFrame(np.random.uniform(0,1,(10,12)),
                     columns=[
                             "wind_speed",
                             "power",
@@ -23,6 +73,6 @@ if __name__ == "__main__":
                         ]
                     )
 
-    data={"data": dat.to_json()}
-
-    print(requests.post(host, json=data).json())
\ No newline at end of file
+    body, headers = encode(dat, args.format)
+    result, model_run_id = decode(requests.post(args.host, data=body, headers=headers))
+    print({"result": result.tolist(), "model_run_id": model_run_id})
@@ -1 +1,3 @@
-from cd4ml.model_training.train_model import train_model
\ No newline at end of file
+from cd4ml.model_training.train_model import train_model
+from cd4ml.model_training.hyperparameter_search import hyperparameter_search, default_search_space
+from cd4ml.model_training.sharded_training import ShardedModel, train_sharded_model
\ No newline at end of file
@@ -0,0 +1,122 @@
+# Author:      CD4ML Working Group @ D ONE
+# Description: Compact inference artifact of linear classifiers (e.g. the
+#              LogisticRegression of 'get_model'): the coefficients, intercepts
+#              and classes in a .npz file and a pure numpy predictor doing the
+#              same operations as sklearn, so it reproduces its predictions
+#              exactly. It only depends on numpy and is copied into the scoring
+#              container (see cd_dag), which then does not need sklearn or the
+#              MLflow model to predict.
+# ================================================================================
+
+import numpy as np
+import logging
+
+logger = logging.getLogger(__name__)
+
+compiled_file = "linear_model.npz"
+_format_version = 1
+
+
+class CompiledLinearModel:
+    """
+    Numpy predictor of a linear classifier
+
+    Args:
+        coef (np.ndarray): coefficients, shape (n_classes or 1, n_features)
+        intercept (np.ndarray): intercepts, shape (n_classes or 1,)
+        classes (np.ndarray): the labels
+        features (Optional[List[str]]): names of the input features in the order of the
+          coefficients, if the model was fitted on a data frame
+        run_id (Optional[str]): MLflow run of the model
+    """
+
+    def __init__(self, coef, intercept, classes, features=None, run_id=None):
+        self.coef = coef
+        self.intercept = intercept
+        self.classes = classes
+        self.features = features
+        self.run_id = run_id
+
+    @classmethod
+    def from_estimator(cls, clf, run_id=None):
+        """the predictor of a fitted sklearn linear classifier, None if 'clf' is not one"""
+        from sklearn.linear_model._base import LinearClassifierMixin
+
+        if not isinstance(clf, LinearClassifierMixin) or not hasattr(clf, "coef_"):
+            return None
+        features = getattr(clf, "feature_names_in_", None)
+        return cls(clf.coef_, clf.intercept_, clf.classes_,
+                   None if features is None else [str(feature) for feature in features], run_id)
+
+    def decision_function(self, x):
+        """
+        Computes the scores of the classes like sklearn's LinearClassifierMixin
+
+        Args:
+            x (Union[pd.DataFrame, np.ndarray]): input features, a data frame is reordered
+              to the features of the model
+
+        Returns:
+            np.ndarray: the scores, shape (n_rows,) for two classes
+        """
+        if self.features is not None and hasattr(x, "columns") and list(x.columns) != self.features:
+            x = x[self.features]
+        x = np.asarray(x)
+        # sklearn converts non-numeric input to float64 and keeps numeric dtypes
+        if x.dtype.kind not in "biufc":
+            x = x.astype(np.float64)
+        scores = x @ self.coef.T + self.intercept
+        return scores.ravel() if scores.shape[1] == 1 else scores
+
+    def predict(self, x):
+        """predicts the labels of the rows of 'x'"""
+        scores = self.decision_function(x)
+        if scores.ndim == 1:
+            return self.classes[(scores > 0).astype(int)]
+        return self.classes[scores.argmax(axis=1)]
+
+    def save(self, path):
+        """saves the predictor as .npz file"""
+        # object arrays (e.g. string labels) can't be loaded without pickle
+        classes = self.classes if self.classes.dtype != object else np.array(self.classes.tolist())
+        arrays = {"version": np.array(_format_version), "coef": self.coef,
+                  "intercept": self.intercept, "classes": classes}
+        if self.features is not None:
+            arrays["features"] = np.array(self.features)
+        if self.run_id is not None:
+            arrays["run_id"] = np.array(self.run_id)
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        """loads a predictor saved with 'save'"""
+        with np.load(path, allow_pickle=False) as arrays:
+            if int(arrays["version"]) != _format_version:
+                raise ValueError(f"unsupported version {int(arrays['version'])} of {path}")
+            return cls(arrays["coef"], arrays["intercept"], arrays["classes"],
+                       arrays["features"].tolist() if "features" in arrays else None,
+                       str(arrays["run_id"]) if "run_id" in arrays else None)
+
+
+def compile_model(clf, x_sample, run_id=None):
+    """
+    Compiles a fitted sklearn model into a numpy predictor, if it is a linear classifier
+    and the predictor reproduces the predictions of the model exactly
+
+    Args:
+        clf (sklearn.base.BaseEstimator): the fitted model
+        x_sample (pd.DataFrame): input data to compare the predictions on
+        run_id (Optional[str]): MLflow run of the model
+
+    Returns:
+        Optional[CompiledLinearModel]: the predictor, None if the model can't be compiled
+    """
+    compiled = CompiledLinearModel.from_estimator(clf, run_id)
+    if compiled is None:
+        logger.info(f"{type(clf).__name__} is not a linear classifier, it is not compiled")
+        return None
+    if not (np.array_equal(compiled.decision_function(x_sample), clf.decision_function(x_sample))
+            and np.array_equal(compiled.predict(x_sample), clf.predict(x_sample))):
+        logger.warning(f"the compiled {type(clf).__name__} does not reproduce its predictions")
+        return None
+    return compiled
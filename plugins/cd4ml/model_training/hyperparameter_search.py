@@ -0,0 +1,181 @@
+# Author:      CD4ML Working Group @ D ONE
+# Description: Parallel hyperparameter search over several estimators with
+#              successive halving: all candidates are trained on a small sample
+#              of the training data, only the best 1/eta of them continue on a
+#              sample eta times larger, until the last rung uses all rows. The
+#              candidates of a rung are trained in a process pool and every
+#              trial is logged as nested MLflow run.
+# ================================================================================
+
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import mlflow
+from mlflow.utils.mlflow_tags import MLFLOW_PARENT_RUN_ID, MLFLOW_RUN_NAME
+from cd4ml.utils.mlflow_logging import BufferedLogger
+from sklearn.metrics import f1_score
+from sklearn.model_selection import ParameterGrid
+from sklearn.linear_model import LogisticRegression
+from sklearn.ensemble import GradientBoostingClassifier
+import logging
+
+logger = logging.getLogger(__name__)
+
+estimators = {
+    'LogisticRegression': LogisticRegression,
+    'GradientBoostingClassifier': GradientBoostingClassifier,
+}
+
+default_search_space = [
+    {'estimator': 'LogisticRegression',
+     'params': {'C': [0.01, 0.1, 1.0, 10.0], 'max_iter': [50, 200]}},
+    {'estimator': 'GradientBoostingClassifier',
+     'params': {'n_estimators': [50, 100], 'max_depth': [2, 3], 'learning_rate': [0.1]}},
+]
+
+# training and validation data of the worker processes, set by '_init_worker'
+_worker_data = {}
+
+
+def get_candidates(search_space):
+    """
+    Expands a search space into the list of candidates
+
+    Args:
+        search_space (List[dict]): per estimator a dict with the keys 'estimator' (a key of
+          'estimators') and 'params' (dict of parameter name to list of values)
+
+    Returns:
+        List[Tuple[str, dict]]: estimator name and parameters of every candidate
+    """
+    candidates = []
+    for space in search_space:
+        if space['estimator'] not in estimators:
+            raise ValueError(f'unknown estimator "{space["estimator"]}", expected one of {list(estimators)}')
+        candidates += [(space['estimator'], params) for params in ParameterGrid(space.get('params', {}))]
+    return candidates
+
+
+def build_model(estimator, params):
+    """returns an unfitted model of the estimator 'estimator' with 'params'"""
+    return estimators[estimator](**params)
+
+
+def _init_worker(x_train, y_train, x_val, y_val, order):
+    """keeps the data in the worker process, so it is only sent once per worker"""
+    mlflow.autolog(disable=True)
+    _worker_data.update(x_train=x_train, y_train=y_train, x_val=x_val, y_val=y_val, order=order)
+
+
+def _evaluate(estimator, params, n_rows):
+    """trains a candidate on the first 'n_rows' rows of the shuffled training data"""
+    rows = _worker_data['order'][:n_rows]
+    start = time.time()
+    try:
+        model = build_model(estimator, params)
+        model.fit(_worker_data['x_train'][rows], _worker_data['y_train'][rows])
+        y_pred = model.predict(_worker_data['x_val'])
+        score = f1_score(_worker_data['y_val'], y_pred, average='macro', zero_division=0)
+        error = None
+    except Exception as e:
+        score, error = -np.inf, str(e)
+    return {'score': float(score), 'fit_time': time.time() - start, 'error': error}
+
+
+def _log_trial(trial, run_logger, parent_run):
+    """logs a trial as nested run of 'parent_run', the values are queued on 'run_logger'"""
+    run = run_logger.client.create_run(parent_run.info.experiment_id, tags={
+        MLFLOW_PARENT_RUN_ID: parent_run.info.run_id,
+        MLFLOW_RUN_NAME: f"{trial['estimator']}_rung{trial['rung']}",
+    })
+    run_id = run.info.run_id
+    run_logger.set_tags({"estimator": trial['estimator'],
+                         "status": "failed" if trial['error'] else "ok"}, run_id=run_id)
+    run_logger.log_params(dict(trial['params'], n_rows=trial['n_rows']), run_id=run_id)
+    run_logger.log_metrics({
+        "rung": trial['rung'],
+        "fit_time": trial['fit_time'],
+        "val_f1": trial['score'] if np.isfinite(trial['score']) else -1.0,
+    }, run_id=run_id)
+    run_logger.terminate_run(run_id)
+
+
+def hyperparameter_search(x_train, y_train, search_space=None, eta=3, min_rows=1000,
+                          validation_fraction=0.2, n_workers=None, seed=0, log_trials=True,
+                          run_logger=None):
+    """
+    Searches the best candidate by successive halving on a validation set made of the
+    last rows of the training data (the training data is ordered by time)
+
+    Args:
+        x_train (pd.DataFrame): training input data
+        y_train (pd.DataFrame): training labels
+        search_space (Optional[List[dict]]): see 'get_candidates', 'default_search_space'
+          by default
+        eta (int): only the best 1/eta candidates of a rung continue, on eta times more rows
+        min_rows (int): minimum number of training rows of the first rung
+        validation_fraction (float): share of the last rows used for validation
+        n_workers (Optional[int]): number of processes, by default one per cpu
+        seed (int): seed of the shuffling of the training rows
+        log_trials (bool): log every trial as nested run of the active MLflow run
+        run_logger (Optional[BufferedLogger]): logger of the trials, a new one is used
+          (and flushed at the end of the search) by default
+
+    Returns:
+        Tuple[str, dict, List[dict]]: estimator and parameters of the best candidate and
+          all trials
+    """
+    candidates = get_candidates(search_space or default_search_space)
+    x = np.asarray(x_train)
+    y = np.asarray(y_train).ravel()
+    n_val = max(1, int(len(x) * validation_fraction))
+    x_fit, y_fit, x_val, y_val = x[:-n_val], y[:-n_val], x[-n_val:], y[-n_val:]
+    order = np.random.default_rng(seed).permutation(len(x_fit))
+
+    n_rungs = max(1, math.floor(math.log(len(candidates), eta)) + 1) if len(candidates) > 1 else 1
+    n_workers = min(n_workers or os.cpu_count() or 1, len(candidates))
+    logger.info(f"searching {len(candidates)} candidates in {n_rungs} rungs with {n_workers} workers")
+
+    trials = []
+    survivors = list(range(len(candidates)))
+    parent_run = mlflow.active_run() if log_trials else None
+    own_logger = parent_run is not None and run_logger is None
+    if own_logger:
+        run_logger = BufferedLogger()
+    try:
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker,
+                                 initargs=(x_fit, y_fit, x_val, y_val, order)) as pool:
+            for rung in range(n_rungs):
+                n_rows = len(x_fit) if rung == n_rungs - 1 else \
+                    min(len(x_fit), max(min_rows, int(len(x_fit) * eta ** (rung - n_rungs + 1))))
+                futures = {i: pool.submit(_evaluate, *candidates[i], n_rows) for i in survivors}
+
+                scores = {}
+                for i, future in futures.items():
+                    trial = dict(future.result(), estimator=candidates[i][0], params=candidates[i][1],
+                                 rung=rung, n_rows=n_rows)
+                    trials.append(trial)
+                    scores[i] = trial['score']
+                    if parent_run is not None:
+                        _log_trial(trial, run_logger, parent_run)
+                    if trial['error']:
+                        logger.warning(f"candidate {candidates[i]} failed: {trial['error']}")
+
+                survivors = sorted(survivors, key=lambda i: scores[i], reverse=True)
+                best_score = scores[survivors[0]]
+                survivors = survivors[:max(1, math.ceil(len(survivors) / eta))]
+                logger.info(f"rung {rung}: {len(scores)} candidates on {n_rows} rows, "
+                            f"best macro F1 {round(best_score, 4)}")
+    finally:
+        # the trials of the search are sent, also if it fails
+        if own_logger:
+            run_logger.close()
+
+    if not np.isfinite(best_score):
+        raise ValueError("all candidates of the hyperparameter search failed")
+
+    estimator, params = candidates[survivors[0]]
+    logger.info(f"best candidate: {estimator} {params}")
+    return estimator, params, trials
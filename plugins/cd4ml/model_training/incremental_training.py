@@ -0,0 +1,160 @@
+# Author:      CD4ML Working Group @ D ONE
+# Description: Incremental retraining of the production model. The training run
+#              of a model is tagged with the last timestamp of its training data,
+#              so the next run only continues training the production model on
+#              the rows that arrived since: with 'partial_fit', or by adding
+#              estimators to an ensemble with 'warm_start'. A full refit is done
+#              periodically and whenever the model can't be updated, e.g. because
+#              new labels appeared or the estimator has no incremental training
+#              (a warm started LogisticRegression only starts its optimisation from
+#              the old coefficients and converges to a fit of the new rows alone).
+# ================================================================================
+
+import os
+import numpy as np
+import pandas as pd
+import mlflow
+import mlflow.sklearn
+from mlflow.tracking.client import MlflowClient
+from cd4ml.data_processing.feature_transformer import FeatureTransformer
+from cd4ml.data_processing.file_io import iter_frames, read_columns, read_frame
+from cd4ml.utils.model_cache import ModelCache
+import logging
+
+logger = logging.getLogger(__name__)
+
+_full_refit_every = 7
+_n_estimators_step = 10
+
+
+def get_production_model_version(model_name):
+    """returns the mlflow model version in stage 'Production' of 'model_name', None if there is none"""
+    try:
+        versions = MlflowClient().get_latest_versions(model_name, stages=["Production"])
+    except Exception:
+        return None
+    return versions[0] if versions else None
+
+
+def get_max_measured_at(path, chunksize=1000000):
+    """last timestamp (utc, iso format) of the 'measured_at' column of a data file, read in chunks"""
+    last = None
+    for chunk in iter_frames(path, chunksize, columns=['measured_at']):
+        if len(chunk):
+            chunk_last = pd.to_datetime(chunk['measured_at'], utc=True).max()
+            last = chunk_last if last is None else max(last, chunk_last)
+    return last.isoformat() if last is not None else None
+
+
+def get_new_training_data(raw_file, transformer, after):
+    """
+    Transforms the rows of a raw data file measured after 'after'
+
+    Args:
+        raw_file (str): location of the raw training data
+        transformer (FeatureTransformer): fitted feature transformer
+        after (str): timestamp (iso format) of the last row already trained on
+
+    Returns:
+        Tuple[pd.DataFrame, pd.Series, str]: input features and labels of the new rows
+          and the last timestamp of the new rows ('after' if there are none)
+    """
+    needed = transformer.features + [transformer.label, 'measured_at']
+    df = read_frame(raw_file, columns=[col for col in read_columns(raw_file) if col in needed])
+    measured_at = pd.to_datetime(df['measured_at'], utc=True)
+    is_new = (measured_at > pd.Timestamp(after)).to_numpy()
+
+    x, y = transformer.transform(df[is_new])
+    last = measured_at[is_new].max().isoformat() if is_new.any() else after
+    return x, y, last
+
+
+def continue_training(clf, x, y, n_estimators_step=_n_estimators_step):
+    """
+    Continues training a fitted model on new data: with 'partial_fit' if the estimator
+    supports it, otherwise ensembles grow by 'n_estimators_step' estimators fitted with
+    'warm_start'. Other estimators can't be updated without forgetting their training data.
+
+    Args:
+        clf (sklearn.base.BaseEstimator): the fitted model, updated in place
+        x (pd.DataFrame): input features of the new data
+        y (pd.Series): labels of the new data
+        n_estimators_step (int): number of estimators added to an ensemble
+
+    Returns:
+        bool: False if the model can't be updated (unknown labels or no incremental
+          training supported)
+    """
+    labels = np.unique(y)
+    if hasattr(clf, 'partial_fit'):
+        if not set(labels) <= set(clf.classes_):
+            return False
+        clf.partial_fit(x, y, classes=clf.classes_)
+        return True
+
+    params = clf.get_params()
+    # only ensembles keep what they learned: the old estimators stay, new ones are added.
+    # Warm started classifiers need the same classes as before
+    if 'warm_start' not in params or 'n_estimators' not in params \
+            or not np.array_equal(labels, clf.classes_):
+        return False
+    clf.set_params(n_estimators=params['n_estimators'] + n_estimators_step, warm_start=True)
+    clf.fit(x, y)
+    return True
+
+
+def warm_start_model(model_name, data_files, full_refit_every=_full_refit_every,
+                     n_estimators_step=_n_estimators_step):
+    """
+    Loads the production model and continues training it on the rows of
+    data_files['raw_train_file'] it was not trained on yet
+
+    Args:
+        model_name (str): name of the registered model in mlflow
+        data_files (dict): contains the key 'raw_train_file' and optionally
+          'feature_transformer_file'
+        full_refit_every (int): number of consecutive incremental updates before a full refit
+        n_estimators_step (int): number of estimators added to an ensemble
+
+    Returns:
+        Tuple[Optional[sklearn.base.BaseEstimator], dict]: the updated model (None if a
+          full refit is needed) and the lineage tags of the training run
+    """
+    version = get_production_model_version(model_name)
+    if version is None:
+        logger.info(f"no production model {model_name}, doing a full refit")
+        return None, {"full_refit_reason": "no production model"}
+
+    lineage = {
+        "parent_model_name": model_name,
+        "parent_model_version": version.version,
+        "parent_run_id": version.run_id,
+    }
+    parent_tags = MlflowClient().get_run(version.run_id).data.tags
+    depth = int(parent_tags.get("incremental_depth", 0))
+    after = parent_tags.get("train_max_measured_at")
+    if after is None:
+        return None, dict(lineage, full_refit_reason="parent has no train_max_measured_at")
+    if "shard_key" in parent_tags:
+        return None, dict(lineage, full_refit_reason="parent is a sharded model")
+    if depth + 1 >= full_refit_every:
+        return None, dict(lineage, full_refit_reason=f"{depth} incremental updates since the last full refit")
+
+    transformer_file = data_files.get('feature_transformer_file')
+    if transformer_file is not None and os.path.isfile(transformer_file):
+        transformer = FeatureTransformer.load(transformer_file)
+    else:
+        transformer = FeatureTransformer()
+    x, y, last = get_new_training_data(data_files['raw_train_file'], transformer, after)
+    logger.info(f"continuing training of {model_name} version {version.version} on "
+                f"{len(x)} rows measured after {after}")
+
+    # through the local model cache, so the artifacts are downloaded once and can't be
+    # evicted while they are read; the version is passed so it is not resolved again
+    with ModelCache().local_path(f"models:/{model_name}/{version.version}", version) as local_path:
+        clf = mlflow.sklearn.load_model(local_path)
+    if len(x) and not continue_training(clf, x, y, n_estimators_step):
+        return None, dict(lineage, full_refit_reason="model can't be updated with the new data")
+
+    return clf, dict(lineage, training_mode="incremental", incremental_depth=depth + 1,
+                     delta_n_rows=len(x), train_max_measured_at=last)
@@ -0,0 +1,60 @@
+# Author:      CD4ML Working Group @ D ONE
+# Description: Out-of-core training on the memory-mapped feature store: a model
+#              with 'partial_fit' streams over mini-batches of the store, its
+#              memory use is bounded by the batch size. Fitting other models on
+#              the np.memmap directly is not bounded, sklearn converts the float32
+#              features to an in-memory float64 copy (e.g. lbfgs LogisticRegression).
+# ================================================================================
+
+from sklearn.linear_model import SGDClassifier
+from cd4ml.data_processing.feature_store import build_feature_store, get_batch_rows
+from cd4ml.data_processing.file_io import read_columns
+import logging
+
+logger = logging.getLogger(__name__)
+
+_batch_mb = 64
+_n_epochs = 5
+_max_conversion_rows = 100000
+
+
+def get_streaming_model():
+    """define and return the multi-classification model trained with partial_fit"""
+    return SGDClassifier(loss="modified_huber", alpha=1e-4, random_state=0)
+
+
+def fit_out_of_core(data_files, model, mode="partial_fit", batch_mb=_batch_mb, n_epochs=_n_epochs,
+                    store_dir=None):
+    """
+    Trains a model on the transformed training data without loading it into memory
+
+    Args:
+        data_files (dict): contains the keys 'transformed_x_train_file' and
+          'transformed_y_train_file'
+        model (sklearn.base.BaseEstimator): the unfitted model, it needs 'partial_fit'
+        mode (str): 'partial_fit' streams mini-batches of about 'batch_mb' megabytes over
+          the store for 'n_epochs' epochs
+        batch_mb (float): size of a mini-batch in megabytes
+        n_epochs (int): number of passes over the data in mode 'partial_fit'
+        store_dir (Optional[str]): location of the feature store
+
+    Returns:
+        Tuple[sklearn.base.BaseEstimator, int]: the fitted model and the number of rows
+    """
+    if mode != "partial_fit":
+        raise ValueError(f'mode must be "partial_fit", got "{mode}"')
+    if not hasattr(model, "partial_fit"):
+        raise ValueError(f"{type(model).__name__} does not support partial_fit")
+
+    x_file = data_files['transformed_x_train_file']
+    batch_rows = get_batch_rows(batch_mb, len(read_columns(x_file)))
+    # converting takes a multiple of the memory of a chunk, the chunks are kept smaller
+    store = build_feature_store(x_file, data_files['transformed_y_train_file'], store_dir,
+                                chunksize=min(batch_rows, _max_conversion_rows))
+
+    for epoch in range(n_epochs):
+        for x, y in store.iter_batches(batch_rows, seed=epoch):
+            model.partial_fit(x, y, classes=store.classes)
+        logger.info(f"finished epoch {epoch + 1} of {n_epochs} over {store.n_rows} rows "
+                    f"in batches of {batch_rows} rows")
+    return model, store.n_rows
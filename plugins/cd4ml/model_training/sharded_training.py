@@ -0,0 +1,214 @@
+# Author:      CD4ML Working Group @ D ONE
+# Description: Sharded training: instead of one global model, a model is trained
+#              per turbine (or per group of turbines). The shards are trained in
+#              parallel in a process pool, together with a global fallback model
+#              for turbines without a model of their own. The models are logged as
+#              a single MLflow pyfunc model, 'ShardedModel', which predicts every
+#              row with the model of its turbine (column 'wt_sk').
+# ================================================================================
+
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import cloudpickle
+import numpy as np
+import pandas as pd
+import mlflow
+import mlflow.pyfunc
+from sklearn.base import clone
+from cd4ml.data_processing.feature_transformer import FeatureTransformer
+from cd4ml.data_processing.file_io import read_frame
+import logging
+
+logger = logging.getLogger(__name__)
+
+_shard_key = 'wt_sk'
+_min_shard_rows = 1000
+_sharding_file = 'sharding.json'
+
+# training data of the worker processes, set by '_init_worker'
+_worker_data = {}
+
+
+class ShardedModel(mlflow.pyfunc.PythonModel):
+    """
+    Composite model which predicts every row with the model of its shard
+
+    Args:
+        models (dict): value of the shard key (e.g. a wt_sk) to its fitted model
+        fallback (sklearn.base.BaseEstimator): model of the rows without a model of their
+          own and of inputs without the shard key column
+        features (List[str]): input features of the models
+        shard_key (str): column of the input which selects the model
+    """
+
+    def __init__(self, models, fallback, features, shard_key=_shard_key):
+        self.models = models
+        self.fallback = fallback
+        self.features = features
+        self.shard_key = shard_key
+
+    def predict(self, context, model_input):
+        x = model_input[self.features]
+        if self.shard_key not in model_input.columns or not self.models:
+            return self.fallback.predict(x)
+
+        keys = model_input[self.shard_key].to_numpy()
+        # one predict call per model, all rows without a model of their own go to the fallback
+        routes = {}
+        for key in pd.unique(keys):
+            model = self.models.get(key, self.fallback)
+            routes.setdefault(id(model), (model, []))[1].append(key)
+
+        y_pred = None
+        for model, route_keys in routes.values():
+            rows = np.flatnonzero(np.isin(keys, route_keys))
+            predictions = model.predict(x.iloc[rows])
+            if y_pred is None:
+                y_pred = np.empty(len(x), dtype=predictions.dtype)
+            y_pred[rows] = predictions
+        return y_pred if y_pred is not None else np.empty(0, dtype=np.int64)
+
+
+def get_shard_keys(raw_file, transformer=None, shard_key=_shard_key):
+    """
+    Returns the shard key of every row of the data transformed from a raw data file
+
+    Args:
+        raw_file (str): location of the raw data
+        transformer (Optional[FeatureTransformer]): the transformer of the raw data
+        shard_key (str): the column to return
+
+    Returns:
+        np.ndarray: the shard keys in the order of the transformed rows
+    """
+    transformer = transformer or FeatureTransformer()
+    df = read_frame(raw_file, columns=[shard_key, 'power'])
+    return df[shard_key].to_numpy()[transformer.row_mask(df)]
+
+
+def get_shards(keys, n_shards=None):
+    """
+    Groups the values of the shard key into shards of about the same number of rows
+
+    Args:
+        keys (np.ndarray): shard key of every row
+        n_shards (Optional[int]): number of shards, one per value by default
+
+    Returns:
+        List[list]: the values of every shard
+    """
+    values, counts = np.unique(keys, return_counts=True)
+    if n_shards is None or n_shards >= len(values):
+        return [[value] for value in values.tolist()]
+
+    # the largest values first, always into the smallest shard
+    shards, sizes = [[] for _ in range(n_shards)], np.zeros(n_shards, dtype=np.int64)
+    for i in np.argsort(-counts, kind='stable'):
+        shard = int(np.argmin(sizes))
+        shards[shard].append(values[i].item())
+        sizes[shard] += counts[i]
+    return shards
+
+
+def _init_worker(x, y, keys):
+    """keeps the training data in the worker process, so it is only sent once per worker"""
+    mlflow.autolog(disable=True)
+    _worker_data.update(x=x, y=y, keys=keys)
+
+
+def _fit_shard(model, shard):
+    """fits a copy of 'model' on the rows of the values in 'shard', on all rows if None"""
+    start = time.time()
+    x, y = _worker_data['x'], _worker_data['y']
+    if shard is not None:
+        rows = np.isin(_worker_data['keys'], shard)
+        x, y = x[rows], y[rows]
+    return clone(model).fit(x, y), time.time() - start
+
+
+def train_sharded_model(data_files, model, n_shards=None, n_workers=None,
+                        min_shard_rows=_min_shard_rows, shard_key=_shard_key):
+    """
+    Trains a copy of 'model' per shard and a global fallback model on all rows, in parallel
+
+    Args:
+        data_files (dict): contains the keys 'transformed_x_train_file',
+          'transformed_y_train_file', 'raw_train_file' (for the shard keys) and optionally
+          'feature_transformer_file'
+        model (sklearn.base.BaseEstimator): the unfitted model
+        n_shards (Optional[int]): number of shards, one per turbine by default
+        n_workers (Optional[int]): number of processes, by default one per cpu
+        min_shard_rows (int): shards with fewer rows (or a single label) use the fallback
+        shard_key (str): the column of the raw data the models are selected by
+
+    Returns:
+        Tuple[ShardedModel, dict]: the model and statistics of the training
+    """
+    transformer_file = data_files.get('feature_transformer_file')
+    if transformer_file is not None and os.path.isfile(transformer_file):
+        transformer = FeatureTransformer.load(transformer_file)
+    else:
+        transformer = FeatureTransformer()
+
+    x = read_frame(data_files['transformed_x_train_file'])
+    y = read_frame(data_files['transformed_y_train_file']).iloc[:, 0].to_numpy()
+    keys = get_shard_keys(data_files['raw_train_file'], transformer, shard_key)
+    if len(keys) != len(x):
+        raise ValueError(f"{data_files['raw_train_file']} does not match the transformed training data")
+
+    all_shards, shards = get_shards(keys, n_shards), []
+    for shard in all_shards:
+        labels = y[np.isin(keys, shard)]
+        if len(labels) >= min_shard_rows and len(np.unique(labels)) > 1:
+            shards.append(shard)
+        else:
+            logger.info(f"{shard_key} {shard} has {len(labels)} rows, using the fallback model")
+
+    n_workers = min(n_workers or os.cpu_count() or 1, len(shards) + 1)
+    logger.info(f"training {len(shards)} shards and the fallback model with {n_workers} workers")
+    start = time.time()
+    with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker,
+                             initargs=(x, y, keys)) as pool:
+        # the fallback model trains on all rows, it is started first
+        fallback_future = pool.submit(_fit_shard, model, None)
+        futures = [pool.submit(_fit_shard, model, shard) for shard in shards]
+
+        models, fit_seconds = {}, 0.0
+        for shard, future in zip(shards, futures):
+            shard_model, seconds = future.result()
+            fit_seconds += seconds
+            for value in shard:
+                models[value] = shard_model
+        fallback, fallback_seconds = fallback_future.result()
+
+    stats = {
+        "n_shards": len(shards),
+        "n_fallback_shards": len(all_shards) - len(shards),
+        "shard_fit_seconds": fit_seconds,
+        "fallback_fit_seconds": fallback_seconds,
+        "sharded_training_seconds": time.time() - start,
+    }
+    logger.info(f"trained {len(shards)} shards in {round(stats['sharded_training_seconds'], 3)} "
+                f"seconds, {round(fit_seconds + fallback_seconds, 3)} seconds of fitting")
+    return ShardedModel(models, fallback, list(x.columns), shard_key), stats
+
+
+def log_sharded_model(sharded_model, artifact_path="model"):
+    """
+    Logs a sharded model to the active MLflow run. The model class is pickled by value,
+    so loading it (e.g. in the scoring container) does not need the cd4ml package.
+
+    Args:
+        sharded_model (ShardedModel): the model
+        artifact_path (str): the artifact path of the model in the run
+    """
+    module = sys.modules[__name__]
+    cloudpickle.register_pickle_by_value(module)
+    try:
+        mlflow.pyfunc.log_model(artifact_path, python_model=sharded_model)
+    finally:
+        cloudpickle.unregister_pickle_by_value(module)
+    # tells serving and validation to pass the shard key column to the model
+    mlflow.log_dict({"shard_key": sharded_model.shard_key}, f"{artifact_path}/{_sharding_file}")
@@ -2,19 +2,34 @@
 # Description: Use this script to train a new ML model from scratch. The algorithm
 #              is defined in 'get_model'. The trained model will be tracked in
 #              MLflow and is available for further steps in the pipeline via model 
-#              uri
+#              uri. In incremental mode, the production model continues training
+#              on the new data only (see incremental_training.py), in sharded mode
+#              a model is trained per turbine (see sharded_training.py)
 # ================================================================================
 
 import os
+import tempfile
 import mlflow
+import mlflow.sklearn
 import time
-import pandas as pd
+from cd4ml.data_processing.file_io import read_frame, iter_frames
+from cd4ml.model_training.hyperparameter_search import hyperparameter_search, build_model
+from cd4ml.model_training.incremental_training import warm_start_model, get_max_measured_at
+from cd4ml.model_training.out_of_core_training import fit_out_of_core, get_streaming_model
+from cd4ml.model_training.sharded_training import train_sharded_model, log_sharded_model
+from cd4ml.model_training.compiled_model import compile_model, compiled_file
+from cd4ml.utils.memory import get_peak_rss_mb
+from cd4ml.utils.git_info import get_git_hash
+from cd4ml.utils.mlflow_logging import BufferedLogger
 from sklearn.linear_model import LogisticRegression
 from sklearn.ensemble import GradientBoostingClassifier
 import logging
 
 logger = logging.getLogger(__name__)
 
+# number of training rows the compiled model is checked on
+_compile_check_rows = 10000
+
 
 def _check_keys(dict_, required_keys):
     """checks if a dict contains all expected keys"""
@@ -32,7 +47,9 @@ def get_model():
     return model
     
 
-def train_model(data_files, experiment_name="experiment", **kwargs):
+def train_model(data_files, experiment_name="experiment", search_space=None, n_workers=None,
+                incremental=False, model_name=None, full_refit_every=7, out_of_core=None,
+                batch_mb=64, sharded=False, n_shards=None, **kwargs):
     """
     Loads x_train.csv and y_train.csv from data_dir, trains a model and tracks
     it with MLflow
@@ -41,30 +58,100 @@ def train_model(data_files, experiment_name="experiment", **kwargs):
         data_files (dict): contains the following keys:
           'transformed_x_train_file': location of the training input data
           'transformed_y_train_file': location of the training data labels
+          'feature_transformer_file' (optional): the fitted feature transformer, it is
+            logged with the model so serving can apply the same transformation
+          'raw_train_file' (optional, required if incremental or sharded): the raw training
+            data, its last timestamp is tagged on the run as start of the next increment
         experiment_name (str): name of the MLflow experiment
+        search_space (Optional[List[dict]]): if given, the model is the best candidate of a
+          hyperparameter search over this space (see 'hyperparameter_search') instead of
+          'get_model', every trial is logged as nested run of the training run
+        n_workers (Optional[int]): number of processes of the hyperparameter search or the
+          sharded training
+        incremental (bool): continue training the production model of 'model_name' on the
+          rows of data_files['raw_train_file'] it was not trained on yet, instead of a
+          full refit. The parent model version is tagged on the run
+        model_name (Optional[str]): name of the registered model, required if incremental
+        full_refit_every (int): number of consecutive incremental updates before a full refit
+        out_of_core (Optional[str]): train on a memory-mapped float32 copy of the training
+          data instead of loading it: 'partial_fit' streams mini-batches into the model of
+          'get_streaming_model'
+        batch_mb (float): size of the mini-batches of the out-of-core training in megabytes
+        sharded (bool): train a model of 'get_model' per turbine (and a fallback model on
+          all turbines) in parallel, logged as one model routing by the column 'wt_sk'
+        n_shards (Optional[int]): number of groups of turbines in sharded mode, one model
+          per turbine by default
     """
     required_keys = [
         'transformed_x_train_file',
         'transformed_y_train_file',
     ]
     _check_keys(data_files, required_keys)
+    if out_of_core is not None and search_space is not None:
+        raise ValueError('the hyperparameter search does not support out-of-core training')
+    if sharded:
+        if incremental or out_of_core is not None or search_space is not None:
+            raise ValueError('sharded training does not support incremental, out-of-core '
+                             'training or the hyperparameter search')
+        _check_keys(data_files, ['raw_train_file'])
+    if incremental:
+        _check_keys(data_files, ['raw_train_file'])
+        if model_name is None:
+            raise ValueError('input argument "model_name" is required for incremental training')
     
     start = time.time()
         
     mlflow.set_experiment(experiment_name)
     mlflow.autolog()
     
-    x_train = pd.read_csv(data_files['transformed_x_train_file'])
-    y_train = pd.read_csv(data_files['transformed_y_train_file'])
-    
-    with mlflow.start_run() as active_run:
+    # params, metrics and tags are sent in batches by a background thread, everything
+    # queued is sent before the run ends, also if the training fails
+    with mlflow.start_run() as active_run, BufferedLogger(active_run.info.run_id) as run_logger:
         run_id = active_run.info.run_id
         # add the git commit hash as tag to the experiment run
-        git_hash = os.popen("git rev-parse --verify HEAD").read()[:-2]
-        mlflow.set_tag("git_hash", git_hash)
-        
-        clf = get_model()
-        clf.fit(x_train, y_train)
+        git_hash = get_git_hash()
+        if git_hash is not None:
+            run_logger.set_tag("git_hash", git_hash)
+
+        clf, lineage = None, {}
+        if incremental:
+            clf, lineage = warm_start_model(model_name, data_files, full_refit_every)
+
+        if clf is not None:
+            _log_model(clf, run_logger)
+            run_logger.set_tags(lineage)
+        elif out_of_core is not None:
+            model = get_streaming_model()
+            # autolog would predict on the complete training data
+            mlflow.autolog(disable=True)
+            clf, n_rows = fit_out_of_core(data_files, model, out_of_core, batch_mb)
+            run_logger.log_metric("training_n_rows", n_rows)
+            _log_model(clf, run_logger)
+            run_logger.set_tags(dict(lineage, training_mode="full", incremental_depth=0,
+                                     out_of_core=out_of_core))
+        elif sharded:
+            # autolog would log every model of the shards
+            mlflow.autolog(disable=True)
+            sharded_model, stats = train_sharded_model(data_files, get_model(), n_shards, n_workers)
+            run_logger.log_params(get_model().get_params())
+            run_logger.log_metrics(stats)
+            log_sharded_model(sharded_model)
+            run_logger.set_tags(dict(lineage, training_mode="full", incremental_depth=0,
+                                     shard_key=sharded_model.shard_key))
+        else:
+            clf = _fit_model(data_files, run_logger, search_space, n_workers)
+            run_logger.set_tags(dict(lineage, training_mode="full", incremental_depth=0))
+
+        if lineage.get("training_mode") != "incremental" and 'raw_train_file' in data_files:
+            run_logger.set_tag("train_max_measured_at", get_max_measured_at(data_files['raw_train_file']))
+
+        if 'feature_transformer_file' in data_files:
+            mlflow.log_artifact(data_files['feature_transformer_file'], artifact_path="model")
+
+        if clf is not None:
+            _log_compiled_model(clf, data_files, run_id, run_logger)
+
+        run_logger.log_metric("peak_rss_mb", get_peak_rss_mb())
     
         # return the model uri
         model_uri = mlflow.get_artifact_uri("model")
@@ -72,5 +159,42 @@ def train_model(data_files, experiment_name="experiment", **kwargs):
     logger.info(f"completed script in {round(time.time() - start, 3)} seconds)") 
     
     return run_id, model_uri
+
+
+def _log_model(clf, run_logger):
+    """logs a model that was not trained with autologging"""
+    mlflow.autolog(disable=True)
+    run_logger.log_params(clf.get_params())
+    mlflow.sklearn.log_model(clf, artifact_path="model")
+
+
+def _log_compiled_model(clf, data_files, run_id, run_logger):
+    """logs the numpy predictor of a linear model to model/compiled, serving prefers it"""
+    x_sample = next(iter_frames(data_files['transformed_x_train_file'], _compile_check_rows), None)
+    compiled = compile_model(clf, x_sample, run_id) if x_sample is not None else None
+    if compiled is None:
+        return
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, compiled_file)
+        compiled.save(path)
+        mlflow.log_artifact(path, artifact_path="model/compiled")
+    run_logger.set_tag("compiled_model", compiled_file)
+
+
+def _fit_model(data_files, run_logger, search_space=None, n_workers=None):
+    """fits the model of 'get_model' or the best candidate of a search on all training data"""
+    x_train = read_frame(data_files['transformed_x_train_file'])
+    y_train = read_frame(data_files['transformed_y_train_file'])
+
+    if search_space is not None:
+        estimator, params, trials = hyperparameter_search(
+            x_train, y_train, search_space, n_workers=n_workers, run_logger=run_logger)
+        run_logger.set_tag("search_best_estimator", estimator)
+        run_logger.log_metric("search_n_trials", len(trials))
+        clf = build_model(estimator, params)
+    else:
+        clf = get_model()
+    clf.fit(x_train, y_train)
+    return clf
     
     
\ No newline at end of file
@@ -1,2 +1,3 @@
-from cd4ml.model_validation.validate_model import validate_model
-from cd4ml.model_validation.push_model import push_model 
\ No newline at end of file
+from cd4ml.model_validation.validate_model import validate_model, get_production_version
+from cd4ml.model_validation.push_model import push_model 
+from cd4ml.model_validation.evaluation import ConfusionMatrix, evaluate_files
\ No newline at end of file
@@ -0,0 +1,179 @@
+# Author:      CD4ML Working Group @ D ONE
+# Description: Evaluation of a classifier from its confusion matrix. The matrix
+#              is counted in one vectorized pass over the labels (np.bincount of
+#              the encoded label pairs) and all metrics, macro, micro and per
+#              class, are derived from it. Matrices of chunks of the test data
+#              can be merged, so the evaluation can stream over the data. The
+#              metrics equal sklearn's with zero_division=0.
+# ================================================================================
+
+from itertools import zip_longest
+import numpy as np
+from cd4ml.data_processing.file_io import iter_frames
+import logging
+
+logger = logging.getLogger(__name__)
+
+_max_label_span = 100000
+
+
+class ConfusionMatrix:
+    """
+    Confusion matrix of a classifier, rows are true labels and columns predicted labels
+
+    Args:
+        labels (Optional[array-like]): the labels of the rows and columns, sorted
+        matrix (Optional[np.ndarray]): the counts, shape (n_labels, n_labels)
+    """
+
+    def __init__(self, labels=(), matrix=None):
+        self.labels = np.asarray(labels)
+        n_labels = len(self.labels)
+        self.matrix = np.zeros((n_labels, n_labels), dtype=np.int64) if matrix is None \
+            else np.asarray(matrix, dtype=np.int64)
+
+    @classmethod
+    def from_predictions(cls, y, y_pred):
+        """counts the confusion matrix of true labels 'y' and predictions 'y_pred'"""
+        return cls().update(y, y_pred)
+
+    def _with_labels(self, labels):
+        """the matrix extended to the sorted union of its labels and 'labels'"""
+        union = np.union1d(self.labels, labels) if len(self.labels) else np.unique(labels)
+        if len(union) == len(self.labels):
+            return self.matrix
+        matrix = np.zeros((len(union), len(union)), dtype=np.int64)
+        index = np.searchsorted(union, self.labels)
+        matrix[np.ix_(index, index)] = self.matrix
+        self.labels = union
+        return matrix
+
+    def update(self, y, y_pred):
+        """
+        Adds the counts of a chunk of labels and predictions
+
+        Args:
+            y (array-like): true labels, a single column
+            y_pred (array-like): predicted labels
+
+        Returns:
+            ConfusionMatrix: self
+        """
+        y = np.asarray(y).ravel()
+        y_pred = np.asarray(y_pred).ravel()
+        if len(y) != len(y_pred):
+            raise ValueError(f"got {len(y)} labels but {len(y_pred)} predictions")
+        # both vectors are encoded at once, the pairs are counted by a single bincount
+        chunk_labels, codes = _encode(np.concatenate([y, y_pred]))
+        self.matrix = self._with_labels(chunk_labels)
+        codes = np.searchsorted(self.labels, chunk_labels)[codes]
+        n_labels = len(self.labels)
+        self.matrix += np.bincount(codes[:len(y)] * n_labels + codes[len(y):],
+                                   minlength=n_labels * n_labels).reshape(n_labels, n_labels)
+        return self
+
+    def merge(self, other):
+        """
+        Adds the counts of another confusion matrix, e.g. of another chunk
+
+        Args:
+            other (ConfusionMatrix): the matrix to add
+
+        Returns:
+            ConfusionMatrix: self
+        """
+        self.matrix = self._with_labels(other.labels)
+        index = np.searchsorted(self.labels, other.labels)
+        self.matrix[np.ix_(index, index)] += other.matrix
+        return self
+
+    def metrics(self):
+        """
+        Derives the metrics from the confusion matrix. Undefined ratios (no predictions or
+        no samples of a label) are 0, like sklearn with zero_division=0.
+
+        Returns:
+            dict: 'accuracy', 'n_samples', 'precision', 'recall' and 'f1' with averages
+              'macro', 'micro' and 'weighted', and 'per_class', a dict of label to its
+              'precision', 'recall', 'f1' and 'support'
+        """
+        tp = np.diag(self.matrix).astype(np.float64)
+        support = self.matrix.sum(axis=1)
+        predicted = self.matrix.sum(axis=0)
+        n_samples = int(support.sum())
+
+        precision = _divide(tp, predicted)
+        recall = _divide(tp, support)
+        f1 = _divide(2 * tp, support + predicted)
+        weights = support / n_samples if n_samples else np.zeros(len(support))
+        # with single-label classes, micro precision, recall and f1 equal the accuracy
+        accuracy = float(tp.sum() / n_samples) if n_samples else 0.0
+
+        return {
+            "accuracy": accuracy,
+            "n_samples": n_samples,
+            **{name: {"macro": float(values.mean()) if len(values) else 0.0,
+                      "micro": accuracy,
+                      "weighted": float(values @ weights)}
+               for name, values in [("precision", precision), ("recall", recall), ("f1", f1)]},
+            "per_class": {_to_python(label): {"precision": float(precision[i]),
+                                              "recall": float(recall[i]),
+                                              "f1": float(f1[i]),
+                                              "support": int(support[i])}
+                          for i, label in enumerate(self.labels)},
+        }
+
+    def to_dict(self):
+        """json serializable representation, see 'from_dict'"""
+        return {"labels": [_to_python(label) for label in self.labels], "matrix": self.matrix.tolist()}
+
+    @classmethod
+    def from_dict(cls, dict_):
+        return cls(dict_["labels"], dict_["matrix"])
+
+
+def _encode(values):
+    """sorted unique values and the index of every value in them"""
+    if values.dtype.kind in "iu" and len(values):
+        # integer labels of a small range are encoded without sorting
+        low = values.min()
+        span = int(values.max()) - int(low) + 1
+        if span <= _max_label_span:
+            offsets = values - low
+            present = np.bincount(offsets, minlength=span) > 0
+            return np.flatnonzero(present) + low, (np.cumsum(present) - 1)[offsets]
+    labels, codes = np.unique(values, return_inverse=True)
+    return labels, codes.ravel()
+
+
+def _divide(numerator, denominator):
+    """element-wise ratio, 0 where the denominator is 0"""
+    return np.divide(numerator, denominator, out=np.zeros(len(numerator)), where=denominator > 0)
+
+
+def _to_python(label):
+    """converts a numpy scalar label to the python type"""
+    return label.item() if isinstance(label, np.generic) else label
+
+
+def evaluate_files(predict, x_file, y_file, chunksize=100000):
+    """
+    Evaluates a model on test data that does not fit into memory, chunk by chunk
+
+    Args:
+        predict (Callable): predicts the labels of a chunk of input data
+        x_file (str): location of the test input data
+        y_file (str): location of the test labels
+        chunksize (int): number of rows predicted at once
+
+    Returns:
+        ConfusionMatrix: the confusion matrix of all rows
+    """
+    confusion_matrix = ConfusionMatrix()
+    # zip_longest, so extra rows of either file are not silently dropped
+    for x, y in zip_longest(iter_frames(x_file, chunksize), iter_frames(y_file, chunksize)):
+        if x is None or y is None or len(x) != len(y):
+            raise ValueError(f"{x_file} and {y_file} have a different number of rows")
+        confusion_matrix.update(y, predict(x))
+    logger.info(f"evaluated {confusion_matrix.matrix.sum()} rows of {x_file}")
+    return confusion_matrix
@@ -2,19 +2,29 @@
 # Description: Use this script to validate the model performance on an unseen
 #              test set. If the new model exceeds a certain threshold and 
 #              outperforms the model in production, it will be pushed to 
-#              production
+#              production. Both models are loaded and scored concurrently and the
+#              predictions and metrics of the production model are cached by its
+#              version and the content hash of the test data. The metrics are
+#              derived from one confusion matrix per model (see evaluation.py), the
+#              per-class metrics of the new model are logged to its MLflow run.
 # ================================================================================
 
-from sklearn.metrics import (
-    accuracy_score,
-    precision_score,
-    recall_score,
-    f1_score,
-)
 import os
+import json
+import hashlib
+import time
+from concurrent.futures import ThreadPoolExecutor
+import mlflow.pyfunc
 from mlflow.tracking.client import MlflowClient
-import mlflow
-import pandas as pd
+from mlflow.exceptions import MlflowException
+import numpy as np
+from cd4ml.data_processing.file_io import read_frame
+from cd4ml.utils.fingerprint import file_hash
+from cd4ml.utils.model_cache import ModelCache
+from cd4ml.utils.mlflow_logging import BufferedLogger
+from cd4ml.model_validation.evaluation import ConfusionMatrix
+from cd4ml.data_processing.feature_transformer import FeatureTransformer
+from cd4ml.model_training.sharded_training import get_shard_keys
 import logging
 
 logger = logging.getLogger(__name__)
@@ -24,20 +34,124 @@ _eta = 0.01
 _min_f1_score = 0.4
 
 
-def _get_performance(y, y_pred, model_name, average='macro'):
-    """calculate performance metrics"""
-    accuracy = accuracy_score(y, y_pred)
-    precision = precision_score(y, y_pred, average='macro')
-    recall = recall_score(y, y_pred, average='macro')
-    f1 = f1_score(y, y_pred, average='macro')
-
+def _log_performance(metrics, model_name, average='macro'):
+    """log performance metrics"""
     logger.info(f"***** performance {model_name} *****")
-    logger.info(f'accuracy: {round(accuracy, 3)}')
-    logger.info(f'precision: {round(precision, 3)}')
-    logger.info(f'recall: {round(recall, 3)}')
-    logger.info(f'f1-score: {round(f1, 3)}\n')
+    logger.info(f'accuracy: {round(metrics["accuracy"], 3)}')
+    logger.info(f'precision: {round(metrics["precision"][average], 3)}')
+    logger.info(f'recall: {round(metrics["recall"][average], 3)}')
+    logger.info(f'f1-score: {round(metrics["f1"][average], 3)}')
+    for label, class_metrics in metrics["per_class"].items():
+        logger.info(f'class {label}: ' + ', '.join(
+            f'{name} {round(value, 3)}' for name, value in class_metrics.items()))
+    logger.info('\n')
+
+
+def _get_performance(y, y_pred, model_name):
+    """calculate performance metrics from the confusion matrix"""
+    confusion_matrix = ConfusionMatrix.from_predictions(y, y_pred)
+    _log_performance(confusion_matrix.metrics(), model_name)
+    return confusion_matrix
+
+
+def _log_test_metrics(run_id, metrics):
+    """logs the test metrics, overall and per class, to the MLflow run of a model"""
+    with BufferedLogger(run_id) as run_logger:
+        run_logger.log_metric("test_accuracy", metrics["accuracy"])
+        for name in ["precision", "recall", "f1"]:
+            for average in ["macro", "micro", "weighted"]:
+                run_logger.log_metric(f"test_{name}_{average}", metrics[name][average])
+        for label, class_metrics in metrics["per_class"].items():
+            run_logger.log_metrics({f"test_{name}_class_{label}": value
+                                    for name, value in class_metrics.items()})
+
+
+def _get_cache_files(cache_dir, model, version, data_files):
+    """locations of the cached predictions and metrics of a model version on the test data"""
+    test_hash = hashlib.sha256("".join(
+        file_hash(data_files[key]) for key in ['transformed_x_test_file', 'transformed_y_test_file']
+    ).encode()).hexdigest()
+    name = f"{model}_v{version}_{test_hash[:16]}"
+    return os.path.join(cache_dir, f"{name}.json"), os.path.join(cache_dir, f"{name}.npy")
+
+
+def _load_cached_performance(metrics_file):
+    """loads the cached confusion matrix of the production model, None if there is none"""
+    if not os.path.isfile(metrics_file):
+        return None
+    with open(metrics_file, "r") as f:
+        cached = json.load(f)
+    # entries of earlier versions only contain the averaged metrics
+    if "confusion_matrix" not in cached:
+        return None
+    return ConfusionMatrix.from_dict(cached["confusion_matrix"])
 
-    return accuracy, precision, recall, f1
+
+def _save_cached_performance(metrics_file, predictions_file, confusion_matrix, y_pred):
+    """caches the predictions and the confusion matrix of the production model"""
+    os.makedirs(os.path.dirname(metrics_file), exist_ok=True)
+    np.save(predictions_file, np.asarray(y_pred))
+    with open(metrics_file + ".tmp", "w") as f:
+        json.dump({"confusion_matrix": confusion_matrix.to_dict()}, f)
+    os.replace(metrics_file + ".tmp", metrics_file)
+
+
+def _load_model(model_cache, model_uri, model_version=None):
+    """loads a model through the cache, with the shard key column if it is a sharded model"""
+    start = time.time()
+    # the model is resolved once and can't be evicted while it is read
+    with model_cache.local_path(model_uri, model_version) as local_path:
+        sharding_file = os.path.join(local_path, "sharding.json")
+        shard_key = None
+        if os.path.isfile(sharding_file):
+            with open(sharding_file, "r") as f:
+                shard_key = json.load(f)["shard_key"]
+        model = mlflow.pyfunc.load_model(local_path)
+    logger.info(f"loaded {model_uri} in {round(time.time() - start, 3)} seconds")
+    return model, shard_key
+
+
+def _predict(model_future, x, data_files):
+    """predicts on 'x' with the model loaded by 'model_future'"""
+    model, shard_key = model_future.result()
+    if shard_key is not None:
+        if 'raw_test_file' in data_files:
+            # a sharded model routes the rows by a column of the raw data
+            transformer_file = data_files.get('feature_transformer_file')
+            transformer = FeatureTransformer.load(transformer_file) \
+                if transformer_file is not None and os.path.isfile(transformer_file) else None
+            x = x.assign(**{shard_key: get_shard_keys(data_files['raw_test_file'], transformer, shard_key)})
+        else:
+            logger.warning(f"no raw test data with column {shard_key}, a sharded model only "
+                           f"uses its fallback model")
+    return model.predict(x)
+
+
+def _get_production_model_version(model):
+    """the registered version of 'model' in stage 'Production', None if there is none"""
+    try:
+        versions = MlflowClient().get_latest_versions(model, stages=["Production"])
+    except MlflowException as e:
+        # a model that was never registered has no production version, other errors
+        # (e.g. an unreachable registry) are raised
+        if e.error_code != "RESOURCE_DOES_NOT_EXIST":
+            raise
+        return None
+    return versions[0] if versions else None
+
+
+def get_production_version(model):
+    """
+    Returns the version of the production model
+
+    Args:
+        model (str): name of the registered model in mlflow
+
+    Returns:
+        Optional[str]: version of the model in stage 'Production', None if there is none
+    """
+    model_version = _get_production_model_version(model)
+    return model_version.version if model_version is not None else None
 
 
 def _check_keys(dict_, required_keys):
@@ -47,7 +161,7 @@ def _check_keys(dict_, required_keys):
             raise ValueError(f'input argument "data_files" is missing required key "{key}"')
         
         
-def validate_model(data_files, model="LR", **kwargs):
+def validate_model(data_files, model="LR", cache_dir=None, **kwargs):
     """
     Validate the model by comparing with the performance of the current production model.
     If performance (F1-score) of the new model exceeds a minimum threshold and the 
@@ -57,7 +171,12 @@ def validate_model(data_files, model="LR", **kwargs):
         data_files (dict): contains the following keys:
           'transformed_x_test_file': location of test input data
           'transformed_y_test_file': location of test labels
+          'raw_test_file' (optional): the raw test data, sharded models route by its column
+            'wt_sk'
+          'feature_transformer_file' (optional): the transformer of the raw test data
         model (str): name of the production model in mlflow
+        cache_dir (Optional[str]): location of the cached results of the production model,
+          defaults to 'validation_cache' next to the test data
     """
     required_keys = [
         'transformed_x_test_file',
@@ -71,31 +190,63 @@ def validate_model(data_files, model="LR", **kwargs):
         ValueError(
             "task_instance is required, ensure you are calling this function from an airflow task and after a training run.")
 
-    _, latest_model_uri = task_instance.xcom_pull(task_ids='model_training')
-
-    logger.info(f"Loading trained model {latest_model_uri}")
-    latest_model = mlflow.pyfunc.load_model(latest_model_uri)
+    latest_run_id, latest_model_uri = task_instance.xcom_pull(task_ids='model_training')
 
-    logger.info("Loading test data")
-    x_test = pd.read_csv(data_files['transformed_x_test_file'])
-    y_test = pd.read_csv(data_files['transformed_y_test_file'])
+    cache_dir = cache_dir or os.path.join(
+        os.path.dirname(os.path.abspath(data_files['transformed_x_test_file'])), 'validation_cache')
+    prod_model_version = _get_production_model_version(model)
+    prod_version = prod_model_version.version if prod_model_version is not None else None
+    prod_performance, cache_files = None, None
+    if prod_version is not None:
+        cache_files = _get_cache_files(cache_dir, model, prod_version, data_files)
+        prod_performance = _load_cached_performance(cache_files[0])
+        if prod_performance is not None:
+            logger.info(f"Using cached performance of production model {model} version {prod_version}")
 
-    y_test_pred = latest_model.predict(x_test)
-    _, _, _, f1_new = _get_performance(y_test, y_test_pred, "new model")
-    
-    try:
-        prod_model = mlflow.pyfunc.load_model(
-            model_uri=f"models:/{model}/Production"
-        )
-        logger.info(f"Loaded production model {model}")
-    except:
+    # load and score the new and the production model concurrently, the models are
+    # loaded (through the local model cache) while the test data is read
+    model_cache = ModelCache()
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        logger.info(f"Loading trained model {latest_model_uri}")
+        new_model = pool.submit(_load_model, model_cache, latest_model_uri)
         prod_model = None
+        if prod_version is not None and prod_performance is None:
+            logger.info(f"Loading production model {model} version {prod_version}")
+            prod_model = pool.submit(_load_model, model_cache, f"models:/{model}/{prod_version}",
+                                     prod_model_version)
+
+        logger.info("Loading test data")
+        x_test = read_frame(data_files['transformed_x_test_file'])
+        y_test = read_frame(data_files['transformed_y_test_file'])
+
+        new_future = pool.submit(_predict, new_model, x_test, data_files)
+        prod_future = pool.submit(_predict, prod_model, x_test, data_files) if prod_model is not None else None
+
+        y_test_pred = new_future.result()
+        new_metrics = _get_performance(y_test, y_test_pred, "new model").metrics()
+        f1_new = new_metrics["f1"]["macro"]
+
+        if prod_future is not None:
+            # a production model that can't be loaded or scored fails the validation, it
+            # must not be mistaken for a missing one which any new model would replace
+            try:
+                y_test_pred_old = prod_future.result()
+            except Exception:
+                logger.exception(f"Scoring production model {model} version {prod_version} failed")
+                raise
+            logger.info(f"Loaded production model {model}")
+            prod_performance = _get_performance(y_test, y_test_pred_old, "old model")
+            _save_cached_performance(*cache_files, prod_performance, y_test_pred_old)
+        elif prod_performance is not None:
+            _log_performance(prod_performance.metrics(), "old model (cached)")
+
+    _log_test_metrics(latest_run_id, new_metrics)
+
+    if prod_version is None:
         f1_old = 0
         logger.info("There is no production model yet")
-
-    if prod_model:
-        y_test_pred_old = prod_model.predict(x_test)
-        _, _, _, f1_old = _get_performance(y_test, y_test_pred_old, "old model")
+    else:
+        f1_old = prod_performance.metrics()["f1"]["macro"]
 
     assert max(f1_old, f1_new) >= _min_f1_score, \
         f"F1-score of best model {max(f1_old, f1_new)} below minimum of {_min_f1_score}"
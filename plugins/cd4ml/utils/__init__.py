@@ -0,0 +1,5 @@
+from cd4ml.utils.fingerprint import file_hash, file_fingerprint, chunked_file_hash
+from cd4ml.utils.stage_cache import cached_stage
+from cd4ml.utils.memory import get_peak_rss_mb
+from cd4ml.utils.model_cache import ModelCache
+from cd4ml.utils.git_info import get_git_hash
@@ -0,0 +1,97 @@
+# Author:      CD4ML Working Group @ D ONE
+# Description: Helpers to fingerprint files, e.g. to detect whether a data file
+#              changed since it was last processed.
+# ================================================================================
+
+import os
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+import logging
+
+logger = logging.getLogger(__name__)
+
+_block_size = 1 << 20
+_chunk_size = 64 << 20
+
+
+def file_hash(path, algorithm="sha256", block_size=_block_size):
+    """
+    Computes the content hash of a file, reading it in blocks
+
+    Args:
+        path (str): location of the file
+        algorithm (str): any algorithm supported by hashlib
+        block_size (int): number of bytes read at once
+
+    Returns:
+        str: hex digest of the file content
+    """
+    hash_ = hashlib.new(algorithm)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            hash_.update(block)
+    return hash_.hexdigest()
+
+
+def file_fingerprint(path):
+    """
+    Cheap fingerprint of a file that changes whenever the file is rewritten or appended
+    to, without reading its content
+
+    Args:
+        path (str): location of the file
+
+    Returns:
+        List[int]: size, modification time in ns and inode of the file
+    """
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+
+
+def _chunk_hash(path, offset, length, algorithm, block_size):
+    """hashes 'length' bytes of a file from 'offset' on"""
+    hash_ = hashlib.new(algorithm)
+    with open(path, "rb") as f:
+        f.seek(offset)
+        while length > 0:
+            block = f.read(min(block_size, length))
+            if not block:
+                break
+            hash_.update(block)
+            length -= len(block)
+    return hash_.digest()
+
+
+def chunked_file_hash(path, algorithm="sha256", chunk_size=_chunk_size, n_workers=None,
+                      block_size=_block_size):
+    """
+    Computes a tree hash of a file: the chunks of 'chunk_size' bytes are hashed in
+    parallel threads (hashlib releases the GIL) and the hash of the file is the hash of
+    the chunk digests. The result differs from 'file_hash', but is as well a content hash.
+
+    Args:
+        path (str): location of the file
+        algorithm (str): any algorithm supported by hashlib
+        chunk_size (int): number of bytes hashed by one worker at once
+        n_workers (Optional[int]): number of threads, by default one per cpu
+        block_size (int): number of bytes read at once
+
+    Returns:
+        str: hex digest of the file content
+    """
+    size = os.path.getsize(path)
+    offsets = range(0, max(size, 1), chunk_size)
+    n_workers = n_workers or os.cpu_count() or 1
+
+    if n_workers > 1 and len(offsets) > 1:
+        with ThreadPoolExecutor(max_workers=n_workers) as pool:
+            digests = list(pool.map(
+                lambda offset: _chunk_hash(path, offset, chunk_size, algorithm, block_size), offsets))
+    else:
+        digests = [_chunk_hash(path, offset, chunk_size, algorithm, block_size) for offset in offsets]
+
+    hash_ = hashlib.new(algorithm)
+    hash_.update(f"{size}:{chunk_size}:".encode())
+    for digest in digests:
+        hash_.update(digest)
+    return hash_.hexdigest()
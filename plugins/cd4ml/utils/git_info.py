@@ -0,0 +1,77 @@
+# Author:      CD4ML Working Group @ D ONE
+# Description: Reads the commit of a git repository in process (without running
+#              git), e.g. to tag MLflow runs with the version of the code.
+# ================================================================================
+
+import functools
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def _find_git_dir(path):
+    """the .git directory of the repository containing 'path', None outside of a repository"""
+    path = os.path.abspath(path)
+    while True:
+        git_path = os.path.join(path, ".git")
+        if os.path.isdir(git_path):
+            return git_path
+        if os.path.isfile(git_path):
+            # worktrees and submodules: .git is a file "gitdir: <path>"
+            with open(git_path, "r") as f:
+                content = f.read().strip()
+            if content.startswith("gitdir:"):
+                return os.path.normpath(os.path.join(path, content[len("gitdir:"):].strip()))
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+
+
+def _read_ref(git_dir, ref):
+    """resolves a ref like 'refs/heads/main' from loose or packed refs"""
+    # worktrees keep shared refs in the common directory
+    common_dir = git_dir
+    common_file = os.path.join(git_dir, "commondir")
+    if os.path.isfile(common_file):
+        with open(common_file, "r") as f:
+            common_dir = os.path.normpath(os.path.join(git_dir, f.read().strip()))
+
+    for directory in (git_dir, common_dir):
+        ref_file = os.path.join(directory, ref)
+        if os.path.isfile(ref_file):
+            with open(ref_file, "r") as f:
+                return f.read().strip()
+
+    packed_refs = os.path.join(common_dir, "packed-refs")
+    if os.path.isfile(packed_refs):
+        with open(packed_refs, "r") as f:
+            for line in f:
+                parts = line.strip().split(" ")
+                if len(parts) == 2 and parts[1] == ref:
+                    return parts[0]
+    return None
+
+
+@functools.lru_cache(maxsize=None)
+def get_git_hash(path=None):
+    """
+    Returns the commit checked out in the repository containing 'path'. The result is
+    cached, so it is resolved once per process.
+
+    Args:
+        path (Optional[str]): a location within the repository, defaults to the
+          working directory
+
+    Returns:
+        Optional[str]: the commit hash, None outside of a repository
+    """
+    git_dir = _find_git_dir(path or os.getcwd())
+    if git_dir is None:
+        return None
+    with open(os.path.join(git_dir, "HEAD"), "r") as f:
+        head = f.read().strip()
+    if head.startswith("ref:"):
+        return _read_ref(git_dir, head[len("ref:"):].strip())
+    return head
@@ -0,0 +1,18 @@
+# Author:      CD4ML Working Group @ D ONE
+# Description: Helpers to report the memory use of the current process.
+# ================================================================================
+
+import resource
+import sys
+
+
+def get_peak_rss_mb():
+    """
+    Returns the peak resident set size of the current process
+
+    Returns:
+        float: peak resident set size in megabytes
+    """
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macos
+    return max_rss / 1024 ** 2 if sys.platform == "darwin" else max_rss / 1024
@@ -0,0 +1,188 @@
+# Author:      CD4ML Working Group @ D ONE
+# Description: Buffered, asynchronous logging of params, metrics and tags to
+#              MLflow. Calls only put the values on a queue; a background thread
+#              sends them in 'log_batch' calls, so the caller does not wait for a
+#              round trip to the tracking server per value. Everything queued is
+#              sent when the logger is closed, also if the run failed.
+# ================================================================================
+
+import atexit
+import queue
+import threading
+import time
+from mlflow.entities import Metric, Param, RunTag, RunStatus
+from mlflow.tracking.client import MlflowClient
+import logging
+
+logger = logging.getLogger(__name__)
+
+# limits of a single log_batch request of the tracking server
+_max_metrics = 1000
+_max_params = 100
+_max_tags = 100
+_max_entities = 1000
+
+
+class BufferedLogger:
+    """
+    Queues params, metrics and tags of one or more runs and logs them in batches
+    from a background thread. Use it as context manager or call 'close'.
+
+    Args:
+        run_id (Optional[str]): default run of all calls without 'run_id'
+        client (Optional[MlflowClient]): the tracking client
+        flush_interval (float): maximum number of seconds values are buffered
+
+    Attributes:
+        stats (dict): number of 'batches' and 'entities' sent and the 'send_seconds'
+          spent in the background thread
+    """
+
+    def __init__(self, run_id=None, client=None, flush_interval=1.0):
+        self.run_id = run_id
+        self.client = client or MlflowClient()
+        self.flush_interval = flush_interval
+        self.stats = {"batches": 0, "entities": 0, "send_seconds": 0.0}
+        self._queue = queue.Queue()
+        self._error = None
+        self._closed = False
+        self._thread = threading.Thread(target=self._worker, name="mlflow-logger", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _put(self, run_id, kind, entity):
+        """queues an entity of 'kind' ('metrics', 'params' or 'tags')"""
+        if self._closed:
+            raise RuntimeError("the logger is closed")
+        run_id = run_id or self.run_id
+        if run_id is None:
+            raise ValueError("no run_id given and the logger has no default run")
+        self._queue.put(("log", (run_id, kind, entity)))
+
+    def log_param(self, key, value, run_id=None):
+        self._put(run_id, "params", Param(key, str(value)))
+
+    def log_params(self, params, run_id=None):
+        for key, value in params.items():
+            self.log_param(key, value, run_id)
+
+    def log_metric(self, key, value, step=0, run_id=None):
+        self._put(run_id, "metrics", Metric(key, float(value), int(time.time() * 1000), step))
+
+    def log_metrics(self, metrics, step=0, run_id=None):
+        for key, value in metrics.items():
+            self.log_metric(key, value, step, run_id)
+
+    def set_tag(self, key, value, run_id=None):
+        self._put(run_id, "tags", RunTag(key, str(value)))
+
+    def set_tags(self, tags, run_id=None):
+        for key, value in tags.items():
+            self.set_tag(key, value, run_id)
+
+    def terminate_run(self, run_id, status="FINISHED"):
+        """ends a run after everything queued for it was sent"""
+        self._queue.put(("terminate", (run_id, status)))
+
+    def flush(self):
+        """blocks until everything queued so far was sent, raises the first send error"""
+        if self._thread.is_alive():
+            done = threading.Event()
+            self._queue.put(("flush", done))
+            done.wait()
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def close(self):
+        """sends everything queued and stops the background thread"""
+        if self._closed:
+            return
+        self._closed = True
+        atexit.unregister(self.close)
+        if self._thread.is_alive():
+            self._queue.put(("stop", None))
+            self._thread.join()
+        logger.info(f"mlflow logger sent {self.stats['entities']} values in {self.stats['batches']} "
+                    f"batches, {round(self.stats['send_seconds'], 3)} seconds in the background")
+        if self._error is not None:
+            raise self._error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # on failure, the queued values are sent but a send error does not hide the failure
+        try:
+            self.close()
+        except Exception as e:
+            if exc_type is None:
+                raise
+            logger.warning(f"failed to send mlflow values: {e}")
+
+    def _send(self, run_id, pending):
+        """sends the pending entities of a run in batches within the server limits"""
+        # the last value of a param or tag wins, duplicates fail the request
+        params = list({param.key: param for param in pending["params"]}.values())
+        tags = list({tag.key: tag for tag in pending["tags"]}.values())
+        metrics = pending["metrics"]
+        pending["params"], pending["tags"], pending["metrics"] = [], [], []
+
+        while params or tags or metrics:
+            batch_params, params = params[:_max_params], params[_max_params:]
+            batch_tags, tags = tags[:_max_tags], tags[_max_tags:]
+            n_metrics = min(_max_metrics, _max_entities - len(batch_params) - len(batch_tags))
+            batch_metrics, metrics = metrics[:n_metrics], metrics[n_metrics:]
+
+            start = time.time()
+            try:
+                self.client.log_batch(run_id, metrics=batch_metrics, params=batch_params, tags=batch_tags)
+            except Exception as e:
+                logger.warning(f"failed to log a batch to run {run_id}: {e}")
+                self._error = self._error or e
+            self.stats["send_seconds"] += time.time() - start
+            self.stats["batches"] += 1
+            self.stats["entities"] += len(batch_metrics) + len(batch_params) + len(batch_tags)
+
+    def _worker(self):
+        """collects queued entities and sends them at least every 'flush_interval' seconds"""
+        pending = {}
+        last_send = time.time()
+
+        def send_all():
+            for run_id in list(pending):
+                self._send(run_id, pending.pop(run_id))
+
+        while True:
+            timeout = max(0.0, self.flush_interval - (time.time() - last_send))
+            try:
+                kind, item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                kind, item = None, None
+
+            if kind == "log":
+                run_id, entity_kind, entity = item
+                run_pending = pending.setdefault(run_id, {"metrics": [], "params": [], "tags": []})
+                run_pending[entity_kind].append(entity)
+                if sum(len(entities) for entities in run_pending.values()) >= _max_entities:
+                    self._send(run_id, pending.pop(run_id))
+            elif kind == "terminate":
+                run_id, status = item
+                if run_id in pending:
+                    self._send(run_id, pending.pop(run_id))
+                try:
+                    self.client.set_terminated(run_id, status=RunStatus.to_string(RunStatus.from_string(status)))
+                except Exception as e:
+                    logger.warning(f"failed to terminate run {run_id}: {e}")
+                    self._error = self._error or e
+            elif kind in ("flush", "stop"):
+                send_all()
+                last_send = time.time()
+                if kind == "flush":
+                    item.set()
+                else:
+                    return
+
+            if time.time() - last_send >= self.flush_interval:
+                send_all()
+                last_send = time.time()
@@ -0,0 +1,231 @@
+# Author:      CD4ML Working Group @ D ONE
+# Description: Local on-disk cache of MLflow model artifacts, shared by the
+#              pipeline and the scoring service. A stage like
+#              models:/<name>/Production is resolved to its version and artifact
+#              source with a single registry call (none if the caller already has
+#              the version) and the artifacts of a version (or run) are only
+#              downloaded once. Downloads are atomic and guarded by file locks, so
+#              concurrent processes can use the same cache. The least recently
+#              used models are evicted above a size limit. The module only needs
+#              mlflow at runtime, it is copied into the scoring image (see cd_dag).
+# ================================================================================
+
+import fcntl
+import hashlib
+import os
+import re
+import shutil
+import time
+from contextlib import contextmanager
+import logging
+
+logger = logging.getLogger(__name__)
+
+_default_cache_dir = os.path.join(os.path.expanduser("~"), ".cache", "cd4ml", "models")
+_default_max_bytes = 5 * 1024 ** 3
+_models_uri = re.compile(r"^models:/(?P<name>[^/]+)/(?P<ref>[^/]+)/?$")
+_runs_uri = re.compile(r"^runs:/(?P<run_id>[^/]+)/(?P<path>.+?)/?$")
+
+
+@contextmanager
+def _locked(lock_file, shared=False, blocking=True):
+    """holds a shared or exclusive lock on 'lock_file', yields False if not blocking and busy"""
+    with open(lock_file, "a") as f:
+        flags = (fcntl.LOCK_SH if shared else fcntl.LOCK_EX) | (0 if blocking else fcntl.LOCK_NB)
+        try:
+            fcntl.flock(f, flags)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _dir_size(path):
+    """total size of the files below 'path'"""
+    return sum(os.path.getsize(os.path.join(dirpath, file))
+               for dirpath, _, files in os.walk(path) for file in files)
+
+
+class ModelCache:
+    """
+    Cache of model artifacts keyed by registered model name, version and run id
+
+    Args:
+        cache_dir (Optional[str]): location of the cache, defaults to the environment
+          variable MODEL_CACHE_DIR or ~/.cache/cd4ml/models
+        max_bytes (int): the least recently used models are evicted above this size
+
+    Attributes:
+        stats (dict): number of 'hits', 'misses' and 'evictions' and the total seconds
+          spent to 'resolve', 'download' and 'load' models
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=_default_max_bytes):
+        self.cache_dir = cache_dir or os.environ.get("MODEL_CACHE_DIR", _default_cache_dir)
+        self.max_bytes = max_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0,
+                      "resolve": 0.0, "download": 0.0, "load": 0.0}
+
+    def resolve(self, model_uri, model_version=None):
+        """
+        Resolves a model uri to a cache key and the uri of its artifacts
+
+        Args:
+            model_uri (str): 'models:/<name>/<stage or version>', 'runs:/<run_id>/<path>'
+              or any artifact uri
+            model_version (Optional[ModelVersion]): the registered version 'model_uri' refers
+              to, if the caller already fetched it from the registry
+
+        Returns:
+            Tuple[str, str]: the cache key and the uri to download the artifacts from
+        """
+        start = time.time()
+        match = _models_uri.match(model_uri)
+        if match is not None:
+            name, ref = match.group("name"), match.group("ref")
+            if model_version is None:
+                from mlflow.tracking.client import MlflowClient
+
+                client = MlflowClient()
+                if ref.isdigit():
+                    model_version = client.get_model_version(name, ref)
+                else:
+                    versions = client.get_latest_versions(name, stages=[ref])
+                    if not versions:
+                        raise ValueError(f"model {name} has no version in stage {ref}")
+                    model_version = versions[0]
+            key = f"{name}-v{model_version.version}-{model_version.run_id}"
+            # the source of a version is where its artifacts are, downloading the
+            # models:/ uri instead would ask the registry again
+            source = model_version.source or f"models:/{name}/{model_version.version}"
+        else:
+            match = _runs_uri.match(model_uri)
+            if match is not None:
+                path = match.group("path").replace("/", "_")
+                key = f"run-{match.group('run_id')}-{path}"
+            else:
+                # artifacts of a run never change, the uri identifies them
+                key = f"uri-{hashlib.sha256(model_uri.encode()).hexdigest()[:16]}"
+            source = model_uri
+        self.stats["resolve"] += time.time() - start
+        return key, source
+
+    def _entry_dir(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def get_local_path(self, model_uri, model_version=None):
+        """
+        Returns the local copy of the artifacts of a model, downloads them on a miss. The
+        copy may be evicted by another process, use 'local_path' to read it.
+
+        Args:
+            model_uri (str): see 'resolve'
+            model_version (Optional[ModelVersion]): see 'resolve'
+
+        Returns:
+            str: location of the model directory
+        """
+        key, source = self.resolve(model_uri, model_version)
+        return self._fetch(model_uri, key, source)
+
+    def _fetch(self, model_uri, key, source):
+        """downloads the artifacts of a resolved model unless they are cached"""
+        entry_dir = self._entry_dir(key)
+
+        with _locked(entry_dir + ".lock"):
+            if os.path.isdir(entry_dir):
+                self.stats["hits"] += 1
+                logger.info(f"model cache hit for {model_uri} ({key})")
+            else:
+                from mlflow.tracking.artifact_utils import _download_artifact_from_uri
+
+                self.stats["misses"] += 1
+                start = time.time()
+                tmp_dir = entry_dir + ".tmp"
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+                os.makedirs(tmp_dir)
+                local_path = _download_artifact_from_uri(source, output_path=tmp_dir)
+                # readers only ever see complete downloads
+                os.replace(local_path, entry_dir)
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+                duration = time.time() - start
+                self.stats["download"] += duration
+                logger.info(f"model cache miss for {model_uri} ({key}), downloaded in "
+                            f"{round(duration, 3)} seconds")
+            # the modification time of the entry is its last use
+            os.utime(entry_dir)
+
+        self.evict(keep=key)
+        return entry_dir
+
+    @contextmanager
+    def local_path(self, model_uri, model_version=None):
+        """
+        Yields the local copy of the artifacts of a model, downloads them on a miss. A
+        shared lock keeps the copy from being evicted until the block is left.
+
+        Args:
+            model_uri (str): see 'resolve'
+            model_version (Optional[ModelVersion]): see 'resolve'
+
+        Yields:
+            str: location of the model directory
+        """
+        key, source = self.resolve(model_uri, model_version)
+        while True:
+            local_path = self._fetch(model_uri, key, source)
+            with _locked(local_path + ".lock", shared=True):
+                # another process may have evicted it in between
+                if os.path.isdir(local_path):
+                    yield local_path
+                    return
+
+    def load_model(self, model_uri, model_version=None):
+        """
+        Loads a pyfunc model through the cache
+
+        Args:
+            model_uri (str): see 'resolve'
+            model_version (Optional[ModelVersion]): see 'resolve'
+
+        Returns:
+            mlflow.pyfunc.PyFuncModel: the loaded model
+        """
+        import mlflow.pyfunc
+
+        start = time.time()
+        with self.local_path(model_uri, model_version) as local_path:
+            model = mlflow.pyfunc.load_model(local_path)
+        duration = time.time() - start
+        self.stats["load"] += duration
+        stats = {name: round(value, 3) for name, value in self.stats.items()}
+        logger.info(f"loaded {model_uri} in {round(duration, 3)} seconds, cache stats: {stats}")
+        return model
+
+    def evict(self, keep=None):
+        """removes the least recently used models until the cache fits into max_bytes"""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            path = self._entry_dir(name)
+            if name != keep and os.path.isdir(path) and not name.endswith(".tmp"):
+                entries.append((os.path.getmtime(path), name, _dir_size(path)))
+        total = sum(size for _, _, size in entries)
+        if keep is not None and os.path.isdir(self._entry_dir(keep)):
+            total += _dir_size(self._entry_dir(keep))
+
+        for _, name, size in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            path = self._entry_dir(name)
+            # entries that are being read or downloaded are skipped
+            with _locked(path + ".lock", blocking=False) as acquired:
+                if not acquired:
+                    continue
+                shutil.rmtree(path, ignore_errors=True)
+            total -= size
+            self.stats["evictions"] += 1
+            logger.info(f"evicted {name} from the model cache")
@@ -0,0 +1,211 @@
+# Author:      CD4ML Working Group @ D ONE
+# Description: Memoization of pipeline stages. A stage is fingerprinted by the
+#              content hashes of its input files, the values of its parameters
+#              and optional upstream XCom values. Its output files and return
+#              value are stored in a local content-addressed cache, so a stage
+#              whose inputs did not change is skipped and its outputs restored.
+# ================================================================================
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import functools
+from cd4ml.utils.fingerprint import file_hash
+import logging
+
+logger = logging.getLogger(__name__)
+
+_cache_version = 1
+_default_max_bytes = 2 * 1024 ** 3
+
+
+def _atomic_write_json(path, obj):
+    """writes a json file atomically"""
+    with open(path + ".tmp", "w") as f:
+        json.dump(obj, f, indent=4, default=str)
+    os.replace(path + ".tmp", path)
+
+
+def _read_json(path, default=None):
+    """reads a json file, returns 'default' if it does not exist"""
+    if not os.path.isfile(path):
+        return default
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+class StageCache:
+    """
+    Local content-addressed store of stage outputs with size based LRU eviction.
+
+    Layout of 'cache_dir':
+      objects/<hash>: content of every cached output file
+      entries/<key>.json: outputs, return value and run time of a stage execution
+      file_hashes.json: content hashes by (size, mtime, inode) to avoid rehashing
+
+    Args:
+        cache_dir (str): location of the cache
+        max_bytes (int): the least recently used entries are evicted above this size
+    """
+
+    def __init__(self, cache_dir, max_bytes=_default_max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.objects_dir = os.path.join(cache_dir, "objects")
+        self.entries_dir = os.path.join(cache_dir, "entries")
+        os.makedirs(self.objects_dir, exist_ok=True)
+        os.makedirs(self.entries_dir, exist_ok=True)
+        self._hashes_file = os.path.join(cache_dir, "file_hashes.json")
+        self._hashes = _read_json(self._hashes_file, {})
+
+    def hash_file(self, path):
+        """content hash of a file, reused while its size, mtime and inode are unchanged"""
+        if not os.path.isfile(path):
+            return None
+        stat = os.stat(path)
+        fingerprint = [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+        known = self._hashes.get(path)
+        if known is not None and known["fingerprint"] == fingerprint:
+            return known["hash"]
+        content_hash = file_hash(path)
+        self._hashes[path] = {"fingerprint": fingerprint, "hash": content_hash}
+        _atomic_write_json(self._hashes_file, self._hashes)
+        return content_hash
+
+    def _entry_file(self, key):
+        return os.path.join(self.entries_dir, f"{key}.json")
+
+    def _object_file(self, content_hash):
+        return os.path.join(self.objects_dir, content_hash)
+
+    def get(self, key):
+        """returns the entry of 'key' if all its outputs are still cached, else None"""
+        entry = _read_json(self._entry_file(key))
+        if entry is None:
+            return None
+        if not all(os.path.isfile(self._object_file(h)) for h in entry["outputs"].values()):
+            return None
+        entry["last_used"] = time.time()
+        _atomic_write_json(self._entry_file(key), entry)
+        return entry
+
+    def restore(self, entry):
+        """copies the cached outputs of an entry to their locations"""
+        for path, content_hash in entry["outputs"].items():
+            if self.hash_file(path) == content_hash:
+                continue
+            tmp_file = path + ".tmp"
+            shutil.copyfile(self._object_file(content_hash), tmp_file)
+            os.replace(tmp_file, path)
+
+    def put(self, key, output_paths, return_value, duration):
+        """stores the outputs of a stage execution under 'key'"""
+        outputs = {}
+        for path in output_paths:
+            content_hash = self.hash_file(path)
+            if content_hash is None:
+                continue
+            object_file = self._object_file(content_hash)
+            if not os.path.isfile(object_file):
+                shutil.copyfile(path, object_file + ".tmp")
+                os.replace(object_file + ".tmp", object_file)
+            outputs[path] = content_hash
+
+        _atomic_write_json(self._entry_file(key), {
+            "outputs": outputs,
+            "return_value": return_value,
+            "is_tuple": isinstance(return_value, tuple),
+            "duration": duration,
+            "last_used": time.time(),
+        })
+        self.evict()
+
+    def evict(self):
+        """removes the least recently used entries until the cache fits into max_bytes"""
+        entries = []
+        for name in os.listdir(self.entries_dir):
+            if name.endswith(".json"):
+                entries.append((name, _read_json(os.path.join(self.entries_dir, name))))
+        entries.sort(key=lambda item: item[1]["last_used"])
+
+        def object_sizes():
+            return {name: os.path.getsize(os.path.join(self.objects_dir, name))
+                    for name in os.listdir(self.objects_dir) if not name.endswith(".tmp")}
+
+        sizes = object_sizes()
+        while entries and sum(sizes.values()) > self.max_bytes:
+            name, _ = entries.pop(0)
+            os.remove(os.path.join(self.entries_dir, name))
+            referenced = {h for _, entry in entries for h in entry["outputs"].values()}
+            for content_hash in set(sizes) - referenced:
+                os.remove(self._object_file(content_hash))
+                sizes.pop(content_hash)
+            logger.info(f"evicted stage cache entry {name}")
+
+
+def cached_stage(func, cache_dir, inputs=(), outputs=(), input_paths=(), output_paths=(),
+                 params=(), xcom_task_ids=(), extra=None, max_bytes=_default_max_bytes):
+    """
+    Wraps a pipeline stage (e.g. 'split_train_test') so it is skipped when its inputs did
+    not change since a cached execution. On a hit, the cached output files are restored
+    and the cached return value (e.g. the (run_id, model_uri) of 'train_model') is
+    returned, so downstream tasks see the same XCom values.
+
+    Args:
+        func (Callable): the stage, called with keyword arguments
+        cache_dir (str): location of the cache
+        inputs (List[str]): keys of kwargs['data_files'] of the input files
+        outputs (List[str]): keys of kwargs['data_files'] of the output files
+        input_paths (List[str]): further input files, a missing file is an input as well
+        output_paths (List[str]): further output files
+        params (List[str]): names of the keyword arguments that change the result
+        xcom_task_ids (List[str]): upstream tasks whose return values are inputs
+        extra (Optional[Callable]): returns further json serializable inputs given the
+          keyword arguments, e.g. the hyperparameters of the model
+        max_bytes (int): size limit of the cache
+
+    Returns:
+        Callable: the cached stage
+    """
+    @functools.wraps(func)
+    def wrapper(**kwargs):
+        start = time.time()
+        cache = StageCache(cache_dir, max_bytes)
+        data_files = kwargs.get("data_files", {})
+
+        fingerprint = {
+            "version": _cache_version,
+            "stage": f"{func.__module__}.{func.__qualname__}",
+            "inputs": {path: cache.hash_file(path)
+                       for path in [data_files[name] for name in inputs] + list(input_paths)},
+            "params": {name: kwargs.get(name) for name in params},
+        }
+        if xcom_task_ids:
+            task_instance = kwargs["task_instance"]
+            fingerprint["xcom"] = {task_id: task_instance.xcom_pull(task_ids=task_id)
+                                   for task_id in xcom_task_ids}
+        if extra is not None:
+            fingerprint["extra"] = extra(kwargs)
+        key = hashlib.sha256(json.dumps(fingerprint, sort_keys=True, default=str).encode()).hexdigest()
+
+        stage_output_paths = [data_files[name] for name in outputs] + list(output_paths)
+        entry = cache.get(key)
+        if entry is not None:
+            cache.restore(entry)
+            duration = time.time() - start
+            logger.info(f"stage cache hit for {func.__name__} ({key[:12]}): restored "
+                        f"{len(entry['outputs'])} outputs in {round(duration, 3)} seconds, "
+                        f"saved {round(max(entry['duration'] - duration, 0), 3)} seconds")
+            return_value = entry["return_value"]
+            return tuple(return_value) if entry["is_tuple"] else return_value
+
+        logger.info(f"stage cache miss for {func.__name__} ({key[:12]})")
+        return_value = func(**kwargs)
+        duration = time.time() - start
+        cache.put(key, stage_output_paths, return_value, duration)
+        logger.info(f"ran {func.__name__} in {round(duration, 3)} seconds and cached its outputs")
+        return return_value
+
+    return wrapper
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the cd4ml package lives in the airflow plugins folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "plugins"))
@@ -0,0 +1,55 @@
+import os
+import pandas as pd
+import pytest
+from cd4ml.data_processing.disagregate_data import PartitionWriter
+
+
+def _frame(timestamps):
+    return pd.DataFrame({"measured_at": timestamps, "value": range(len(timestamps))})
+
+
+def _write(folder, chunks, **kwargs):
+    writer = PartitionWriter(str(folder), **kwargs)
+    try:
+        for df in chunks:
+            writer.write(df, pd.to_datetime(df["measured_at"], utc=True))
+    finally:
+        writer.close()
+    return writer
+
+
+@pytest.mark.parametrize("n_workers", [1, 4])
+def test_hour_partitions_sharing_a_file_keep_all_rows(tmp_path, n_workers):
+    # day 1 hour 10 and day 11 hour 0 are both written to 2020/1/110.csv
+    df = _frame(["2020-01-01 10:00:00", "2020-01-01 10:30:00", "2020-01-11 00:00:00",
+                 "2020-01-11 00:30:00", "2020-01-02 05:00:00"])
+    _write(tmp_path, [df], granularity="hour", n_workers=n_workers)
+
+    shared = pd.read_csv(os.path.join(tmp_path, "2020", "1", "110.csv"))
+    assert sorted(shared["value"]) == [0, 1, 2, 3]
+    assert len(pd.read_csv(os.path.join(tmp_path, "2020", "1", "25.csv"))) == 1
+
+
+def test_hour_partitions_sharing_a_file_across_chunks(tmp_path):
+    chunks = [_frame(["2020-01-01 10:00:00"]), _frame(["2020-01-11 00:00:00"])]
+    _write(tmp_path, chunks, granularity="hour")
+
+    assert len(pd.read_csv(os.path.join(tmp_path, "2020", "1", "110.csv"))) == 2
+
+
+def test_parquet_partitions_are_closed_and_rewritten_with_late_rows(tmp_path):
+    pytest.importorskip("pyarrow")
+    chunks = [_frame(["2020-01-01 10:00:00", "2020-01-02 10:00:00"]),
+              _frame(["2020-01-02 11:00:00", "2020-01-03 10:00:00"]),
+              _frame(["2020-01-01 12:00:00"])]
+    writer = PartitionWriter(str(tmp_path), granularity="day", output_format="parquet")
+    for df in chunks[:2]:
+        writer.write(df, pd.to_datetime(df["measured_at"], utc=True))
+    # day 1 has no rows in the second chunk, its file is closed
+    assert sorted(os.path.basename(path) for path in writer._parquet_writers) == ["2.parquet", "3.parquet"]
+    writer.write(chunks[2], pd.to_datetime(chunks[2]["measured_at"], utc=True))
+    writer.close()
+
+    day1 = pd.read_parquet(os.path.join(tmp_path, "2020", "1", "1.parquet"))
+    assert len(day1) == 2
+    assert len(pd.read_parquet(os.path.join(tmp_path, "2020", "1", "2.parquet"))) == 2
@@ -0,0 +1,33 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip("mlflow")
+
+from cd4ml.model_validation.evaluation import evaluate_files
+
+
+def _write(tmp_path, n_x, n_y):
+    x_file, y_file = os.path.join(tmp_path, "x.csv"), os.path.join(tmp_path, "y.csv")
+    pd.DataFrame({"a": range(n_x)}).to_csv(x_file, index=False)
+    pd.DataFrame({"label": [i % 2 for i in range(n_y)]}).to_csv(y_file, index=False)
+    return x_file, y_file
+
+
+def _predict(x):
+    return x["a"].to_numpy() % 2
+
+
+@pytest.mark.parametrize("n_x, n_y", [(4, 6), (6, 4), (4, 5)])
+def test_files_with_a_different_number_of_rows_are_rejected(tmp_path, n_x, n_y):
+    x_file, y_file = _write(tmp_path, n_x, n_y)
+    with pytest.raises(ValueError, match="different number of rows"):
+        evaluate_files(_predict, x_file, y_file, chunksize=2)
+
+
+def test_every_row_is_counted(tmp_path):
+    x_file, y_file = _write(tmp_path, 5, 5)
+    confusion_matrix = evaluate_files(_predict, x_file, y_file, chunksize=2)
+    assert confusion_matrix.matrix.sum() == 5
+    assert np.trace(confusion_matrix.matrix) == 5
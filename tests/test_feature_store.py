@@ -0,0 +1,24 @@
+import os
+import pandas as pd
+import pytest
+from cd4ml.data_processing.feature_store import build_feature_store
+
+
+def test_labels_with_extra_rows_are_rejected(tmp_path):
+    x_file, y_file = os.path.join(tmp_path, "x.csv"), os.path.join(tmp_path, "y.csv")
+    pd.DataFrame({"a": range(4), "b": range(4)}).to_csv(x_file, index=False)
+    # a whole extra chunk of labels
+    pd.DataFrame({"label": [0, 1] * 3}).to_csv(y_file, index=False)
+
+    with pytest.raises(ValueError, match="different number of rows"):
+        build_feature_store(x_file, y_file, os.path.join(tmp_path, "store"), chunksize=2)
+
+
+def test_store_has_every_row(tmp_path):
+    x_file, y_file = os.path.join(tmp_path, "x.csv"), os.path.join(tmp_path, "y.csv")
+    pd.DataFrame({"a": range(5), "b": range(5)}).to_csv(x_file, index=False)
+    pd.DataFrame({"label": [0, 1, 0, 1, 0]}).to_csv(y_file, index=False)
+
+    store = build_feature_store(x_file, y_file, os.path.join(tmp_path, "store"), chunksize=2)
+    assert store.n_rows == 5
+    assert store.x.shape == (5, 2)
@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("mlflow")
+
+from sklearn.ensemble import GradientBoostingClassifier
+from sklearn.linear_model import LogisticRegression, SGDClassifier
+from cd4ml.model_training.incremental_training import continue_training
+
+
+def _data(seed, n=200):
+    rng = np.random.default_rng(seed)
+    x = rng.normal(size=(n, 3))
+    return x, (x[:, 0] > 0).astype(int)
+
+
+def test_full_batch_estimators_are_not_warm_started():
+    clf = LogisticRegression().fit(*_data(0))
+    coef = clf.coef_.copy()
+    assert not continue_training(clf, *_data(1))
+    np.testing.assert_array_equal(clf.coef_, coef)
+
+
+def test_ensembles_grow_and_partial_fit_updates():
+    ensemble = GradientBoostingClassifier(n_estimators=5).fit(*_data(0))
+    assert continue_training(ensemble, *_data(1), n_estimators_step=3)
+    assert len(ensemble.estimators_) == 8
+
+    sgd = SGDClassifier().fit(*_data(0))
+    assert continue_training(sgd, *_data(1))
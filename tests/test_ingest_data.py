@@ -0,0 +1,48 @@
+import os
+import pandas as pd
+from cd4ml.data_processing.ingest_data import ingest_data
+
+
+def _write_partition(folder, day, **columns):
+    path = os.path.join(folder, "2020", "1", f"{day}.csv")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    pd.DataFrame(dict({"measured_at": [f"2020-01-{day:02d} 10:00:00"], "wt_sk": [1]}, **columns)) \
+        .to_csv(path, index=False)
+
+
+def _ingest(tmp_path):
+    raw_data_file = os.path.join(tmp_path, "raw", "raw.csv")
+    ingest_data(os.path.join(tmp_path, "batch"), {"raw_data_file": raw_data_file}, incremental=True)
+    return pd.read_csv(raw_data_file).sort_values("measured_at", ignore_index=True)
+
+
+def test_partition_with_an_extra_column_rebuilds_the_raw_data(tmp_path):
+    folder = os.path.join(tmp_path, "batch")
+    _write_partition(folder, 1, power=[1.0])
+    _ingest(tmp_path)
+
+    _write_partition(folder, 2, power=[2.0], cosphi=[0.5])
+    df = _ingest(tmp_path)
+    assert list(df["power"]) == [1.0, 2.0]
+    assert df["cosphi"].isna().tolist() == [True, False]
+
+
+def test_partition_with_a_missing_column_is_appended(tmp_path):
+    folder = os.path.join(tmp_path, "batch")
+    _write_partition(folder, 1, power=[1.0], cosphi=[0.5])
+    _ingest(tmp_path)
+
+    _write_partition(folder, 2, power=[2.0])
+    df = _ingest(tmp_path)
+    assert list(df.columns) == ["measured_at", "wt_sk", "power", "cosphi"]
+    assert list(df["power"]) == [1.0, 2.0]
+    assert df["cosphi"].isna().tolist() == [False, True]
+
+
+def test_first_ingestion_has_the_columns_of_all_partitions(tmp_path):
+    folder = os.path.join(tmp_path, "batch")
+    _write_partition(folder, 1, power=[1.0])
+    _write_partition(folder, 2, cosphi=[0.5])
+    df = _ingest(tmp_path)
+    assert len(df) == 2
+    assert set(df.columns) == {"measured_at", "wt_sk", "power", "cosphi"}
@@ -0,0 +1,36 @@
+import os
+import shutil
+import pandas as pd
+from cd4ml.data_processing.partition_catalog import query_partitions, update_catalog
+
+
+def _write_partition(folder, day):
+    path = os.path.join(folder, "2020", "1", f"{day}.csv")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    pd.DataFrame({"measured_at": [f"2020-01-{day:02d} 10:00:00"], "wt_sk": [1], "power": [1.0]}) \
+        .to_csv(path, index=False)
+    return path
+
+
+def test_partitions_written_with_update_catalog_are_found(tmp_path):
+    folder = os.path.join(tmp_path, "batch")
+    first = _write_partition(folder, 1)
+    assert query_partitions(folder) == [first]
+
+    second = _write_partition(folder, 2)
+    update_catalog(folder, [second])
+    assert query_partitions(folder) == [first, second]
+
+
+def test_partitions_copied_into_the_folder_are_found_after_a_refresh(tmp_path):
+    folder = os.path.join(tmp_path, "batch")
+    first = _write_partition(folder, 1)
+    assert query_partitions(folder) == [first]
+
+    # the folder is not walked again unless a refresh is requested
+    second = _write_partition(folder, 2)
+    assert query_partitions(folder) == [first]
+    assert query_partitions(folder, refresh=True) == [first, second]
+
+    shutil.rmtree(os.path.dirname(first))
+    assert query_partitions(folder, refresh=True) == []